@@ -0,0 +1,100 @@
+"""
+Compare the CPU inference backends of DOLPHIN against the fp32 reference
+
+Lays out a fixture set once with the fp32 model, then decodes the same text/table crops
+with every requested backend (config model.cpu_backend) on CPU. Reports wall time,
+generated tokens and tokens/sec per backend, and how close each backend's text is to the
+fp32 output (exact matches and mean character similarity).
+
+Usage:
+    python benchmark_cpu_backend.py --input_path ./demo/page_imgs --backends fp32 int8 int8_full
+"""
+
+import argparse
+import difflib
+import os
+import time
+
+import torch
+from omegaconf import OmegaConf
+
+from benchmark_length_bucketing import (
+    collect_elements,
+    count_generated_tokens,
+    load_fixture_pages,
+)
+from chat import CPU_BACKENDS, DOLPHIN
+
+
+def load_model(config_path, cpu_backend, num_threads):
+    """DOLPHIN on CPU with the given backend"""
+    config = OmegaConf.load(config_path)
+    config.model.cpu_backend = cpu_backend
+    config.model.cpu_threads = num_threads
+    return DOLPHIN(config)
+
+
+def run(model, elements, max_batch_size):
+    prompts = [elem["prompt"] for elem in elements]
+    crops = [elem["crop"] for elem in elements]
+    labels = [elem["label"] for elem in elements]
+
+    start = time.perf_counter()
+    output = model.chat(prompts, crops, max_batch_size=max_batch_size, labels=labels, return_raw=True)
+    elapsed = time.perf_counter() - start
+    tokens = count_generated_tokens(model, output["sequences"])
+    return elapsed, tokens, output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Dolphin CPU backends against the fp32 reference")
+    parser.add_argument("--config", default="./config/Dolphin.yaml", help="Path to configuration file")
+    parser.add_argument("--input_path", type=str, default="./demo/page_imgs", help="Fixture image/PDF or directory")
+    parser.add_argument("--max_pages", type=int, default=5, help="Maximum number of fixture pages")
+    parser.add_argument("--max_batch_size", type=int, default=4, help="Decoding batch size")
+    parser.add_argument("--threads", type=int, default=None, help="Torch CPU threads (default: torch default)")
+    parser.add_argument(
+        "--backends", nargs="+", choices=CPU_BACKENDS, default=list(CPU_BACKENDS), help="Backends to compare"
+    )
+    parser.add_argument("--save_dir", type=str, default="./bench_results", help="Directory for figure crops")
+    args = parser.parse_args()
+
+    if torch.cuda.is_available():
+        print("Warning: a GPU is available, so DOLPHIN ignores cpu_backend; hide it with CUDA_VISIBLE_DEVICES=")
+
+    os.makedirs(os.path.join(args.save_dir, "markdown", "figures"), exist_ok=True)
+    pages = load_fixture_pages(args.input_path, args.max_pages)
+    reference = load_model(args.config, "fp32", args.threads)
+    elements = collect_elements(reference, pages, args.save_dir)
+    print(f"Fixture: {len(pages)} pages, {len(elements)} text/table elements")
+
+    reference_texts = None
+    results = {}
+    for cpu_backend in ["fp32"] + [backend for backend in args.backends if backend != "fp32"]:
+        model = reference if cpu_backend == "fp32" else load_model(args.config, cpu_backend, args.threads)
+
+        # Warm up kernels and allocator before timing
+        run(model, elements[: args.max_batch_size], args.max_batch_size)
+        elapsed, tokens, output = run(model, elements, args.max_batch_size)
+        texts = output["repetitions"]
+        if reference_texts is None:
+            reference_texts = texts
+
+        exact = sum(text == ref for text, ref in zip(texts, reference_texts))
+        similarity = sum(
+            difflib.SequenceMatcher(None, text, ref, autojunk=False).ratio()
+            for text, ref in zip(texts, reference_texts)
+        ) / max(1, len(texts))
+        results[cpu_backend] = tokens / elapsed if elapsed > 0 else 0.0
+        print(
+            f"{cpu_backend:<10} {elapsed:8.2f}s  {tokens:8d} tokens  {results[cpu_backend]:8.1f} tokens/sec  "
+            f"exact {exact}/{len(texts)}  similarity {similarity:.4f}"
+        )
+
+    for cpu_backend, tokens_per_sec in results.items():
+        if cpu_backend != "fp32" and results["fp32"] > 0:
+            print(f"Speedup {cpu_backend}: {tokens_per_sec / results['fp32']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
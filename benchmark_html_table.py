@@ -0,0 +1,220 @@
+"""
+Benchmark the single-pass HTML table parser of dolphin_transformer
+
+Times, per table, what dolphin_transformer does with a "tab" element: validation,
+markdown/TSV/row sentences and the simplified fallback text. "regex" is the previous
+implementation: separate re.findall/re.sub scans per step, the table validated twice and
+converted with pandas.read_html when pandas/lxml are installed ("regex+pandas", the path of
+the project venv) or with the regex fallback parser ("regex"). "single-pass" parses the
+table once with utils.html_table and renders from the parse.
+
+Tables are the HTML strings found in the input JSON files (Dolphin recognition results),
+plus every list of records in them rendered as an HTML table - mena_parse_result.json holds
+the structured parse of a catalog section, whose stamp/variety/production-order lists are
+the tables of the printed page. --scale repeats each record list to production-order size.
+
+Usage:
+    python benchmark_html_table.py --inputs mena_parse_result.json ./results/recognition_json --scale 40
+"""
+
+import argparse
+import glob
+import html as html_lib
+import json
+import os
+import re
+import time
+from collections import Counter
+from functools import partial
+from io import StringIO
+
+from dolphin_transformer import (
+    _simplify_html_table,
+    _table_to_md_tsv_and_sentences,
+    _validate_html_table,
+)
+from utils.html_table import parse_html_table
+
+
+def _flatten(record, prefix=""):
+    flat = {}
+    for key, value in record.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif not isinstance(value, list):
+            flat[f"{prefix}{key}"] = "" if value is None else str(value)
+    return flat
+
+
+def records_to_html(records, scale=1):
+    """HTML table of a list of records (nested dicts flattened), repeated scale times"""
+    rows = [_flatten(record) for record in records]
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    cell = lambda text: f"<td>{html_lib.escape(text)}</td>"  # noqa: E731
+    lines = ["<table><tr><td>#</td>" + "".join(cell(c) for c in columns) + "</tr>"]
+    for i in range(len(rows) * scale):
+        row = rows[i % len(rows)]
+        lines.append(f"<tr><td>{i + 1}</td>" + "".join(cell(row.get(c, "")) for c in columns) + "</tr>")
+    return "".join(lines) + "</table>"
+
+
+def collect_tables(value, scale, tables):
+    """HTML tables and record lists (as HTML tables) anywhere in a JSON value"""
+    if isinstance(value, str):
+        if "<table" in value.lower():
+            tables.append(value)
+    elif isinstance(value, list):
+        if value and all(isinstance(item, dict) for item in value):
+            tables.append(records_to_html(value, scale))
+        for item in value:
+            collect_tables(item, scale, tables)
+    elif isinstance(value, dict):
+        for item in value.values():
+            collect_tables(item, scale, tables)
+    return tables
+
+
+def load_tables(inputs, scale):
+    tables = []
+    for path in inputs:
+        paths = sorted(glob.glob(os.path.join(path, "*.json*"))) if os.path.isdir(path) else [path]
+        for file_path in paths:
+            with open(file_path, "r", encoding="utf-8") as f:
+                if file_path.endswith(".jsonl"):
+                    values = [json.loads(line) for line in f if line.strip()]
+                else:
+                    values = [json.load(f)]
+            for value in values:
+                collect_tables(value, scale, tables)
+    return tables
+
+
+def regex_validate(html):
+    """Previous _validate_html_table"""
+    if not html or len(html.strip()) < 20 or not re.search(r"<table[^>]*>", html, re.I):
+        return False
+    rows = re.findall(r"<tr[^>]*>.*?</tr>", html, re.I | re.S)
+    if len(rows) > 200 or len(rows) < 2:
+        return False
+    if len(re.findall(r"<t[dh][^>]*>.*?</t[dh]>", html, re.I | re.S)) > 1000:
+        return False
+    cell_contents = re.findall(r"<t[dh][^>]*>(.*?)</t[dh]>", html, re.I | re.S)
+    cleaned = [re.sub(r"<.*?>", "", cell).strip() for cell in cell_contents if cell.strip()]
+    if cleaned and Counter(cleaned).most_common(1)[0][1] / len(cleaned) > 0.7:
+        return False
+    empty = len([cell for cell in cleaned if cell in ("", "nan")])
+    return empty / max(1, len(cleaned)) <= 0.8
+
+
+def regex_rows(html, max_cells):
+    """Previous row/cell scan of the fallback converter and of _simplify_html_table"""
+    rows = []
+    for r in re.findall(r"<tr[^>]*>(.*?)</tr>", html, flags=re.I | re.S):
+        cells = re.findall(r"<t[dh][^>]*>(.*?)</t[dh]>", r, flags=re.I | re.S)
+        cells = [c for c in (re.sub(r"<.*?>", "", c).strip()[:100] for c in cells) if c]
+        if cells and len(cells) <= max_cells:
+            rows.append(cells)
+    return rows
+
+
+def pandas_convert(html):
+    """Previous primary converter: pandas.read_html, then markdown/TSV/row sentences from the DataFrame"""
+    import pandas as pd
+
+    df = pd.read_html(StringIO(html))[0]
+    if df.shape[0] > 100 or df.shape[1] > 25:
+        raise ValueError("Table too large")
+    df = df.map(lambda x: "" if x is None else str(x)[:200])
+    headers = [str(c)[:50] for c in df.columns.tolist()]
+    try:
+        markdown = df.to_markdown(index=False)  # needs tabulate
+    except ImportError:
+        markdown = None
+    tsv = df.to_csv(index=False, sep="\t")
+    sentences = []
+    for idx, (_, row) in enumerate(df.iterrows()):
+        if idx >= 50:
+            break
+        parts = [
+            f"{col}: {str(row[col]).strip()[:100]}" for col in df.columns if str(row[col]).strip() not in ("", "nan")
+        ]
+        sentences.append(", ".join(parts)[:500])
+    return markdown, tsv, headers, sentences
+
+
+def previous_pipeline(html, use_pandas):
+    """Previous per-table work: validate in transform, validate again in the converter, convert
+    (pandas, or the regex fallback parser), simplify when neither markdown nor TSV came out"""
+    if not regex_validate(html) or not regex_validate(html):
+        return None
+    if use_pandas:
+        try:
+            return pandas_convert(html)
+        except Exception:
+            pass
+    rows = regex_rows(html, 10)
+    headers = rows[0] if rows else []
+    sentences = [", ".join(f"{h}: {v[:80]}" for h, v in zip(headers, r) if v) for r in rows[1:30]]
+    tsv = "\n".join("\t".join(r) for r in rows[:30])
+    simplified = "\n".join(" | ".join(c[:80] for c in r) for r in regex_rows(html, 8)[:20])
+    return tsv, sentences, simplified
+
+
+def single_pass_pipeline(html):
+    table = parse_html_table(html)
+    if not _validate_html_table(table):
+        return None
+    return _table_to_md_tsv_and_sentences(table), _simplify_html_table(table)
+
+
+def time_per_table(func, tables, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for html in tables:
+            func(html)
+    return (time.perf_counter() - start) / (repeat * len(tables))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the single-pass HTML table parser")
+    parser.add_argument(
+        "--inputs", nargs="+", default=["mena_parse_result.json"], help="JSON/JSONL files or directories"
+    )
+    parser.add_argument("--scale", type=int, default=40, help="Repeat each record list this many times")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed passes over all tables")
+    args = parser.parse_args()
+
+    tables = load_tables(args.inputs, args.scale)
+    if not tables:
+        raise SystemExit(f"No tables found in {args.inputs}")
+    print(f"{len(tables)} tables, {sum(map(len, tables)) / len(tables):.0f} chars on average")
+
+    agree = sum(regex_validate(html) == _validate_html_table(html) for html in tables)
+    print(f"validation agrees on {agree}/{len(tables)} tables")
+
+    # The converters print their warnings; time them quietly
+    import contextlib
+    import io
+
+    baselines = {"regex": False}
+    try:
+        import lxml  # noqa: F401
+        import pandas  # noqa: F401
+
+        baselines["regex+pandas"] = True
+    except ImportError:
+        print("pandas/lxml not installed: the previous pipeline is timed with its regex fallback only")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        single_seconds = time_per_table(single_pass_pipeline, tables, args.repeat)
+        seconds = {
+            name: time_per_table(partial(previous_pipeline, use_pandas=use_pandas), tables, args.repeat)
+            for name, use_pandas in baselines.items()
+        }
+    print(f"{'single-pass':14s}{single_seconds * 1000:9.3f} ms/table")
+    for name, value in seconds.items():
+        print(f"{name:14s}{value * 1000:9.3f} ms/table ({value / single_seconds:.2f}x the single-pass time)")
+
+
+if __name__ == "__main__":
+    main()
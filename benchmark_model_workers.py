@@ -0,0 +1,82 @@
+"""
+Benchmark shared-memory model workers: pages/sec vs worker count on CPU
+
+Loads DOLPHIN once, then parses the same fixture pages (layout + element recognition,
+pooled over pages_per_batch pages) in-process and with SharedModelWorkers for each
+requested worker count. Reports wall time, pages/sec and the parent's RSS, plus each
+worker's RSS and the part of it that is shared memory (the parent's weights), read from
+/proc on Linux.
+
+Usage:
+    CUDA_VISIBLE_DEVICES= python benchmark_model_workers.py --input_path ./demo/page_imgs --workers 1 2 4
+"""
+
+import argparse
+import os
+import time
+
+from omegaconf import OmegaConf
+
+from benchmark_length_bucketing import load_fixture_pages
+from chat import DOLPHIN, peak_rss_mb
+from demo_page import process_page_batch
+from model_workers import SharedModelWorkers
+
+
+def worker_rss_mb(pid):
+    """Resident and shared-memory resident set size of a process in MB, from /proc/<pid>/status"""
+    with open(f"/proc/{pid}/status") as f:
+        fields = dict(line.split(":", 1) for line in f if ":" in line)
+    return int(fields["VmRSS"].split()[0]) / 1024, int(fields["RssShmem"].split()[0]) / 1024
+
+
+def run(model, pages, save_dir, max_batch_size, pages_per_batch):
+    """Parse all pages and return the wall time"""
+    start = time.perf_counter()
+    for first in range(0, len(pages), pages_per_batch):
+        group = pages[first : first + pages_per_batch]
+        page_names = [f"bench_{first + i:03d}" for i in range(len(group))]
+        process_page_batch(group, model, save_dir, page_names, max_batch_size)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pages/sec of shared-memory Dolphin workers")
+    parser.add_argument("--config", default="./config/Dolphin.yaml", help="Path to configuration file")
+    parser.add_argument("--input_path", type=str, default="./demo/page_imgs", help="Fixture image/PDF or directory")
+    parser.add_argument("--max_pages", type=int, default=8, help="Maximum number of fixture pages")
+    parser.add_argument("--max_batch_size", type=int, default=4, help="Decoding batch size")
+    parser.add_argument("--pages_per_batch", type=int, default=4, help="Pages pooled per layout/recognition round")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Worker counts to compare")
+    parser.add_argument("--save_dir", type=str, default="./bench_results", help="Directory for figure crops")
+    args = parser.parse_args()
+
+    config = OmegaConf.load(args.config)
+    model = DOLPHIN(config)
+    os.makedirs(os.path.join(args.save_dir, "markdown", "figures"), exist_ok=True)
+    pages = load_fixture_pages(args.input_path, args.max_pages)
+    print(f"Fixture: {len(pages)} pages, {os.cpu_count()} CPU cores")
+
+    # Warm up kernels and allocator before timing
+    run(model, pages[:1], args.save_dir, args.max_batch_size, 1)
+
+    elapsed = run(model, pages, args.save_dir, args.max_batch_size, args.pages_per_batch)
+    baseline = len(pages) / elapsed
+    print(f"{'in-process':<12} {elapsed:8.2f}s  {baseline:6.3f} pages/sec  peak RSS {peak_rss_mb():8.0f} MB")
+
+    for num_workers in args.workers:
+        with SharedModelWorkers(model, num_workers=num_workers) as workers:
+            run(workers, pages[:1], args.save_dir, args.max_batch_size, 1)
+            elapsed = run(workers, pages, args.save_dir, args.max_batch_size, args.pages_per_batch)
+            worker_rss = [worker_rss_mb(worker.pid) for worker in workers.workers]
+        pages_per_sec = len(pages) / elapsed
+        print(
+            f"{f'{num_workers} worker(s)':<12} {elapsed:8.2f}s  {pages_per_sec:6.3f} pages/sec  "
+            f"peak RSS {peak_rss_mb():8.0f} MB  speedup {pages_per_sec / baseline:.2f}x"
+        )
+        for worker_id, (rss, shared) in enumerate(worker_rss):
+            print(f"{'':<12} worker {worker_id}: RSS {rss:8.0f} MB ({shared:.0f} MB shared)")
+
+
+if __name__ == "__main__":
+    main()
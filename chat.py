@@ -4,6 +4,8 @@ SPDX-License-Identifier: MIT
 """
 
 import os
+import resource
+import time
 import warnings
 from collections import OrderedDict
 
@@ -17,8 +19,16 @@ import torch
 from PIL import Image
 from transformers import PreTrainedTokenizerFast
 
-from utils.model import DonutConfig, DonutModel, SwinEncoder
+from utils.model import DonutConfig, DonutModel, SwinEncoder, quantize_linears_int8
 from utils.processor import DolphinProcessor
+from utils.scheduler import (
+    estimate_output_length,
+    length_bucketed_batches,
+    restore_order,
+    sequential_batches,
+)
+
+CPU_BACKENDS = ("fp32", "int8", "int8_full")
 
 
 def try_rename_lagacy_weights(ckpt, output_path=""):
@@ -41,6 +51,50 @@ def try_rename_lagacy_weights(ckpt, output_path=""):
     return new_ckpt
 
 
+def convert_checkpoint_to_safetensors(ckpt_path, output_path=""):
+    """One-time conversion of a torch checkpoint to a renamed safetensors file
+
+    Legacy weight names are renamed once here, and tensors shared between tied layers are
+    stored once, so DOLPHIN can memory-map the file at startup instead of unpickling it.
+
+    Returns:
+        Path of the safetensors file (next to the checkpoint unless output_path is given)
+    """
+    from safetensors.torch import save_file
+
+    output_path = output_path or os.path.splitext(ckpt_path)[0] + ".safetensors"
+    ckpt = try_rename_lagacy_weights(torch.load(ckpt_path, map_location="cpu"))
+
+    state_dict = {}
+    seen = set()
+    # Output projections come last, so a tied pair keeps the input embedding
+    for k, v in sorted(ckpt.items(), key=lambda item: item[0].endswith("lm_head.weight")):
+        key = (v.untyped_storage().data_ptr(), v.storage_offset(), tuple(v.shape))
+        if key in seen:
+            continue  # tied weight, restored by tie_weights at load time
+        seen.add(key)
+        state_dict[k] = v.contiguous()
+    save_file(state_dict, output_path, metadata={"format": "pt", "source": os.path.basename(ckpt_path)})
+    return output_path
+
+
+def resolve_checkpoint_path(path):
+    """Prefer an up-to-date converted .safetensors file next to a torch checkpoint"""
+    if not path or path.endswith(".safetensors"):
+        return path
+    converted = os.path.splitext(path)[0] + ".safetensors"
+    if os.path.exists(converted) and (
+        not os.path.exists(path) or os.path.getmtime(converted) >= os.path.getmtime(path)
+    ):
+        return converted
+    return path
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
 def convert_listconfig_to_list(config):
     new_config = {}
     for k, v in config.items():
@@ -89,19 +143,71 @@ class DOLPHIN:
 
         self.model = DonutModel(config=donut_config, vision_tower=vision_tower, tokenizer=self.tokenizer)
         if self.model_args.model_name_or_path:
-            ckpt = torch.load(self.model_args.model_name_or_path)
-            ckpt = try_rename_lagacy_weights(ckpt)
-            self.model.load_state_dict(ckpt, strict=True)
+            self.load_checkpoint(resolve_checkpoint_path(self.model_args.model_name_or_path))
 
         device = "cuda" if torch.cuda.is_available() else "cpu"
         self.model.to(device)
         self.model.eval()
+        if device == "cpu":
+            self._setup_cpu_backend()
         transform_args = {
             "input_size": self.swin_args["img_size"],
             "max_length": self.model_args.max_length,
         }
         self.processor = DolphinProcessor({}, self.tokenizer, transform_args=transform_args)
 
+    def load_checkpoint(self, ckpt_path):
+        """Load model weights, memory-mapping .safetensors files instead of unpickling them
+
+        Tensors of a safetensors file are mapped from disk and assigned to the model as they
+        are, so the weights are not held twice in memory. Load time and peak RSS are kept in
+        self.load_stats.
+        """
+        start = time.perf_counter()
+        if ckpt_path.endswith(".safetensors"):
+            from safetensors.torch import load_file
+
+            missing, unexpected = self.model.load_state_dict(load_file(ckpt_path), strict=False, assign=True)
+            # Tied weights are stored once; tie_weights points them at the loaded tensor again
+            self.model.llm.model.tie_weights()
+            tied = {k for k in missing if k.endswith("lm_head.weight")}
+            if unexpected or set(missing) - tied:
+                raise RuntimeError(
+                    f"Checkpoint {ckpt_path} does not match the model: missing {sorted(set(missing) - tied)}, "
+                    f"unexpected {sorted(unexpected)}"
+                )
+        else:
+            ckpt = torch.load(ckpt_path, map_location="cpu")
+            ckpt = try_rename_lagacy_weights(ckpt)
+            self.model.load_state_dict(ckpt, strict=True)
+            del ckpt
+        self.load_stats = {
+            "checkpoint": ckpt_path,
+            "load_seconds": time.perf_counter() - start,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        print(
+            f"Loaded {os.path.basename(ckpt_path)} in {self.load_stats['load_seconds']:.2f}s "
+            f"(peak RSS {self.load_stats['peak_rss_mb']:.0f} MB)"
+        )
+
+    def _setup_cpu_backend(self):
+        """Apply model.cpu_backend when running without a GPU
+
+        "fp32" keeps the reference weights, "int8" runs the decoder linears (including the
+        vocabulary projection) with dynamic int8 quantization and "int8_full" quantizes the
+        Swin encoder linears as well.
+        """
+        cpu_backend = self.model_args.get("cpu_backend", "fp32")
+        if cpu_backend not in CPU_BACKENDS:
+            raise ValueError(f"Unknown CPU backend: {cpu_backend}")
+        if self.model_args.get("cpu_threads"):
+            torch.set_num_threads(self.model_args.cpu_threads)
+        if cpu_backend in ("int8", "int8_full"):
+            quantize_linears_int8(self.model.llm)
+        if cpu_backend == "int8_full":
+            quantize_linears_int8(self.model.vpm)
+
     def chat(
         self,
         question,
@@ -111,7 +217,37 @@ class DOLPHIN:
         return_img_size=False,
         only_return_img_size=False,
         max_batch_size=16,
+        labels=None,
+        length_bucketing=None,
+        engine=None,
+        repetition_penalty=None,
+        return_stop_reason=False,
+        max_new_tokens=None,
+        return_metrics=False,
     ):
+        """Run Dolphin on one (question, image) pair or on lists of them
+
+        Args:
+            labels: Optional layout label of each image in a batched call, used to estimate
+                output lengths for length-aware bucketing
+            length_bucketing: Group images of similar estimated output length into the same
+                batch (default: model.length_bucketing from the config). Results are always
+                returned in input order.
+            engine: "static" decodes each batch with generate until its slowest sequence ends;
+                "continuous" refills slots freed by finished sequences with pending images
+                (default: model.decoding_engine from the config)
+            repetition_penalty: Optional repetition penalty, e.g. to retry outputs that looped
+            return_stop_reason: Also return why decoding ended for each output ("eos",
+                "repetition", "early_stop" or "max_length"). Repetition loops are only cut
+                short when model.repetition_stopping is enabled in the config.
+            max_new_tokens: Optional token budget, one int for all images or one per image.
+                Outputs cut at their budget report the stop reason "budget".
+            return_metrics: Also return per-output metrics (a dict, or a list of dicts for a
+                batched call) as the last return value: preprocess_seconds, encoder_seconds and
+                decode_seconds (shares of the batch), decode_steps, generated_tokens,
+                stop_reason, mean_token_score and batch_occupancy (rows decoded together
+                divided by max_batch_size)
+        """
 
         def _preprocess_image(image):
             if isinstance(image, str):
@@ -145,10 +281,22 @@ class DOLPHIN:
                 output = output.split(self.tokenizer._prompt_end_token)[-1]
             return output
 
+        if length_bucketing is None:
+            length_bucketing = self.model_args.get("length_bucketing", False)
+        if engine is None:
+            engine = self.model_args.get("decoding_engine", "static")
+        if engine not in ("static", "continuous"):
+            raise ValueError(f"Unknown decoding engine: {engine}")
+        repetition_stopping = self.model_args.get("repetition_stopping", False)
+
+        preprocess_seconds = []
         if isinstance(question, list):
+            image = [Image.open(i).convert("RGB") if isinstance(i, str) else i for i in image]
             image_tensor_list = []
             for i in image:
+                preprocess_start = time.perf_counter()
                 image_tensor, ori_size = _preprocess_image(i)
+                preprocess_seconds.append(time.perf_counter() - preprocess_start)
                 image_tensor_list.append(image_tensor)
             image_tensor = torch.cat(image_tensor_list, dim=0)
 
@@ -158,17 +306,51 @@ class DOLPHIN:
                 question, add_special_tokens=False, return_tensors="pt", padding=True
             ).input_ids
         else:
+            preprocess_start = time.perf_counter()
             image_tensor, ori_size = _preprocess_image(image)
+            preprocess_seconds.append(time.perf_counter() - preprocess_start)
             prompt_ids = _preprocess_prompt(question)
 
         if only_return_img_size:
             return ori_size
 
+        if isinstance(question, list) and length_bucketing:
+            if labels is None:
+                labels = ["tab" if "table" in q else "para" for q in question]
+            lengths = [estimate_output_length(label, *img.size) for label, img in zip(labels, image)]
+            batches = length_bucketed_batches(lengths, max_batch_size)
+        else:
+            batches = sequential_batches(image_tensor.shape[0], max_batch_size)
+
+        if isinstance(max_new_tokens, int):
+            max_new_tokens = [max_new_tokens] * image_tensor.shape[0]
+
+        if engine == "continuous":
+            # One running batch of max_batch_size slots, filled in batch order
+            batches = [[i for indices in batches for i in indices]]
+
         model_output_batch = []
-        for i in range(0, image_tensor.shape[0], max_batch_size):
-            image_tensor_batch = image_tensor[i : i + max_batch_size]
-            prompt_ids_batch = prompt_ids[i : i + max_batch_size]
-            model_output = self.model.inference(image_tensors=image_tensor_batch, prompt_ids=prompt_ids_batch)
+        for indices in batches:
+            image_tensor_batch = image_tensor[indices]
+            prompt_ids_batch = prompt_ids[indices]
+            budgets_batch = [max_new_tokens[i] for i in indices] if max_new_tokens is not None else None
+            if engine == "continuous":
+                model_output = self.model.inference_continuous(
+                    prompt_ids_batch,
+                    image_tensor_batch,
+                    max_batch_size=max_batch_size,
+                    repetition_stopping=repetition_stopping,
+                    repetition_penalty=repetition_penalty,
+                    max_new_tokens=budgets_batch,
+                )
+            else:
+                model_output = self.model.inference(
+                    image_tensors=image_tensor_batch,
+                    prompt_ids=prompt_ids_batch,
+                    repetition_stopping=repetition_stopping,
+                    repetition_penalty=repetition_penalty,
+                    max_new_tokens=budgets_batch,
+                )
             model_output_batch.append(model_output)
         model_output = {}
         for k, v in model_output_batch[0].items():
@@ -179,6 +361,8 @@ class DOLPHIN:
                 )
             else:
                 model_output[k] = sum([v_batch[k] for v_batch in model_output_batch], [])
+            if len(model_output[k]) == image_tensor.shape[0]:
+                model_output[k] = restore_order(model_output[k], batches)
 
         if return_raw:
             if return_img_size:
@@ -191,8 +375,44 @@ class DOLPHIN:
             else:
                 output = _postprocess(model_output["repetitions"][0], question)
                 score = model_output["scores"][0]
-            if return_score:
-                return output, score
-            if return_img_size:
-                return output, ori_size
-            return output
+            if return_stop_reason:
+                stop_reason = model_output["stop_reasons"]
+                if not isinstance(question, list):
+                    stop_reason = stop_reason[0]
+                if return_score:
+                    result = (output, score, stop_reason)
+                else:
+                    result = (output, stop_reason)
+            elif return_score:
+                result = (output, score)
+            elif return_img_size:
+                result = (output, ori_size)
+            else:
+                result = (output,)
+
+            if return_metrics:
+                metrics = self._output_metrics(model_output, preprocess_seconds, max_batch_size)
+                result += (metrics if isinstance(question, list) else metrics[0],)
+            return result if len(result) > 1 else result[0]
+
+    @staticmethod
+    def _output_metrics(model_output, preprocess_seconds, max_batch_size):
+        """Per-output metrics of a chat call from the merged model output"""
+        metrics = []
+        for i, preprocess in enumerate(preprocess_seconds):
+            generated_tokens = model_output["generated_tokens"][i]
+            # Rows that stopped early carry scores of padding after their last token
+            scores = model_output["scores"][i][:generated_tokens]
+            metrics.append(
+                {
+                    "preprocess_seconds": round(preprocess, 6),
+                    "encoder_seconds": round(model_output["encoder_seconds"][i], 6),
+                    "decode_seconds": round(model_output["decode_seconds"][i], 6),
+                    "decode_steps": model_output["decode_steps"][i],
+                    "generated_tokens": generated_tokens,
+                    "stop_reason": model_output["stop_reasons"][i],
+                    "mean_token_score": round(sum(scores) / len(scores), 4) if scores else None,
+                    "batch_occupancy": round(model_output["batch_rows"][i] / max_batch_size, 4),
+                }
+            )
+        return metrics
@@ -0,0 +1,38 @@
+"""
+Convert the Dolphin torch checkpoint to a memory-mappable safetensors file
+
+Run once per checkpoint. DOLPHIN then loads the .safetensors file next to
+model.model_name_or_path automatically (or point model_name_or_path at it directly),
+which avoids unpickling the checkpoint and holding the weights twice at startup.
+
+Usage:
+    python convert_checkpoint.py --config ./config/Dolphin.yaml
+"""
+
+import argparse
+
+from omegaconf import OmegaConf
+
+from chat import DOLPHIN, convert_checkpoint_to_safetensors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a Dolphin checkpoint to safetensors")
+    parser.add_argument("--config", default="./config/Dolphin.yaml", help="Path to configuration file")
+    parser.add_argument("--ckpt_path", type=str, default=None, help="Checkpoint (default: model.model_name_or_path)")
+    parser.add_argument("--output_path", type=str, default="", help="Output file (default: <checkpoint>.safetensors)")
+    parser.add_argument("--verify", action="store_true", help="Load the converted file into DOLPHIN afterwards")
+    args = parser.parse_args()
+
+    config = OmegaConf.load(args.config)
+    ckpt_path = args.ckpt_path or config.model.model_name_or_path
+    output_path = convert_checkpoint_to_safetensors(ckpt_path, args.output_path)
+    print(f"Converted {ckpt_path} -> {output_path}")
+
+    if args.verify:
+        config.model.model_name_or_path = output_path
+        DOLPHIN(config)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,62 +7,273 @@ import argparse
 import glob
 import os
 
-import cv2
 from omegaconf import OmegaConf
 from PIL import Image
 
 from chat import DOLPHIN
+from utils.figure_store import FigureWriter
+from utils.inference_backend import create_backend
+from utils.ocr_profile import ocr_profiler, print_profile_summary, profile_path
+from utils.page_check import precheck_page
+from utils.page_store import PageStore, shard_name
+from utils.result_stream import DocumentStream
+from utils.scheduler import budget_telemetry, token_budget
+from utils.text_layer import extract_text_layer_pages
 from utils.utils import *
 
+LAYOUT_PROMPT = "Parse the reading order of this document."
+
+
+def process_document(
+    document_path,
+    model,
+    save_dir,
+    max_batch_size,
+    pages_per_batch=1,
+    crop_cache=None,
+    resume=True,
+    text_layer=False,
+    page_range=None,
+    save_figure=save_figure_to_local,
+    stream_results=False,
+    export_json=True,
+):
+    """Parse documents - Handles both images and PDFs
 
-def process_document(document_path, model, save_dir, max_batch_size):
-    """Parse documents - Handles both images and PDFs"""
+    Args:
+        document_path: Path to the image or PDF file
+        model: DOLPHIN model instance
+        save_dir: Directory to save results
+        max_batch_size: Maximum batch size for processing
+        pages_per_batch: Number of PDF pages whose elements are pooled into shared
+            recognition batches (1 keeps the page-by-page behaviour)
+        crop_cache: Optional CropCache of element results shared across pages and documents
+        resume: Reuse pages of this PDF already in the page store (False starts over)
+        text_layer: Take pages with a usable born-digital text layer straight from the PDF
+            instead of running the model on them
+        page_range: Optional (start, stop) 0-based page range of a PDF to process as one
+            shard. Shards store their pages separately; the shard that finds every page of
+            the PDF stored and claims the stitch (PageStore.claim_stitch) stitches the
+            combined results, the others return (None, None).
+        save_figure: Callable (pil_crop, save_dir, image_name, reading_order) -> figure filename,
+            e.g. a utils.figure_store.FigureWriter
+        stream_results: Append each finished PDF page to recognition_json/<name>.jsonl and
+            markdown/<name>.md as soon as it and all pages before it are done, instead of
+            assembling the whole document in memory. The second return value is then the
+            JSONL path, which transform_dolphin_to_oxcart_preserving_labels also accepts.
+        export_json: With stream_results, also export the combined recognition JSON
+    """
     file_ext = os.path.splitext(document_path)[1].lower()
-    
+
     if file_ext == '.pdf':
         # Process PDF file
-        # Convert PDF to images
-        images = convert_pdf_to_images(document_path)
-        if not images:
+        try:
+            num_pages = get_pdf_page_count(document_path)
+        except Exception as e:
+            raise Exception(f"Failed to convert PDF {document_path} to images: {str(e)}")
+        if num_pages == 0:
             raise Exception(f"Failed to convert PDF {document_path} to images")
-        
-        all_results = []
-        
-        # Process each page
-        for page_idx, pil_image in enumerate(images):
-            print(f"Processing page {page_idx + 1}/{len(images)}")
-            
-            # Generate output name for this page
-            base_name = os.path.splitext(os.path.basename(document_path))[0]
-            page_name = f"{base_name}_page_{page_idx + 1:03d}"
-            
-            # Process this page (don't save individual page results)
-            json_path, recognition_results = process_single_image(
-                pil_image, model, save_dir, page_name, max_batch_size, save_individual=False
+
+        # Finished pages are kept in a per-PDF page store, so an interrupted run resumes
+        page_store = PageStore(save_dir, document_path, shard=shard_name(page_range) if page_range else None)
+        if not resume:
+            page_store.clear()
+        start, stop = page_range or (0, num_pages)
+        missing_pages = page_store.missing_pages(num_pages, page_range=(start, stop))
+        if len(missing_pages) < stop - start:
+            done_pages = stop - start - len(missing_pages)
+            print(f"Resuming: {done_pages}/{stop - start} pages already in {page_store.directory}")
+
+        # Stream pages out as they finish; a shard streams the document when it stitches it
+        stream = None
+        if stream_results and not page_range:
+            stream = DocumentStream(save_dir, document_path, num_pages)
+            stream.add_pages(page_store.load())
+
+        base_name = os.path.splitext(os.path.basename(document_path))[0]
+        render_size = get_render_size(model)
+
+        # Born-digital pages are read from the text layer; only the others go to the model
+        if text_layer and missing_pages:
+            text_pages = extract_text_layer_pages(
+                document_path, missing_pages, render_size, save_dir, base_name, save_figure=save_figure
+            )
+            for page_idx, recognition_results in text_pages.items():
+                record = page_store.append(page_idx, recognition_results, page_info={"page_class": "text_layer"})
+                if stream is not None:
+                    stream.add_page(page_idx, record)
+            missing_pages = [page_idx for page_idx in missing_pages if page_idx not in text_pages]
+            print(f"Text layer: {len(text_pages)} page(s) extracted, {len(missing_pages)} page(s) left for OCR")
+
+        # Render pages lazily, at the size the model consumes them
+        pages = iter_pdf_images(document_path, target_size=render_size, page_indices=missing_pages)
+
+        # Process pages in groups so that sparse pages share recognition batches
+        for page_batch in batched(pages, max(1, pages_per_batch)):
+            page_indices, page_images = zip(*page_batch)
+            if len(page_indices) == 1:
+                print(f"Processing page {page_indices[0] + 1}/{num_pages}")
+            else:
+                print(f"Processing pages {page_indices[0] + 1}-{page_indices[-1] + 1}/{num_pages}")
+
+            # Generate output names for these pages
+            page_names = [f"{base_name}_page_{page_idx + 1:03d}" for page_idx in page_indices]
+
+            pages_info = []
+            pages_elements = process_page_batch(
+                list(page_images),
+                model,
+                save_dir,
+                page_names,
+                max_batch_size,
+                crop_cache=crop_cache,
+                pages_info=pages_info,
+                save_figure=save_figure,
             )
-            
-            # Add page information to results
-            page_results = {
-                "page_number": page_idx + 1,
-                "elements": recognition_results
-            }
-            all_results.append(page_results)
-        
-        # Save combined results for multi-page PDF
+
+            # Record each page as soon as it is done
+            for page_idx, recognition_results, page_info in zip(page_indices, pages_elements, pages_info):
+                record = page_store.append(page_idx, recognition_results, page_info=page_info)
+                if stream is not None:
+                    stream.add_page(page_idx, record)
+
+        # A shard stitches the document only once all other shards are stored too
+        if page_range and page_store.missing_pages(num_pages):
+            print(f"Shard {page_store.shard} done, waiting for the other shards of {document_path}")
+            return None, None
+        # Shards finishing together all see every page stored; only one writes the combined files
+        if page_range and not page_store.claim_stitch():
+            print(f"Shard {page_store.shard} done, another shard stitches {document_path}")
+            return None, None
+
+        if stream_results:
+            if stream is None:
+                stream = DocumentStream(save_dir, document_path, num_pages)
+                stream.add_pages(page_store.load())
+            jsonl_path = stream.close()
+            return (stream.export_json() if export_json else jsonl_path), jsonl_path
+
+        # Save combined results for multi-page PDF, assembled from the page store
+        all_results = page_store.assemble(num_pages)
         combined_json_path = save_combined_pdf_results(all_results, document_path, save_dir)
-        
+
         return combined_json_path, all_results
 
     else:
         # Process regular image file
         pil_image = Image.open(document_path).convert("RGB")
         base_name = os.path.splitext(os.path.basename(document_path))[0]
-        return process_single_image(pil_image, model, save_dir, base_name, max_batch_size)
+        return process_single_image(
+            pil_image, model, save_dir, base_name, max_batch_size, crop_cache=crop_cache, save_figure=save_figure
+        )
+
+
+def get_render_size(model, default=896):
+    """Longest page side the model's processor works at, used as the PDF render size"""
+    processor = getattr(model, "processor", None)
+    input_size = getattr(processor, "input_size", None)
+    return max(input_size) if input_size else default
+
+
+def process_page_batch(
+    images,
+    model,
+    save_dir,
+    page_names,
+    max_batch_size,
+    crop_cache=None,
+    pages_info=None,
+    save_figure=save_figure_to_local,
+):
+    """Parse several pages at once, pooling their text/table crops into shared batches
+
+    Layout parsing runs as one batch over all pages, then the text/table crops of every
+    page are recognized together so each decoding batch is filled up to max_batch_size
+    regardless of how sparse individual pages are. Blank and image-only pages are settled
+    by the page pre-check and never reach the model.
 
+    Args:
+        images: List of PIL Image objects (one per page)
+        model: DOLPHIN model instance
+        save_dir: Directory to save results
+        page_names: Output name for each page (used for figure files)
+        max_batch_size: Maximum batch size for processing
+        crop_cache: Optional CropCache of element results
+        pages_info: Optional list, extended with the page fields (e.g. {"page_class": "blank"})
+            to store with each page
+        save_figure: Callable (pil_crop, save_dir, image_name, reading_order) -> figure filename
 
-def process_single_image(image, model, save_dir, image_name, max_batch_size, save_individual=True):
+    Returns:
+        List of recognition results, one list of elements per page
+    """
+    # Stage 0: Settle blank and image-only pages without the model
+    prechecked = [None] * len(images)
+    if getattr(model, "model_args", {}).get("page_precheck"):
+        prechecked = [
+            precheck_page(image, save_dir, page_name, save_figure=save_figure)
+            for image, page_name in zip(images, page_names)
+        ]
+    if pages_info is not None:
+        pages_info.extend(precheck[1] if precheck else {} for precheck in prechecked)
+    layout_indices = [page_idx for page_idx, precheck in enumerate(prechecked) if precheck is None]
+
+    # Stage 1: Page-level layout and reading order parsing for all remaining pages
+    layout_outputs = [None] * len(images)
+    if layout_indices:
+        outputs = profiled_chat(
+            model,
+            [LAYOUT_PROMPT] * len(layout_indices),
+            [images[page_idx] for page_idx in layout_indices],
+            ["layout"] * len(layout_indices),
+            [page_names[page_idx] for page_idx in layout_indices],
+            max_batch_size=max_batch_size,
+        )
+        for page_idx, layout_output in zip(layout_indices, outputs):
+            layout_outputs[page_idx] = layout_output
+
+    # Stage 2: Crop every page and pool the elements that need decoding
+    pages_results = []
+    pooled_elements = []
+    for page_idx, (image, layout_output, page_name) in enumerate(zip(images, layout_outputs, page_names)):
+        if prechecked[page_idx] is not None:
+            print(f"Page pre-check: {page_name} is {prechecked[page_idx][1]['page_class']}, skipping layout parsing")
+            pages_results.append(prechecked[page_idx][0])
+            continue
+        padded_image, dims = prepare_image(image)
+        figure_results, text_table_elements = prepare_elements(
+            layout_output, padded_image, dims, save_dir, page_name, save_figure=save_figure
+        )
+        pages_results.append(figure_results)
+        pooled_elements.extend((page_idx, elem) for elem in text_table_elements)
+
+    # Stage 3: Element-level content parsing across all pages
+    batch_results = recognize_elements([elem for _, elem in pooled_elements], model, max_batch_size, crop_cache)
+
+    # Scatter results back to their pages, keyed by (page, reading_order)
+    for (page_idx, _), result in zip(pooled_elements, batch_results):
+        pages_results[page_idx].append(result)
+    for recognition_results in pages_results:
+        recognition_results.sort(key=lambda x: x.get("reading_order", 0))
+
+    return pages_results
+
+
+def process_single_image(
+    image,
+    model,
+    save_dir,
+    image_name,
+    max_batch_size,
+    save_individual=True,
+    crop_cache=None,
+    page_info=None,
+    save_figure=save_figure_to_local,
+):
     """Process a single image (either from file or converted from PDF page)
-    
+
+    Blank pages (no elements) and pure-image pages (a single fig element) are recognized by
+    a cheap ink/connected-component pre-check and skip the model entirely.
+
     Args:
         image: PIL Image object
         model: DOLPHIN model instance
@@ -70,16 +281,40 @@ def process_single_image(image, model, save_dir, image_name, max_batch_size, sav
         image_name: Name for the output file
         max_batch_size: Maximum batch size for processing
         save_individual: Whether to save individual results (False for PDF pages)
-        
+        crop_cache: Optional CropCache of element results
+        page_info: Optional dict, updated with the page fields decided by the pre-check
+            (e.g. {"page_class": "image_only"})
+        save_figure: Callable (pil_crop, save_dir, image_name, reading_order) -> figure filename
+
     Returns:
         Tuple of (json_path, recognition_results)
     """
-    # Stage 1: Page-level layout and reading order parsing
-    layout_output = model.chat("Parse the reading order of this document.", image)
-
-    # Stage 2: Element-level content parsing
-    padded_image, dims = prepare_image(image)
-    recognition_results = process_elements(layout_output, padded_image, dims, model, max_batch_size, save_dir, image_name)
+    precheck = None
+    if getattr(model, "model_args", {}).get("page_precheck"):
+        precheck = precheck_page(image, save_dir, image_name, save_figure=save_figure)
+
+    if precheck is not None:
+        recognition_results, precheck_info = precheck
+        print(f"Page pre-check: {image_name} is {precheck_info['page_class']}, skipping layout parsing")
+        if page_info is not None:
+            page_info.update(precheck_info)
+    else:
+        # Stage 1: Page-level layout and reading order parsing
+        layout_output = profiled_chat(model, LAYOUT_PROMPT, image, "layout", image_name)
+
+        # Stage 2: Element-level content parsing
+        padded_image, dims = prepare_image(image)
+        recognition_results = process_elements(
+            layout_output,
+            padded_image,
+            dims,
+            model,
+            max_batch_size,
+            save_dir,
+            image_name,
+            crop_cache=crop_cache,
+            save_figure=save_figure,
+        )
 
     # Save outputs only if requested (skip for PDF pages)
     json_path = None
@@ -91,88 +326,222 @@ def process_single_image(image, model, save_dir, image_name, max_batch_size, sav
     return json_path, recognition_results
 
 
-def process_elements(layout_results, padded_image, dims, model, max_batch_size, save_dir=None, image_name=None):
-    """Parse all document elements with parallel decoding"""
-    layout_results = parse_layout_string(layout_results)
+def process_elements(
+    layout_results,
+    padded_image,
+    dims,
+    model,
+    max_batch_size,
+    save_dir=None,
+    image_name=None,
+    crop_cache=None,
+    save_figure=save_figure_to_local,
+):
+    """Parse all document elements with parallel decoding, reusing cached results of known crops
+
+    The text/table crops of the page go to model.chat in one call, so with an HTTP
+    backend of utils.inference_backend as model they are sent as /generate_batch requests.
+    """
+    figure_results, text_table_elements = prepare_elements(
+        layout_results, padded_image, dims, save_dir, image_name, save_figure=save_figure
+    )
 
-    text_table_elements = []  # Elements that need processing
-    figure_results = []  # Figure elements (no processing needed)
-    previous_box = None
-    reading_order = 0
+    # Parse text/table elements in parallel
+    recognition_results = figure_results + recognize_elements(text_table_elements, model, max_batch_size, crop_cache)
 
-    # Collect elements for processing
-    for bbox, label in layout_results:
-        try:
-            # Adjust coordinates
-            x1, y1, x2, y2, orig_x1, orig_y1, orig_x2, orig_y2, previous_box = process_coordinates(
-                bbox, padded_image, dims, previous_box
-            )
+    # Sort elements by reading order
+    recognition_results.sort(key=lambda x: x.get("reading_order", 0))
 
-            # Crop and parse element
-            cropped = padded_image[y1:y2, x1:x2]
-            if cropped.size > 0 and cropped.shape[0] > 3 and cropped.shape[1] > 3:
-                if label == "fig":
-                    pil_crop = Image.fromarray(cv2.cvtColor(cropped, cv2.COLOR_BGR2RGB))
-                    
-                    figure_filename = save_figure_to_local(pil_crop, save_dir, image_name, reading_order)
-                    
-                    # For figure regions, store relative path instead of base64
-                    figure_results.append(
-                        {
-                            "label": label,
-                            "text": f"![Figure](figures/{figure_filename})",
-                            "figure_path": f"figures/{figure_filename}",
-                            "bbox": [orig_x1, orig_y1, orig_x2, orig_y2],
-                            "reading_order": reading_order,
-                        }
-                    )
-                else:
-                    # For text or table regions, prepare for parsing
-                    pil_crop = Image.fromarray(cv2.cvtColor(cropped, cv2.COLOR_BGR2RGB))
-                    prompt = "Parse the table in the image." if label == "tab" else "Read text in the image."
-                    text_table_elements.append(
-                        {
-                            "crop": pil_crop,
-                            "prompt": prompt,
-                            "label": label,
-                            "bbox": [orig_x1, orig_y1, orig_x2, orig_y2],
-                            "reading_order": reading_order,
-                        }
-                    )
-
-            reading_order += 1
+    return recognition_results
 
-        except Exception as e:
-            print(f"Error processing bbox with label {label}: {str(e)}")
-            continue
 
-    # Parse text/table elements in parallel
-    recognition_results = figure_results
-    if text_table_elements:
-        crops_list = [elem["crop"] for elem in text_table_elements]
-        prompts_list = [elem["prompt"] for elem in text_table_elements]
-
-        # Inference in batch
-        batch_results = model.chat(prompts_list, crops_list, max_batch_size=max_batch_size)
-
-        # Add batch results to recognition_results
-        for i, result in enumerate(batch_results):
-            elem = text_table_elements[i]
-            recognition_results.append(
+def prepare_elements(
+    layout_results, padded_image, dims, save_dir=None, image_name=None, save_figure=save_figure_to_local
+):
+    """Crop the layout elements of a page and save its figures
+
+    Returns:
+        Tuple of (figure_results, text_table_elements), where text/table elements still
+        carry their crop and prompt for recognition
+    """
+    elements = crop_layout_elements(layout_results, padded_image, dims)
+    return split_elements(elements, save_dir, image_name, save_figure=save_figure)
+
+
+def split_elements(elements, save_dir, image_name, save_figure=save_figure_to_local):
+    """Turn cropped layout elements into figure results and elements to recognize
+
+    Args:
+        elements: Cropped elements from crop_layout_elements
+        save_dir: Directory to save results
+        image_name: Name of the page (used for figure files)
+        save_figure: Callable (pil_crop, save_dir, image_name, reading_order) -> figure filename
+
+    Returns:
+        Tuple of (figure_results, text_table_elements)
+    """
+    text_table_elements = []  # Elements that need processing
+    figure_results = []  # Figure elements (no processing needed)
+
+    for elem in elements:
+        label = elem["label"]
+        if label == "fig":
+            figure_filename = save_figure(elem["crop"], save_dir, image_name, elem["reading_order"])
+
+            # For figure regions, store relative path instead of base64
+            figure_results.append(
                 {
-                    "label": elem["label"],
+                    "label": label,
+                    "text": f"![Figure](figures/{figure_filename})",
+                    "figure_path": f"figures/{figure_filename}",
                     "bbox": elem["bbox"],
-                    "text": result.strip(),
                     "reading_order": elem["reading_order"],
                 }
             )
+        else:
+            # For text or table regions, prepare for parsing
+            elem["prompt"] = "Parse the table in the image." if label == "tab" else "Read text in the image."
+            elem["page"] = image_name
+            text_table_elements.append(elem)
+
+    return figure_results, text_table_elements
 
-    # Sort elements by reading order
-    recognition_results.sort(key=lambda x: x.get("reading_order", 0))
+
+def recognize_elements(text_table_elements, model, max_batch_size, crop_cache=None):
+    """Decode text/table crops in batches
+
+    Args:
+        text_table_elements: Elements with crop, prompt, label, bbox and reading_order
+        model: DOLPHIN model instance
+        max_batch_size: Maximum batch size for decoding
+        crop_cache: Optional CropCache; crops it already holds skip the model
+
+    Returns:
+        List of recognition results aligned with text_table_elements
+    """
+    if not text_table_elements:
+        return []
+
+    texts = [None] * len(text_table_elements)
+    stop_reasons = [None] * len(text_table_elements)
+    to_decode = list(range(len(text_table_elements)))
+
+    if crop_cache is not None:
+        keys = [crop_cache.key(elem["crop"], elem["prompt"]) for elem in text_table_elements]
+        first_index = {}
+        for i, hit in enumerate(crop_cache.get_many(keys)):
+            if hit is not None:
+                texts[i], stop_reasons[i] = hit["text"], hit["stop_reason"]
+            else:
+                # Identical crops of this batch are decoded once
+                first_index.setdefault(keys[i], i)
+        to_decode = list(first_index.values())
+
+    if to_decode:
+        decoded_texts, decoded_reasons = decode_elements(
+            [text_table_elements[i] for i in to_decode], model, max_batch_size
+        )
+        for i, text, stop_reason in zip(to_decode, decoded_texts, decoded_reasons):
+            texts[i], stop_reasons[i] = text, stop_reason
+        if crop_cache is not None:
+            crop_cache.put_many([keys[i] for i in to_decode], decoded_texts, decoded_reasons)
+            for i, text in enumerate(texts):
+                if text is None:
+                    texts[i], stop_reasons[i] = texts[first_index[keys[i]]], stop_reasons[first_index[keys[i]]]
+
+    recognition_results = []
+    for elem, result, stop_reason in zip(text_table_elements, texts, stop_reasons):
+        recognition_result = {
+            "label": elem["label"],
+            "bbox": elem["bbox"],
+            "text": result.strip(),
+            "reading_order": elem["reading_order"],
+        }
+        # Flag outputs that did not end normally so later stages can skip or re-route them
+        if stop_reason in ("repetition", "budget", "max_length"):
+            recognition_result["stop_reason"] = stop_reason
+        recognition_results.append(recognition_result)
 
     return recognition_results
 
 
+def decode_elements(text_table_elements, model, max_batch_size):
+    """Run the model on text/table crops, retrying outputs that fell into a repetition loop
+
+    Returns:
+        Tuple of (texts, stop_reasons) aligned with text_table_elements
+    """
+    crops_list = [elem["crop"] for elem in text_table_elements]
+    prompts_list = [elem["prompt"] for elem in text_table_elements]
+    labels_list = [elem["label"] for elem in text_table_elements]
+
+    # Per-element token budgets from the label and crop size (None when disabled)
+    model_args = getattr(model, "model_args", {})
+    budget_policy = model_args.get("token_budgets")
+    budgets = [token_budget(label, *crop.size, budget_policy) for label, crop in zip(labels_list, crops_list)]
+    if None in budgets:
+        budgets = None
+
+    pages_list = [elem.get("page") for elem in text_table_elements]
+
+    # Inference in batch (labels let the model bucket crops by expected output length)
+    batch_results, stop_reasons = profiled_chat(
+        model,
+        prompts_list,
+        crops_list,
+        labels_list,
+        pages_list,
+        max_batch_size=max_batch_size,
+        labels=labels_list,
+        return_stop_reason=True,
+        max_new_tokens=budgets,
+    )
+
+    # Retry elements that were stopped in a repetition loop once, with a repetition penalty
+    retry_penalty = model_args.get("repetition_retry_penalty")
+    retry_indices = [i for i, reason in enumerate(stop_reasons) if reason == "repetition"]
+    if retry_penalty and retry_indices:
+        print(f"Retrying {len(retry_indices)} element(s) stopped for repetition")
+        retry_results, retry_reasons = profiled_chat(
+            model,
+            [prompts_list[i] for i in retry_indices],
+            [crops_list[i] for i in retry_indices],
+            [labels_list[i] for i in retry_indices],
+            [pages_list[i] for i in retry_indices],
+            max_batch_size=max_batch_size,
+            labels=[labels_list[i] for i in retry_indices],
+            repetition_penalty=retry_penalty,
+            return_stop_reason=True,
+            max_new_tokens=[budgets[i] for i in retry_indices] if budgets else None,
+        )
+        for i, result, reason in zip(retry_indices, retry_results, retry_reasons):
+            batch_results[i] = result
+            stop_reasons[i] = reason
+
+    if budgets:
+        for label, budget, stop_reason in zip(labels_list, budgets, stop_reasons):
+            budget_telemetry.record(label, budget, stop_reason)
+
+    return batch_results, stop_reasons
+
+
+def profiled_chat(model, question, image, profile_labels, profile_pages, **kwargs):
+    """model.chat that records per-output metrics in ocr_profiler while profiling is enabled
+
+    Args:
+        profile_labels: Label (or list of labels, for a batched call) to record the outputs under
+        profile_pages: Page name (or list of page names) of the outputs
+    """
+    if not ocr_profiler.enabled:
+        return model.chat(question, image, **kwargs)
+    *result, metrics = model.chat(question, image, return_metrics=True, **kwargs)
+    if isinstance(question, list):
+        ocr_profiler.record_many(profile_labels, profile_pages, metrics)
+    else:
+        ocr_profiler.record(profile_labels, profile_pages, metrics)
+    return result[0] if len(result) == 1 else tuple(result)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Document parsing based on DOLPHIN")
     parser.add_argument("--config", default="./config/Dolphin.yaml", help="Path to configuration file")
@@ -189,17 +558,154 @@ def main():
         default=4,
         help="Maximum number of document elements to parse in a single batch (default: 4)",
     )
+    parser.add_argument(
+        "--pages_per_batch",
+        type=int,
+        default=1,
+        help="Number of PDF pages whose elements are pooled into shared batches (default: 1)",
+    )
+    parser.add_argument(
+        "--pipeline_workers",
+        type=int,
+        default=0,
+        help="Run PDFs through the staged OCR pipeline with this many rasterize/crop processes (default: 0, serial)",
+    )
+    parser.add_argument(
+        "--length_bucketing",
+        action="store_true",
+        help="Batch element crops of similar expected output length together",
+    )
+    parser.add_argument(
+        "--crop_cache",
+        type=str,
+        default=None,
+        help="SQLite file caching element results across pages, documents and runs, local backend only "
+        "(default: no cache)",
+    )
+    parser.add_argument(
+        "--crop_cache_mode",
+        choices=["exact", "perceptual"],
+        default="exact",
+        help="Key cached crops by exact pixels or by perceptual hash (default: exact)",
+    )
+    parser.add_argument(
+        "--no_resume",
+        action="store_true",
+        help="Reprocess every PDF page instead of resuming from recognition_json/pages",
+    )
+    parser.add_argument(
+        "--text_layer",
+        action="store_true",
+        help="Read PDF pages with a good born-digital text layer directly instead of running OCR on them",
+    )
+    parser.add_argument(
+        "--model_workers",
+        type=int,
+        default=0,
+        help="Decode with this many CPU processes sharing one copy of the model weights (default: 0, in-process)",
+    )
+    parser.add_argument(
+        "--figure_format",
+        choices=["png", "webp", "jpeg"],
+        default="png",
+        help="Image format of saved figure crops (default: png)",
+    )
+    parser.add_argument(
+        "--figure_dedup",
+        action="store_true",
+        help="Name figures by content hash so each unique figure is stored once",
+    )
+    parser.add_argument(
+        "--figure_thumbnails",
+        type=int,
+        default=0,
+        help="Also write figure thumbnails of this longest side to markdown/figures/thumbs (default: 0, none)",
+    )
+    parser.add_argument(
+        "--figure_workers",
+        type=int,
+        default=2,
+        help="Threads encoding and writing figures in the background (default: 2)",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["local", "vllm", "tensorrt"],
+        default="local",
+        help="Run the model in-process or on a vLLM/TensorRT-LLM inference server (default: local)",
+    )
+    parser.add_argument(
+        "--server_url",
+        type=str,
+        default=None,
+        help="Address of the inference server of the vllm/tensorrt backends, e.g. http://gpu-box:8000",
+    )
+    parser.add_argument(
+        "--server_concurrency",
+        type=int,
+        default=4,
+        help="Most requests in flight to the inference server (default: 4)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Write per-element OCR timings to recognition_json/<name>.profile.json and print the slowest labels/pages",
+    )
+    parser.add_argument(
+        "--stream_results",
+        action="store_true",
+        help="Write PDF pages to recognition_json/<name>.jsonl and markdown as they finish",
+    )
+    parser.add_argument(
+        "--no_combined_json",
+        action="store_true",
+        help="With --stream_results, skip exporting the combined recognition_json/<name>.json",
+    )
     args = parser.parse_args()
 
+    # The pipeline writes each document's combined results itself and does not stream pages
+    if args.pipeline_workers > 0 and (args.stream_results or args.no_combined_json):
+        raise ValueError("--stream_results and --no_combined_json are not supported with --pipeline_workers")
+
     # Load Model
     config = OmegaConf.load(args.config)
-    model = DOLPHIN(config)
+    if args.length_bucketing:
+        config.model.length_bucketing = True
+    if args.backend == "local":
+        model = DOLPHIN(config)
+    else:
+        if args.profile or args.model_workers > 0:
+            raise ValueError("--profile and --model_workers need the local backend")
+        # The servers decode without the settings the crop cache is keyed by (token budgets,
+        # repetition stopping) and report no stop reasons, so their outputs are not cached
+        if args.crop_cache:
+            raise ValueError("--crop_cache needs the local backend")
+        # Only pre-/post-processing runs here; the inference server does the decoding
+        model = create_backend(args.backend, config, url=args.server_url, max_concurrency=args.server_concurrency)
+
+    model_workers = None
+    if args.model_workers > 0:
+        from model_workers import SharedModelWorkers
+
+        model = model_workers = SharedModelWorkers(model, num_workers=args.model_workers)
+
+    figure_writer = FigureWriter(
+        num_workers=args.figure_workers,
+        image_format=args.figure_format,
+        thumbnail_size=args.figure_thumbnails,
+        dedup=args.figure_dedup,
+    )
+
+    crop_cache = None
+    if args.crop_cache:
+        from utils.crop_cache import CropCache
+
+        crop_cache = CropCache(args.crop_cache, model.model_args, mode=args.crop_cache_mode)
 
     # Collect Document Files (images and PDFs)
     if os.path.isdir(args.input_path):
         # Support both image and PDF files
         file_extensions = [".jpg", ".jpeg", ".png", ".JPG", ".JPEG", ".PNG", ".pdf", ".PDF"]
-        
+
         document_files = []
         for ext in file_extensions:
             document_files.extend(glob.glob(os.path.join(args.input_path, f"*{ext}")))
@@ -207,14 +713,14 @@ def main():
     else:
         if not os.path.exists(args.input_path):
             raise FileNotFoundError(f"Input path {args.input_path} does not exist")
-        
+
         # Check if it's a supported file type
         file_ext = os.path.splitext(args.input_path)[1].lower()
         supported_exts = ['.jpg', '.jpeg', '.png', '.pdf']
-        
+
         if file_ext not in supported_exts:
             raise ValueError(f"Unsupported file type: {file_ext}. Supported types: {supported_exts}")
-        
+
         document_files = [args.input_path]
 
     save_dir = args.save_dir or (
@@ -225,23 +731,71 @@ def main():
     total_samples = len(document_files)
     print(f"\nTotal files to process: {total_samples}")
 
+    ocr_profiler.enabled = args.profile
+    profile_paths = []
+
+    pipeline = None
+    if args.pipeline_workers > 0:
+        from ocr_pipeline import OCRPipeline
+
+        pipeline = OCRPipeline(
+            model,
+            save_dir,
+            max_batch_size=args.max_batch_size,
+            pages_per_batch=args.pages_per_batch,
+            num_workers=args.pipeline_workers,
+            crop_cache=crop_cache,
+            resume=not args.no_resume,
+            text_layer=args.text_layer,
+            figure_writer=figure_writer,
+        )
+
     # Process All Document Files
     for file_path in document_files:
         print(f"\nProcessing {file_path}")
         try:
-            json_path, recognition_results = process_document(
-                document_path=file_path,
-                model=model,
-                save_dir=save_dir,
-                max_batch_size=args.max_batch_size,
-            )
-
+            if pipeline is not None:
+                json_path, recognition_results = pipeline.process_document(file_path)
+            else:
+                json_path, recognition_results = process_document(
+                    document_path=file_path,
+                    model=model,
+                    save_dir=save_dir,
+                    max_batch_size=args.max_batch_size,
+                    pages_per_batch=args.pages_per_batch,
+                    crop_cache=crop_cache,
+                    resume=not args.no_resume,
+                    text_layer=args.text_layer,
+                    save_figure=figure_writer,
+                    stream_results=args.stream_results,
+                    export_json=not args.no_combined_json,
+                )
+                figure_writer.flush()
+
+            if args.profile:
+                profile_paths.append(ocr_profiler.write(profile_path(save_dir, file_path), file_path))
             print(f"Processing completed. Results saved to {save_dir}")
 
         except Exception as e:
             print(f"Error processing {file_path}: {str(e)}")
+            ocr_profiler.reset()
             continue
 
+    if pipeline is not None:
+        pipeline.close()
+        pipeline.print_report()
+    if model_workers is not None:
+        model_workers.close()
+    if args.backend != "local":
+        model.close()
+    figure_writer.close()
+    figure_writer.print_summary()
+    budget_telemetry.print_summary()
+    print_profile_summary(profile_paths)
+    if crop_cache is not None:
+        crop_cache.print_summary()
+        crop_cache.close()
+
 
 if __name__ == "__main__":
     main()
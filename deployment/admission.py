@@ -0,0 +1,254 @@
+"""
+Admission control, deadlines and metrics shared by the Dolphin inference servers
+
+Both deployment/vllm/api_server.py and deployment/tensorrt_llm/api_server.py wrap their
+FastAPI app in AdmissionMiddleware, so they behave the same under load:
+    - at most max_in_flight generate requests are admitted; the rest are turned away at
+      once with 429 and a Retry-After estimate instead of queueing until clients time out
+    - every admitted request runs under a deadline (the X-Deadline-Seconds request header,
+      capped at request_timeout) and is cancelled with 504 when it passes it
+    - a request whose client disconnects before its response is complete is cancelled at
+      once instead of decoding until its deadline
+    - GET /metrics returns the in-flight count, request/rejection/timeout counters, the
+      histogram of engine batch sizes, tokens/second and p50/p95/p99 latency as JSON
+
+The servers report batches and generated tokens through ServerMetrics.record_batch: the
+TensorRT server per batched runner call, the vLLM server (whose engine batches internally)
+per request, with the number of (prompt, image) pairs as the batch size.
+"""
+
+import asyncio
+import contextlib
+import json
+import math
+import threading
+import time
+from collections import Counter, deque
+from typing import Callable, Dict, Optional, Sequence
+
+GENERATE_PATHS = ("/generate", "/generate_batch")
+DEADLINE_HEADER = b"x-deadline-seconds"
+
+
+def percentile(values: Sequence[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile (q in 0-100), None for no values"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+class ServerMetrics:
+    """Counters of an inference server (thread-safe: engines report from worker threads)
+
+    Args:
+        window: Seconds of generated tokens the tokens/second rate is computed over
+        latency_samples: Number of most recent request latencies kept for the percentiles
+        clock: Time source (seconds), replaceable for tests
+    """
+
+    def __init__(self, window: float = 60.0, latency_samples: int = 2048, clock: Callable[[], float] = time.monotonic):
+        self.window = window
+        self.clock = clock
+        self.latencies = deque(maxlen=latency_samples)
+        self.batch_sizes = Counter()
+        self.tokens = deque()  # (time, tokens) of recent batches
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def record_request(self, status: int, seconds: float):
+        with self._lock:
+            self.counts["requests"] += 1
+            self.counts[f"status_{status}"] += 1
+            if status < 400:
+                self.latencies.append(seconds)
+
+    def record_rejected(self):
+        with self._lock:
+            self.counts["rejected"] += 1
+
+    def record_timed_out(self):
+        with self._lock:
+            self.counts["timed_out"] += 1
+
+    def record_disconnected(self):
+        with self._lock:
+            self.counts["disconnected"] += 1
+
+    def record_batch(self, size: int, tokens: int = 0):
+        """One engine batch of size inputs that generated tokens tokens"""
+        with self._lock:
+            self.batch_sizes[size] += 1
+            self.tokens.append((self.clock(), tokens))
+
+    def latency(self, q: float) -> Optional[float]:
+        with self._lock:
+            return percentile(list(self.latencies), q)
+
+    def snapshot(self, in_flight: int = 0, max_in_flight: int = 0) -> Dict:
+        now = self.clock()
+        with self._lock:
+            while self.tokens and self.tokens[0][0] < now - self.window:
+                self.tokens.popleft()
+            latencies = list(self.latencies)
+            recent_tokens = sum(tokens for _, tokens in self.tokens)
+            return {
+                "in_flight": in_flight,
+                "max_in_flight": max_in_flight,
+                "requests": self.counts["requests"],
+                "rejected": self.counts["rejected"],
+                "timed_out": self.counts["timed_out"],
+                "disconnected": self.counts["disconnected"],
+                "status_counts": {
+                    key[len("status_") :]: value
+                    for key, value in sorted(self.counts.items())
+                    if key.startswith("status_")
+                },
+                "batch_size_histogram": {str(size): count for size, count in sorted(self.batch_sizes.items())},
+                "tokens_per_second": round(recent_tokens / self.window, 2),
+                "latency_seconds": {
+                    f"p{q}": round(value, 4) if value is not None else None
+                    for q, value in ((q, percentile(latencies, q)) for q in (50, 95, 99))
+                },
+            }
+
+
+class AdmissionController:
+    """In-flight limit and deadlines of generate requests
+
+    Args:
+        max_in_flight: Most generate requests admitted at once (0: unlimited)
+        request_timeout: Longest deadline of a request in seconds
+        metrics: ServerMetrics to report to
+    """
+
+    def __init__(self, max_in_flight: int = 64, request_timeout: float = 600.0, metrics: ServerMetrics = None):
+        self.max_in_flight = max_in_flight
+        self.request_timeout = request_timeout
+        self.metrics = metrics or ServerMetrics()
+        self.in_flight = 0
+
+    def try_admit(self) -> bool:
+        """Take an in-flight slot; False when the server is full (runs on the event loop only)"""
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            self.metrics.record_rejected()
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+
+    def retry_after(self) -> int:
+        """Seconds a rejected client should wait: about one median request"""
+        p50 = self.metrics.latency(50)
+        return max(1, math.ceil(p50)) if p50 else 1
+
+    def deadline(self, requested: Optional[float]) -> float:
+        if requested is None or requested <= 0:
+            return self.request_timeout
+        return min(requested, self.request_timeout)
+
+    def snapshot(self) -> Dict:
+        return self.metrics.snapshot(self.in_flight, self.max_in_flight)
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying an AdmissionController to the generate endpoints
+
+    Usage:
+        app.add_middleware(AdmissionMiddleware, controller=controller)
+    """
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        if scope["path"] == "/metrics" and scope["method"] == "GET":
+            return await _send_json(send, 200, self.controller.snapshot())
+        if scope["path"] not in GENERATE_PATHS:
+            return await self.app(scope, receive, send)
+
+        if not self.controller.try_admit():
+            retry_after = self.controller.retry_after()
+            return await _send_json(
+                send, 429, {"error": "server busy"}, headers=[(b"retry-after", str(retry_after).encode())]
+            )
+
+        requested = dict(scope.get("headers") or []).get(DEADLINE_HEADER)
+        try:
+            deadline = self.controller.deadline(float(requested) if requested else None)
+        except ValueError:
+            deadline = self.controller.request_timeout
+        state = {"status": 500, "started": False, "complete": False}
+        disconnected = asyncio.Event()
+        watcher = None
+
+        async def watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+
+        async def tracked_receive():
+            # Once the body is read, the watcher is the only reader of receive
+            nonlocal watcher
+            if watcher is not None:
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+            elif not message.get("more_body", False):
+                watcher = asyncio.ensure_future(watch_disconnect())
+            return message
+
+        async def tracked_send(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                state["started"] = True
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                state["complete"] = True
+            await send(message)
+
+        start = time.perf_counter()
+        handler = asyncio.ensure_future(self.app(scope, tracked_receive, tracked_send))
+        disconnect = asyncio.ensure_future(disconnected.wait())
+        try:
+            await asyncio.wait({handler, disconnect}, timeout=deadline, return_when=asyncio.FIRST_COMPLETED)
+            if state["complete"] or (handler.done() and not disconnected.is_set()):
+                await handler
+            else:
+                handler.cancel()
+                if disconnected.is_set():
+                    # The client is gone: stop generating for it now rather than at the deadline
+                    self.controller.metrics.record_disconnected()
+                    state["status"] = 499
+                else:
+                    self.controller.metrics.record_timed_out()
+                    state["status"] = 504
+                    if not state["started"]:
+                        await _send_json(send, 504, {"error": f"deadline of {deadline:g}s exceeded"})
+                with contextlib.suppress(asyncio.CancelledError):
+                    await handler
+        finally:
+            for task in (handler, disconnect, watcher):
+                if task is not None and not task.done():
+                    task.cancel()
+            self.controller.release()
+            self.controller.metrics.record_request(state["status"], time.perf_counter() - start)
+
+
+async def _send_json(send, status: int, body: Dict, headers=None):
+    payload = json.dumps(body).encode("utf-8")
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())]
+            + list(headers or []),
+        }
+    )
+    await send({"type": "http.response.body", "body": payload})
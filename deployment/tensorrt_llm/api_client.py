@@ -11,12 +11,16 @@ For production use, we recommend `vllm serve` and the OpenAI client API.
 
 import argparse
 import base64
+import importlib.util
 import json
+import os
 from argparse import Namespace
 from collections.abc import Iterable
 
 import requests
 
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 
 def clear_line(n: int = 1) -> None:
     LINE_UP = "\033[1A"
@@ -47,6 +51,19 @@ def post_http_request(
     return response
 
 
+def load_inference_backend():
+    """utils/inference_backend.py of the repo, imported by file path.
+
+    The utils.py next to this script shadows the repo's utils package.
+    """
+    spec = importlib.util.spec_from_file_location(
+        "inference_backend", os.path.join(REPO_DIR, "utils", "inference_backend.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
 def get_streaming_response(response: requests.Response) -> Iterable[list[str]]:
     for chunk in response.iter_lines(
             chunk_size=8192, decode_unicode=False, delimiter=b"\n"
@@ -70,10 +87,26 @@ def parse_args():
     parser.add_argument("--prompt", type=str, default="Parse the reading order of this document.")
     parser.add_argument("--image_path", type=str, default="./demo/page_imgs/page_1.jpeg")
     parser.add_argument("--stream", action="store_true")
+    parser.add_argument(
+        "--image_paths",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Send these images with --prompt in one /generate_batch request",
+    )
     return parser.parse_args()
 
 
 def main(args: Namespace):
+    if args.image_paths:
+        backend = load_inference_backend().TensorRTBackend(f"http://{args.host}:{args.port}")
+        prompts = [args.prompt] * len(args.image_paths)
+        outputs = backend.chat(prompts, args.image_paths, max_batch_size=len(prompts))
+        for image_path, output in zip(args.image_paths, outputs):
+            print(f"{image_path}: {output!r}", flush=True)
+        backend.close()
+        return
+
     prompt = args.prompt
     image_path = args.image_path
     api_url = f"http://{args.host}:{args.port}/generate"
@@ -4,19 +4,25 @@
 import asyncio
 import base64
 import io
+import json
 import logging
+import os
 import signal
+import sys
 from http import HTTPStatus
-from PIL import Image
 from typing import Optional
 
 import click
 import uvicorn
+from batcher import MicroBatcher
+from dolphin_runner import DolphinRunner, InferenceConfig
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse, Response
-
+from PIL import Image
 from tensorrt_llm.executor import CppExecutorError, RequestError
-from dolphin_runner import DolphinRunner, InferenceConfig
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from admission import AdmissionController, AdmissionMiddleware  # noqa: E402
 
 TIMEOUT_KEEP_ALIVE = 5  # seconds.
 
@@ -28,14 +34,35 @@ async def decode_image(image_base64: str) -> Image.Image:
 
 
 class LlmServer:
-    def __init__(self, runner: DolphinRunner):
+    def __init__(
+        self,
+        runner: DolphinRunner,
+        max_batch_size: int = 16,
+        max_new_tokens: int = 4024,
+        max_wait_ms: float = 10.0,
+        max_in_flight: int = 64,
+        request_timeout: float = 600.0,
+    ):
         self.runner = runner
+        self.max_new_tokens = max_new_tokens
+        # Concurrent requests are coalesced into batched runner calls off the event loop
+        self.batcher = MicroBatcher(self.run_batch, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+        self.admission = AdmissionController(max_in_flight=max_in_flight, request_timeout=request_timeout)
         self.app = FastAPI()
+        # In-flight limit (429), per-request deadlines (504) and GET /metrics
+        self.app.add_middleware(AdmissionMiddleware, controller=self.admission)
         self.register_routes()
 
+    def run_batch(self, prompts, images, max_new_tokens):
+        outputs = self.runner.run(prompts, images, max_new_tokens)
+        tokens = sum(len(self.runner.tokenizer(texts[0], add_special_tokens=False).input_ids) for texts in outputs)
+        self.admission.metrics.record_batch(len(prompts), tokens)
+        return outputs
+
     def register_routes(self):
         self.app.add_api_route("/health", self.health, methods=["GET"])
         self.app.add_api_route("/generate", self.generate, methods=["POST"])
+        self.app.add_api_route("/generate_batch", self.generate_batch, methods=["POST"])
 
     async def health(self) -> Response:
         return Response(status_code=200)
@@ -55,9 +82,38 @@ class LlmServer:
         image = await decode_image(image_base64)
 
         try:
-            output_texts = self.runner.run([prompt], [image], 4024)
-            output_texts = [texts[0] for texts in output_texts]
-            return JSONResponse({"text": output_texts[0]})
+            output_text = await self.batcher.submit(prompt, image, self.max_new_tokens)
+            return JSONResponse({"text": output_text})
+        except RequestError as e:
+            return JSONResponse(content=str(e), status_code=HTTPStatus.BAD_REQUEST)
+        except CppExecutorError:
+            # If internal executor error is raised, shutdown the server
+            signal.raise_signal(signal.SIGINT)
+
+    async def generate_batch(self, request: Request) -> Response:
+        """Generate completions for many (prompt, image) pairs in one request.
+
+        The request should be multipart/form-data with the following fields:
+        - prompts: JSON list of prompts, one per image (or a single prompt string used for every image).
+        - images: the raw image files (repeated field), in prompt order.
+        The response is a JSON object {"text": [...]} with the output of every pair, in request order.
+        """
+        form = await request.form()
+        images = [Image.open(io.BytesIO(await image.read())) for image in form.getlist("images")]
+        prompts = json.loads(form.get("prompts", "[]"))
+        if isinstance(prompts, str):
+            prompts = [prompts] * len(images)
+        if len(prompts) != len(images):
+            return JSONResponse(
+                content=f"{len(prompts)} prompts for {len(images)} images", status_code=HTTPStatus.BAD_REQUEST
+            )
+
+        try:
+            # The pairs join the micro-batcher like concurrent single requests
+            output_texts = await asyncio.gather(
+                *(self.batcher.submit(prompt, image, self.max_new_tokens) for prompt, image in zip(prompts, images))
+            )
+            return JSONResponse({"text": list(output_texts)})
         except RequestError as e:
             return JSONResponse(content=str(e),
                                 status_code=HTTPStatus.BAD_REQUEST)
@@ -80,15 +136,33 @@ class LlmServer:
 @click.option("--llm_engine_dir", type=str, required=True)
 @click.option("--max_batch_size", type=int, default=16)
 @click.option("--max_new_tokens", type=int, default=4024)
+@click.option("--max_wait_ms", type=float, default=10.0, help="How long a request waits for others to share its batch")
+@click.option(
+    "--max_in_flight",
+    type=int,
+    default=64,
+    help="Most generate requests in flight; more are rejected with 429 (0: unlimited)",
+)
+@click.option(
+    "--request_timeout",
+    type=float,
+    default=600.0,
+    help="Longest deadline of a request in seconds; clients may ask for less with X-Deadline-Seconds",
+)
 @click.option("--host", type=str, default=None)
 @click.option("--port", type=int, default=8000)
-def entrypoint(hf_model_dir: str,
-               visual_engine_dir: str,
-               llm_engine_dir: str,
-               max_batch_size: int,
-               max_new_tokens: int,
-               host: Optional[str] = None,
-               port: int = 8000):
+def entrypoint(
+    hf_model_dir: str,
+    visual_engine_dir: str,
+    llm_engine_dir: str,
+    max_batch_size: int,
+    max_new_tokens: int,
+    max_wait_ms: float,
+    max_in_flight: int,
+    request_timeout: float,
+    host: Optional[str] = None,
+    port: int = 8000,
+):
     host = host or "0.0.0.0"
     port = port or 8000
     logging.info(f"Starting server at {host}:{port}")
@@ -103,10 +177,17 @@ def entrypoint(hf_model_dir: str,
     )
 
     dolphin_runner = DolphinRunner(config)
-    server = LlmServer(runner=dolphin_runner)
+    server = LlmServer(
+        runner=dolphin_runner,
+        max_batch_size=max_batch_size,
+        max_new_tokens=max_new_tokens,
+        max_wait_ms=max_wait_ms,
+        max_in_flight=max_in_flight,
+        request_timeout=request_timeout,
+    )
 
     asyncio.run(server(host, port))
 
 
 if __name__ == "__main__":
-    entrypoint()
\ No newline at end of file
+    entrypoint()
@@ -0,0 +1,120 @@
+"""
+Request-coalescing micro-batcher for the Dolphin TensorRT-LLM api_server
+
+Each /generate request used to call DolphinRunner.run on its own, at batch size 1 and on
+the event loop thread. MicroBatcher queues concurrent requests instead: it waits up to
+max_wait_ms after the first one (or until max_batch_size are queued), runs them as one
+batched runner call on a worker thread and hands every caller its own output.
+
+DolphinRunner.run tokenizes its prompts without padding, so only requests with the same
+prompt (and max_new_tokens) share a runner call; a mixed group is split by prompt.
+"""
+
+import asyncio
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Sequence
+
+
+class MicroBatcher:
+    """Coalesces concurrent generate requests into batched runner calls
+
+    Args:
+        run_batch: Callable (prompts, images, max_new_tokens) -> one list of texts per input,
+            e.g. DolphinRunner.run
+        max_batch_size: Most requests per runner call
+        max_wait_ms: Longest time the first request of a batch waits for others to join
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[str], List[Any], int], Sequence[Sequence[str]]],
+        max_batch_size: int = 16,
+        max_wait_ms: float = 10.0,
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        # The engine runs one batch at a time; requests arriving meanwhile form the next one
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dolphin-runner")
+        self.queue: Optional[asyncio.Queue] = None
+        self.worker: Optional[asyncio.Task] = None
+        self.batch_sizes: List[int] = []
+
+    async def submit(self, prompt: str, image: Any, max_new_tokens: int) -> str:
+        """Queue one request and wait for its output text
+
+        Raises:
+            The exception of the runner call the request was part of
+        """
+        if self.worker is None:
+            self.queue = asyncio.Queue()
+            self.worker = asyncio.get_running_loop().create_task(self._collect())
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((prompt, image, max_new_tokens, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = batch[0][4] + self.max_wait
+            while len(batch) < self.max_batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            groups = defaultdict(list)
+            for request in batch:
+                groups[(request[0], request[2])].append(request)
+            for (prompt, max_new_tokens), requests in groups.items():
+                await self._run(loop, prompt, max_new_tokens, requests)
+
+    async def _run(self, loop, prompt, max_new_tokens, requests):
+        # Callers cancelled while queued (e.g. past their deadline) are not run
+        requests = [request for request in requests if not request[3].done()]
+        if not requests:
+            return
+        self.batch_sizes.append(len(requests))
+        try:
+            outputs = await loop.run_in_executor(
+                self.executor,
+                self.run_batch,
+                [prompt] * len(requests),
+                [request[1] for request in requests],
+                max_new_tokens,
+            )
+        except Exception as e:
+            self._fail(requests, e)
+            return
+        if len(outputs) != len(requests):
+            self._fail(requests, RuntimeError(f"Runner returned {len(outputs)} outputs for {len(requests)} inputs"))
+            return
+        for request, texts in zip(requests, outputs):
+            if not request[3].done():
+                request[3].set_result(texts[0])
+
+    @staticmethod
+    def _fail(requests, error):
+        for request in requests:
+            if not request[3].done():
+                request[3].set_exception(error)
+
+    async def close(self):
+        """Stop collecting requests and wait for the runner thread"""
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+        self.executor.shutdown(wait=True)
@@ -12,11 +12,15 @@ For production use, we recommend `vllm serve` and the OpenAI client API.
 import argparse
 import base64
 import json
+import os
+import sys
 from argparse import Namespace
 from collections.abc import Iterable
 
 import requests
 
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 
 def clear_line(n: int = 1) -> None:
     LINE_UP = "\033[1A"
@@ -74,10 +78,29 @@ def parse_args():
     parser.add_argument("--prompt", type=str, default="Parse the reading order of this document.")
     parser.add_argument("--image_path", type=str, default="./demo/page_imgs/page_1.jpeg")
     parser.add_argument("--stream", action="store_true")
+    parser.add_argument(
+        "--image_paths",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Send these images with --prompt in one /generate_batch request",
+    )
     return parser.parse_args()
 
 
 def main(args: Namespace):
+    if args.image_paths:
+        sys.path.insert(0, REPO_DIR)
+        from utils.inference_backend import VLLMBackend
+
+        backend = VLLMBackend(f"http://{args.host}:{args.port}")
+        prompts = [args.prompt] * len(args.image_paths)
+        outputs = backend.chat(prompts, args.image_paths, max_batch_size=len(prompts))
+        for image_path, output in zip(args.image_paths, outputs):
+            print(f"{image_path}: {output!r}", flush=True)
+        backend.close()
+        return
+
     prompt = args.prompt
     image_path = args.image_path
     api_url = f"http://{args.host}:{args.port}/generate"
@@ -9,21 +9,21 @@ change `vllm/entrypoints/openai/api_server.py` instead.
 
 import asyncio
 import base64
-import json
 import io
+import json
+import os
 import ssl
+import sys
 from argparse import Namespace
 from collections.abc import AsyncGenerator
-from PIL import Image
-from typing import Any, Optional
+from typing import Any, Dict, Optional
 
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse, Response, StreamingResponse
-
+from PIL import Image
 from vllm.engine.arg_utils import AsyncEngineArgs
 from vllm.engine.async_llm_engine import AsyncLLMEngine
 from vllm.entrypoints.launcher import serve_http
-from vllm.entrypoints.utils import with_cancellation
 from vllm.inputs import ExplicitEncoderDecoderPrompt, TextPrompt, TokensPrompt
 from vllm.logger import init_logger
 from vllm.sampling_params import SamplingParams
@@ -31,11 +31,15 @@ from vllm.usage.usage_lib import UsageContext
 from vllm.utils import FlexibleArgumentParser, random_uuid, set_ulimit
 from vllm.version import __version__ as VLLM_VERSION
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from admission import AdmissionController, AdmissionMiddleware  # noqa: E402
+
 logger = init_logger("api_server")
 
 TIMEOUT_KEEP_ALIVE = 5  # seconds.
 app = FastAPI()
 engine = None
+admission = AdmissionController()
 
 
 @app.get("/health")
@@ -57,17 +61,46 @@ async def generate(request: Request) -> Response:
     return await _generate(request_dict, raw_request=request)
 
 
+@app.post("/generate_batch")
+async def generate_batch(request: Request) -> Response:
+    """Generate completions for many (prompt, image) pairs in one request.
+
+    The request should be multipart/form-data with the following fields:
+    - prompts: JSON list of decoder prompts, one per image (or a single
+      prompt string used for every image).
+    - images: the raw image files (repeated field), in prompt order.
+    - sampling_params: optional JSON object of sampling parameters.
+    The response is a JSON object {"text": [...]} with the generated text of
+    every pair, in request order.
+    """
+    form = await request.form()
+    images = [await image.read() for image in form.getlist("images")]
+    prompts = json.loads(form.get("prompts", "[]"))
+    if isinstance(prompts, str):
+        prompts = [prompts] * len(images)
+    if len(prompts) != len(images):
+        return JSONResponse({"error": f"{len(prompts)} prompts for {len(images)} images"}, status_code=400)
+    batch = {
+        "prompts": prompts,
+        "images": images,
+        "sampling_params": json.loads(form.get("sampling_params", "{}")),
+    }
+    return await _generate_batch(batch, raw_request=request)
+
+
 async def decode_image(image_base64: str) -> Image.Image:
     image_data = base64.b64decode(image_base64)
     image = Image.open(io.BytesIO(image_data))
     return image
 
 
-async def custom_process_prompt(encoder_prompt: str, decoder_prompt: str,
-                                image_base64: str) -> ExplicitEncoderDecoderPrompt:
+async def custom_process_prompt(
+    encoder_prompt: str, decoder_prompt: str, image_base64: str = "", image: Optional[Image.Image] = None
+) -> ExplicitEncoderDecoderPrompt:
     assert engine is not None
     tokenizer = engine.engine.get_tokenizer_group().tokenizer
-    image = await decode_image(image_base64)
+    if image is None:
+        image = await decode_image(image_base64)
 
     if encoder_prompt == "":
         encoder_prompt = "0" * 783  # For Dolphin
@@ -86,30 +119,58 @@ async def custom_process_prompt(encoder_prompt: str, decoder_prompt: str,
     return enc_dec_prompt
 
 
-@with_cancellation
+async def _engine_outputs(
+    enc_dec_prompt: ExplicitEncoderDecoderPrompt, sampling_params: SamplingParams, generated: Dict[str, int]
+) -> AsyncGenerator[Any, None]:
+    """engine.generate under a fresh request id, aborted in the engine when cancelled.
+
+    The generate handlers are not wrapped in with_cancellation: AdmissionMiddleware
+    cancels them when the client disconnects or the request deadline passes, and
+    with_cancellation would only cancel its own wrapper and leave the engine decoding
+    after the 504. generated[request_id] counts the tokens generated so far, so
+    cancelled requests reach the metrics too.
+    """
+    assert engine is not None
+    request_id = random_uuid()
+    generated[request_id] = 0
+    try:
+        async for request_output in engine.generate(enc_dec_prompt, sampling_params, request_id):
+            generated[request_id] = sum(len(output.token_ids) for output in request_output.outputs)
+            yield request_output
+    except asyncio.CancelledError:
+        await engine.abort(request_id)
+        raise
+
+
+def _record(generated: Dict[str, int]):
+    if generated:
+        admission.metrics.record_batch(len(generated), sum(generated.values()))
+
+
 async def _generate(request_dict: dict, raw_request: Request) -> Response:
     encoder_prompt = request_dict.pop("encoder_prompt", "")
     decoder_prompt = request_dict.pop("decoder_prompt", "")
     image_base64 = request_dict.pop("image_base64", "")
     stream = request_dict.pop("stream", False)
     sampling_params = SamplingParams(**request_dict)
-    request_id = random_uuid()
 
     assert engine is not None
 
     enc_dec_prompt = await custom_process_prompt(encoder_prompt, decoder_prompt, image_base64)
-    results_generator = engine.generate(enc_dec_prompt, sampling_params, request_id)
+    generated: Dict[str, int] = {}
+    results_generator = _engine_outputs(enc_dec_prompt, sampling_params, generated)
 
     # Streaming case
     async def stream_results() -> AsyncGenerator[bytes, None]:
-        async for request_output in results_generator:
-            prompt = request_output.prompt
-            assert prompt is not None
-            text_outputs = [
-                prompt + output.text for output in request_output.outputs
-            ]
-            ret = {"text": text_outputs}
-            yield (json.dumps(ret) + "\n").encode("utf-8")
+        try:
+            async for request_output in results_generator:
+                prompt = request_output.prompt
+                assert prompt is not None
+                text_outputs = [prompt + output.text for output in request_output.outputs]
+                ret = {"text": text_outputs}
+                yield (json.dumps(ret) + "\n").encode("utf-8")
+        finally:
+            _record(generated)
 
     if stream:
         return StreamingResponse(stream_results())
@@ -119,8 +180,8 @@ async def _generate(request_dict: dict, raw_request: Request) -> Response:
     try:
         async for request_output in results_generator:
             final_output = request_output
-    except asyncio.CancelledError:
-        return Response(status_code=499)
+    finally:
+        _record(generated)
 
     assert final_output is not None
     prompt = final_output.prompt
@@ -130,10 +191,37 @@ async def _generate(request_dict: dict, raw_request: Request) -> Response:
     return JSONResponse(ret)
 
 
+async def _generate_batch(batch: dict, raw_request: Request) -> Response:
+    assert engine is not None
+    params = SamplingParams(**batch["sampling_params"])
+    generated: Dict[str, int] = {}
+
+    async def _generate_one(decoder_prompt: str, image_data: bytes) -> str:
+        image = Image.open(io.BytesIO(image_data))
+        enc_dec_prompt = await custom_process_prompt("", decoder_prompt, image=image)
+        final_output = None
+        # The engine batches the concurrent requests itself
+        async for request_output in _engine_outputs(enc_dec_prompt, params, generated):
+            final_output = request_output
+        assert final_output is not None
+        return final_output.outputs[0].text.strip()
+
+    try:
+        texts = await asyncio.gather(
+            *(_generate_one(prompt, image) for prompt, image in zip(batch["prompts"], batch["images"]))
+        )
+    finally:
+        _record(generated)
+    return JSONResponse({"text": list(texts)})
+
+
 def build_app(args: Namespace) -> FastAPI:
-    global app
+    global app, admission
 
     app.root_path = args.root_path
+    # In-flight limit (429), per-request deadlines (504) and GET /metrics
+    admission = AdmissionController(max_in_flight=args.max_in_flight, request_timeout=args.request_timeout)
+    app.add_middleware(AdmissionMiddleware, controller=admission)
     return app
 
 
@@ -209,6 +297,18 @@ if __name__ == "__main__":
         default=None,
         help="FastAPI root_path when app is behind a path based routing proxy")
     parser.add_argument("--log-level", type=str, default="debug")
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=64,
+        help="Most generate requests in flight; more are rejected with 429 (0: unlimited)",
+    )
+    parser.add_argument(
+        "--request-timeout",
+        type=float,
+        default=600.0,
+        help="Longest deadline of a request in seconds; clients may ask for less with X-Deadline-Seconds",
+    )
     parser = AsyncEngineArgs.add_cli_args(parser)
     args = parser.parse_args()
 
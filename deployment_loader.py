@@ -0,0 +1,38 @@
+"""
+Import modules from the deployment script directories by file path
+
+The deployment directories are run as scripts, and their modules share names with root
+packages (deployment/tensorrt_llm/utils.py shadows the utils package, and deployment/vllm
+passes for the vllm package). Putting those directories on sys.path would break later
+imports, so tests load the modules they need with load_deployment_module instead.
+"""
+
+import importlib.util
+import os
+import sys
+
+DEPLOYMENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "deployment")
+
+
+def load_deployment_module(relative_path):
+    """Import deployment/<relative_path> without touching sys.path
+
+    Args:
+        relative_path: Path of the module inside deployment/, e.g. "tensorrt_llm/batcher.py"
+
+    Returns:
+        The module, registered in sys.modules under a name built from its path
+        (deployment_tensorrt_llm_batcher) so it never collides with a root package
+    """
+    name = "deployment_" + os.path.splitext(relative_path)[0].replace("/", "_")
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(DEPLOYMENT_DIR, relative_path))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[name]
+        raise
+    return module
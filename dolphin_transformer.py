@@ -7,227 +7,145 @@ with improved table handling and chunk generation for RAG applications.
 
 import re
 import uuid
-from typing import Any, Callable, Dict, List, Tuple, Optional
 from datetime import datetime
 from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
+from utils.html_table import HTMLTable, parse_html_table
 
-def _validate_html_table(html: str) -> bool:
-    """Validate if HTML contains a reasonable table structure."""
-    if not html or len(html.strip()) < 20:
+
+def _as_table(html: Union[str, HTMLTable]) -> HTMLTable:
+    """Parsed table of HTML, or the already parsed table itself."""
+    return html if isinstance(html, HTMLTable) else parse_html_table(html)
+
+
+def _validate_html_table(html: Union[str, HTMLTable]) -> bool:
+    """Validate if HTML (or its parsed table) contains a reasonable table structure."""
+    table = _as_table(html)
+    if table.length < 20:
         return False
-    
+
     # Check for basic table structure
-    if not re.search(r'<table[^>]*>', html, re.I):
+    if not table.has_table:
         return False
-    
+
     # Count rows and cells to detect malformed tables
-    rows = re.findall(r'<tr[^>]*>.*?</tr>', html, re.I | re.S)
-    if len(rows) > 200:  # Too many rows
+    stats = table.stats()
+    if stats["rows"] > 200:  # Too many rows
         return False
-        
-    if len(rows) < 2:  # Need at least header + data row
+
+    if stats["rows"] < 2:  # Need at least header + data row
         return False
-    
+
     # Check for reasonable cell structure
-    total_cells = len(re.findall(r'<t[dh][^>]*>.*?</t[dh]>', html, re.I | re.S))
-    if total_cells > 1000:  # Too many cells
+    if stats["cells"] > 1000:  # Too many cells
         return False
-    
+
     # Detect repetitive malformed tables (like the "Genus" problem)
-    cell_contents = re.findall(r'<t[dh][^>]*>(.*?)</t[dh]>', html, re.I | re.S)
-    cleaned_contents = [re.sub(r'<.*?>', '', cell).strip() for cell in cell_contents if cell.strip()]
-    
     # If more than 70% of cells contain the same text, it's likely malformed
-    if cleaned_contents:
-        from collections import Counter
-        content_counts = Counter(cleaned_contents)
-        most_common = content_counts.most_common(1)[0]
-        if most_common[1] / len(cleaned_contents) > 0.7:
-            print(f"Warning: Table appears malformed - {most_common[1]}/{len(cleaned_contents)} cells contain '{most_common[0]}'")
+    if stats["content_cells"]:
+        most_common_text, most_common_count = table.content_counts.most_common(1)[0]
+        if most_common_count / stats["content_cells"] > 0.7:
+            print(
+                f"Warning: Table appears malformed - {most_common_count}/{stats['content_cells']} cells "
+                f"contain '{most_common_text}'"
+            )
             return False
-    
+
     # Check for mostly empty tables (too many empty cells)
-    empty_cells = len([cell for cell in cleaned_contents if not cell or cell in ['', 'nan']])
-    if empty_cells / max(1, len(cleaned_contents)) > 0.8:
-        print(f"Warning: Table appears malformed - {empty_cells}/{len(cleaned_contents)} cells are empty")
+    if stats["empty_cells"] / max(1, stats["content_cells"]) > 0.8:
+        print(f"Warning: Table appears malformed - {stats['empty_cells']}/{stats['content_cells']} cells are empty")
         return False
-    
+
     return True
 
 
-def _table_to_md_tsv_and_sentences(html: str, context_title: str = None) -> Dict[str, Any]:
+def _table_to_md_tsv_and_sentences(html: Union[str, HTMLTable], context_title: str = None) -> Dict[str, Any]:
     """
     Convert HTML table to markdown/TSV format and extract row sentences.
     Includes strict validation and size limits to prevent oversized chunks.
-    
+
+    The table is parsed once (see utils.html_table); rowspan/colspan cells are repeated in
+    every row and column they cover. Header rows are the <thead> rows or leading rows of
+    <th> cells, else the first row.
+
     Args:
-        html: HTML table string
+        html: HTML table string, or the table parse_html_table made of it
         context_title: Optional context title to prepend to sentences
-        
+
     Returns:
         Dictionary containing markdown, tsv, headers, and row_sentences
     """
+    empty = {"markdown": None, "tsv": None, "headers": [], "row_sentences": []}
+    table = _as_table(html)
+
     # Validate input
-    if not _validate_html_table(html):
+    if not _validate_html_table(table):
         print("Warning: Invalid or malformed table HTML detected, skipping.")
-        return {"markdown": None, "tsv": None, "headers": [], "row_sentences": []}
-    
-    headers, markdown, tsv, row_sentences = [], None, None, []
-
-    try:
-        import pandas as pd
-        from io import StringIO
-        
-        # Use StringIO to avoid pandas deprecation warning
-        dfs = pd.read_html(StringIO(html))
-        if not dfs:
-            raise ValueError("No tables parsed")
-        df = dfs[0]
-        
-        # Validate dataframe size
-        if df.shape[0] > 100 or df.shape[1] > 25:
-            raise ValueError(f"Table too large: {df.shape[0]} rows x {df.shape[1]} columns")
-
-        # Clean headers/values to strings and limit length
-        df = df.map(lambda x: "" if x is None else str(x)[:200])  # Limit cell content
-
-        # Extract and clean headers
-        headers = [str(c)[:50] for c in df.columns.tolist()]  # Limit header length
-        
-        # Validate headers
-        if len(headers) == 0 or all(h.strip() == "" for h in headers):
-            raise ValueError("No valid headers found")
-
-        # Generate markdown if available
-        if hasattr(df, "to_markdown"):
-            try:
-                markdown = df.to_markdown(index=False)
-                # Validate markdown size
-                if len(markdown) > 8000:
-                    print(f"Warning: Markdown too large ({len(markdown)} chars), truncating")
-                    markdown = markdown[:8000] + "\n... (truncated)"
-            except Exception:
-                markdown = None
-        
-        # Generate TSV (always available)
-        tsv = df.to_csv(index=False, sep="\t")
-        if len(tsv) > 8000:
-            print(f"Warning: TSV too large ({len(tsv)} chars), truncating")
-            tsv = tsv[:8000] + "\n... (truncated)"
-
-        # Generate sentences per row with size control
-        for idx, (_, row) in enumerate(df.iterrows()):
-            if idx >= 50:  # Limit number of row sentences
-                break
-                
-            parts = []
-            for col in df.columns:
-                val = str(row[col]).strip()
-                if val != "" and val != "nan":
-                    # Limit individual field length
-                    if len(val) > 100:
-                        val = val[:100] + "..."
-                    parts.append(f"{col}: {val}")
-            
-            if parts:
-                sent = ", ".join(parts)
-                if len(sent) > 500:  # Limit sentence length
-                    sent = sent[:500] + "..."
-                if context_title:
-                    sent = f"{context_title} — " + sent
-                row_sentences.append(sent)
-
-    except Exception as e:
-        # Strict fallback: only process well-formed simple tables
-        print(f"Warning: Pandas table parsing failed: {e}. Using strict fallback parser.")
-        
-        # Extract rows with strict validation
-        rows = re.findall(r"<tr[^>]*>(.*?)</tr>", html, flags=re.I|re.S)
-        if len(rows) > 50:  # Much stricter row limit
-            print(f"Warning: Too many rows ({len(rows)}), skipping table")
-            return {"markdown": None, "tsv": None, "headers": [], "row_sentences": []}
-        
-        simple_rows = []
-        for r in rows[:50]:  # Process max 50 rows
-            cells = re.findall(r"<t[dh][^>]*>(.*?)</t[dh]>", r, flags=re.I|re.S)
-            # Clean and limit cell content
-            cells = [re.sub(r"<.*?>", "", c).strip()[:100] for c in cells]  # Limit cell length
-            cells = [c for c in cells if c]  # Remove empty cells
-            
-            if cells and len(cells) <= 10:  # Much stricter column limit
-                simple_rows.append(cells)
-
-        if len(simple_rows) < 2:  # Need at least header + 1 data row
-            print("Warning: Insufficient table data, skipping")
-            return {"markdown": None, "tsv": None, "headers": [], "row_sentences": []}
-            
-        headers = simple_rows[0][:10]  # Limit headers
-        data_rows = simple_rows[1:30]  # Limit data rows
-        
-        # Validate headers
-        if not headers or all(not h.strip() for h in headers):
-            print("Warning: No valid headers found, skipping table")
-            return {"markdown": None, "tsv": None, "headers": [], "row_sentences": []}
-        
-        # Generate TSV with size control
-        tsv_lines = ["\t".join(headers)]
-        for r in data_rows:
-            # Pad/truncate row to match header count
-            r_clean = [c.replace("\t", " ").replace("\n", " ").strip() for c in r]
-            r_padded = (r_clean + [""] * len(headers))[:len(headers)]
-            tsv_lines.append("\t".join(r_padded))
-            
-            # Generate sentence with strict limits
-            parts = []
-            for col, val in zip(headers, r_padded):
-                if val and val.strip():
-                    val_clean = val.strip()[:80]  # Limit value length
-                    parts.append(f"{col}: {val_clean}")
-            
-            if parts:
-                sent = ", ".join(parts)
-                if len(sent) > 400:  # Strict sentence limit
-                    sent = sent[:400] + "..."
-                if context_title:
-                    sent = f"{context_title} — " + sent
-                row_sentences.append(sent)
-        
-        tsv = "\n".join(tsv_lines)
-        
-        # Validate TSV size
-        if len(tsv) > 5000:
-            print(f"Warning: TSV still too large ({len(tsv)} chars), truncating")
-            tsv = tsv[:5000] + "\n... (truncated)"
-        
-        # Generate simple markdown with size control
-        if headers and len(data_rows) > 0:
-            try:
-                sep = "| " + " | ".join("---" for _ in headers) + " |"
-                md_head = "| " + " | ".join(h[:30] for h in headers) + " |"  # Limit header display
-                md_rows = []
-                
-                for r in data_rows[:20]:  # Limit displayed rows
-                    r_clean = [c.replace("|", "\|").strip()[:30] for c in r]  # Escape pipes, limit length
-                    padded = (r_clean + [""] * len(headers))[:len(headers)]
-                    md_rows.append("| " + " | ".join(padded) + " |")
-                
-                markdown = "\n".join([md_head, sep] + md_rows)
-                
-                # Final size check
-                if len(markdown) > 6000:
-                    print(f"Warning: Markdown too large ({len(markdown)} chars), truncating")
-                    markdown = markdown[:6000] + "\n... (truncated)"
-                    
-            except Exception as md_error:
-                print(f"Warning: Markdown generation failed: {md_error}")
-                markdown = None
-
-    # Ensure strings
-    if markdown is not None:
-        markdown = str(markdown)
-    if tsv is not None:
-        tsv = str(tsv)
+        return empty
+
+    header_count = max(1, table.header_rows)
+    header_grid, data_grid = table.grid[:header_count], table.grid[header_count:]
+
+    # Validate table size
+    if len(data_grid) > 100 or table.n_cols > 25:
+        print(f"Warning: Table too large: {len(data_grid)} rows x {table.n_cols} columns, skipping")
+        return empty
+
+    # Extract and clean headers (stacked header rows are joined per column)
+    headers = []
+    for col in range(table.n_cols):
+        parts = []
+        for header_row in header_grid:
+            if header_row[col] and header_row[col] not in parts:
+                parts.append(header_row[col])
+        headers.append(" ".join(parts)[:50])  # Limit header length
+
+    # Validate headers
+    if len(headers) == 0 or all(h.strip() == "" for h in headers):
+        print("Warning: No valid headers found, skipping table")
+        return empty
+    headers = [h or f"Column {i + 1}" for i, h in enumerate(headers)]
+
+    # Limit cell content
+    data_rows = [[cell[:200] for cell in row] for row in data_grid]
+
+    # Generate markdown with size control
+    def md_row(cells):
+        return "| " + " | ".join(c.replace("|", "\\|").replace("\n", " ") for c in cells) + " |"
+
+    markdown = "\n".join(
+        [md_row(headers), "| " + " | ".join("---" for _ in headers) + " |"] + [md_row(r) for r in data_rows]
+    )
+    if len(markdown) > 8000:
+        print(f"Warning: Markdown too large ({len(markdown)} chars), truncating")
+        markdown = markdown[:8000] + "\n... (truncated)"
+
+    # Generate TSV with size control
+    tsv = "\n".join("\t".join(c.replace("\t", " ").replace("\n", " ") for c in r) for r in [headers] + data_rows)
+    if len(tsv) > 8000:
+        print(f"Warning: TSV too large ({len(tsv)} chars), truncating")
+        tsv = tsv[:8000] + "\n... (truncated)"
+
+    # Generate sentences per row with size control
+    row_sentences = []
+    for row in data_rows[:50]:  # Limit number of row sentences
+        parts = []
+        for col, val in zip(headers, row):
+            val = val.strip()
+            if val != "" and val != "nan":
+                # Limit individual field length
+                if len(val) > 100:
+                    val = val[:100] + "..."
+                parts.append(f"{col}: {val}")
+
+        if parts:
+            sent = ", ".join(parts)
+            if len(sent) > 500:  # Limit sentence length
+                sent = sent[:500] + "..."
+            if context_title:
+                sent = f"{context_title} — " + sent
+            row_sentences.append(sent)
 
     return {
         "markdown": markdown,
@@ -237,48 +155,42 @@ def _table_to_md_tsv_and_sentences(html: str, context_title: str = None) -> Dict
     }
 
 
-def _simplify_html_table(html: str) -> str:
+def _simplify_html_table(html: Union[str, HTMLTable]) -> str:
     """
     Simplify HTML table to a readable text format for LLMs as a last resort.
 
     Args:
-        html: HTML table string
+        html: HTML table string, or the table parse_html_table made of it
 
     Returns:
         Simplified text representation of the table
     """
-    if not html or len(html.strip()) < 20:
+    table = _as_table(html)
+    if table.length < 20:
         return ""
 
-    try:
-        # Extract rows with minimal processing
-        rows = re.findall(r"<tr[^>]*>(.*?)</tr>", html, flags=re.I|re.S)
-        if not rows or len(rows) > 50:  # Limit to reasonable size
-            return ""
-
-        simplified_rows = []
-        for i, row in enumerate(rows[:20]):  # Process max 20 rows
-            # Extract cells
-            cells = re.findall(r"<t[dh][^>]*>(.*?)</t[dh]>", row, flags=re.I|re.S)
-            # Clean cell content
-            cells = [re.sub(r"<.*?>", "", cell).strip()[:80] for cell in cells]
-            cells = [cell for cell in cells if cell]  # Remove empty cells
-
-            if cells and len(cells) <= 8:  # Reasonable column limit
-                if i == 0:  # Header row
-                    simplified_rows.append("Headers: " + " | ".join(cells))
-                else:
-                    simplified_rows.append(f"Row {i}: " + " | ".join(cells))
+    rows = table.rows
+    if not rows or len(rows) > 50:  # Limit to reasonable size
+        return ""
 
-        if len(simplified_rows) >= 2:  # At least header + 1 data row
-            result = "\n".join(simplified_rows)
-            # Ensure reasonable size
-            if len(result) > 1500:
-                result = result[:1500] + "\n... (truncated)"
-            return result
+    simplified_rows = []
+    for i, row in enumerate(rows[:20]):  # Process max 20 rows
+        # Clean cell content
+        cells = [cell.text[:80] for cell in row]
+        cells = [cell for cell in cells if cell]  # Remove empty cells
 
-    except Exception as e:
-        print(f"Warning: HTML table simplification failed: {e}")
+        if cells and len(cells) <= 8:  # Reasonable column limit
+            if i == 0:  # Header row
+                simplified_rows.append("Headers: " + " | ".join(cells))
+            else:
+                simplified_rows.append(f"Row {i}: " + " | ".join(cells))
+
+    if len(simplified_rows) >= 2:  # At least header + 1 data row
+        result = "\n".join(simplified_rows)
+        # Ensure reasonable size
+        if len(result) > 1500:
+            result = result[:1500] + "\n... (truncated)"
+        return result
 
     return ""
 
@@ -591,9 +503,10 @@ def transform_dolphin_to_oxcart_preserving_labels(
 ) -> Dict[str, Any]:
     """
     Transform Dolphin recognition results to OXCART format with enhanced table handling.
-    
+
     Args:
-        recognition_results: Dolphin model output (pages with elements)
+        recognition_results: Dolphin model output (pages with elements), or the path of a
+            page-record JSONL written by utils.result_stream.DocumentStream
         doc_id: Document identifier
         page_dims_provider: Function to get page dimensions (page_num) -> (width, height)
         exclude_labels: Labels to exclude from processing
@@ -601,11 +514,15 @@ def transform_dolphin_to_oxcart_preserving_labels(
         fuse_figure_and_caption: Whether to combine figures with their captions
         table_row_block_size: Number of table row sentences per chunk (None=disabled to preserve table integrity)
         strict_mode: Enable strict validation and size limits
-        
+
     Returns:
         OXCART format dictionary with chunks and metadata
     """
     # Normalize input to list of pages
+    if isinstance(recognition_results, (str, Path)) and str(recognition_results).endswith(".jsonl"):
+        from utils.result_stream import read_page_records
+
+        recognition_results = list(read_page_records(str(recognition_results)))
     if isinstance(recognition_results, dict) and "pages" in recognition_results:
         pages_in = recognition_results["pages"]
     elif isinstance(recognition_results, list) and recognition_results and isinstance(recognition_results[0], dict) and "page_number" in recognition_results[0]:
@@ -642,9 +559,12 @@ def transform_dolphin_to_oxcart_preserving_labels(
 
     md_parts = []
     chunk_counter = 0
+    page_classes = {}  # pages not parsed by the layout model (blank, image_only, text_layer)
 
     for page in pages_in:
         pno = int(page.get("page_number", 1))
+        if page.get("page_class"):
+            page_classes.setdefault(page["page_class"], []).append(pno)
         elements = sorted(page.get("elements", []), key=lambda e: e.get("reading_order", 0))
 
         # Get page dimensions if provider is available
@@ -662,11 +582,11 @@ def transform_dolphin_to_oxcart_preserving_labels(
                 continue
 
             label = (el.get("label") or "").lower()
-            
+
             # Skip excluded labels
             if label in exclude_labels:
                 continue
-                
+
             chunk_type = DOLPHIN2TYPE.get(label, "text")
             txt = (el.get("text") or "").strip()
             bbox = el.get("bbox")
@@ -678,7 +598,7 @@ def transform_dolphin_to_oxcart_preserving_labels(
                 labels = [label]
                 ro_end = ro
                 cap_txt = None
-                
+
                 # Check if next element is a caption
                 if idx + 1 < len(elements) and (elements[idx + 1].get("label","").lower() == "cap"):
                     cap = elements[idx + 1]
@@ -686,11 +606,11 @@ def transform_dolphin_to_oxcart_preserving_labels(
                     ro_end = cap.get("reading_order", ro)
                     labels.append("cap")
                     skip_next = True
-                
+
                 vis_text = cap_txt if cap_txt else txt
                 if vis_text:
                     md_parts.append(vis_text + "\n\n")
-                
+
                 chunk_counter += 1
                 oxcart["chunks"].append({
                     "chunk_id": f"{doc_id}:{pno:03d}:{ro}-{ro_end}:0",
@@ -710,18 +630,26 @@ def transform_dolphin_to_oxcart_preserving_labels(
                 # Strict size and content validation
                 if not txt or len(txt.strip()) < 30:  # More strict minimum size
                     continue
-                
+
+                # Decoding was cut short in a repetition loop (even after the retry)
+                if el.get("stop_reason") == "repetition":
+                    print(f"Warning: Skipping table stopped in a repetition loop on page {pno}")
+                    continue
+
                 if len(txt) > 50000:  # Reject extremely large HTML
                     print(f"Warning: Skipping extremely large table HTML on page {pno} (size: {len(txt)} chars)")
                     continue
-                
+
+                # Parse once for the validation and every rendering below
+                table = parse_html_table(txt)
+
                 # Check for reasonable table structure before processing
-                if not _validate_html_table(txt):
+                if not _validate_html_table(table):
                     print(f"Warning: Skipping malformed table on page {pno}")
                     continue
 
                 # Convert table to multiple formats with strict validation
-                conv = _table_to_md_tsv_and_sentences(txt, context_title=None)
+                conv = _table_to_md_tsv_and_sentences(table, context_title=None)
 
                 # Smart format selection - prioritize Markdown > TSV > Simplified HTML
                 table_format = "unknown"
@@ -733,17 +661,17 @@ def transform_dolphin_to_oxcart_preserving_labels(
                     table_format = "tsv"
                 else:
                     # Last resort: simplify HTML for LLM readability
-                    main_text = _simplify_html_table(txt)
+                    main_text = _simplify_html_table(table)
                     table_format = "simplified_html"
                     if not main_text:
                         print(f"Warning: All table conversion methods failed on page {pno}, skipping")
                         continue
-                
+
                 # More strict size validation
                 if len(main_text) > 3000:  # Much stricter limit
                     print(f"Warning: Skipping oversized table on page {pno} (size: {len(main_text)} chars)")
                     continue
-                
+
                 # Validate that we have meaningful content
                 if len(conv["headers"]) == 0 or len(main_text.strip()) < 50:
                     print(f"Warning: Table lacks meaningful content on page {pno}, skipping")
@@ -770,28 +698,28 @@ def transform_dolphin_to_oxcart_preserving_labels(
                 # Additional chunks: row sentences (only if table_row_block_size is specified)
                 if table_row_block_size is not None:
                     rsents = conv["row_sentences"] or []
-                    
+
                     # Only create row chunks for tables with reasonable size and content
                     if rsents and len(rsents) > 3 and len(rsents) <= 30:  # Strict row count limits
                         # Very conservative block size
                         effective_block_size = min(table_row_block_size, 3)  # Max 3 rows per chunk
-                        
+
                         for start in range(0, len(rsents), effective_block_size):
                             block = rsents[start:start+effective_block_size]
                             if not block:  # Skip empty blocks
                                 continue
-                            
+
                             block_text = "\n".join(block)
-                            
+
                             # Very strict size limits for row chunks
                             if len(block_text) > 800:  # Much stricter limit
                                 print(f"Warning: Skipping oversized table_row chunk on page {pno} (size: {len(block_text)} chars)")
                                 continue
-                            
+
                             # Quality check: ensure meaningful content
                             if len(block_text.strip()) < 20 or block_text.count(":") < 2:
                                 continue  # Skip low-quality blocks
-                                
+
                             chunk_counter += 1
                             oxcart["chunks"].append({
                                 "chunk_id": f"{doc_id}:{pno:03d}:{ro}-{ro}:rows{start}",
@@ -834,7 +762,7 @@ def transform_dolphin_to_oxcart_preserving_labels(
                     parts = _split_long_paragraph(txt, max_chars=para_max_chars, overlap_sents=1)
                 else:
                     parts = [txt]
-                
+
                 for si, part in enumerate(parts):
                     # Add appropriate markdown formatting
                     if label == "title":
@@ -867,13 +795,19 @@ def transform_dolphin_to_oxcart_preserving_labels(
 
     # Finalize markdown
     oxcart["markdown"] = "".join(md_parts).strip()
-    
+
+    # Pages settled without layout parsing, so blank pages are not mistaken for lost ones
+    if page_classes:
+        oxcart["metadata"]["page_classes"] = page_classes
+        if page_classes.get("blank"):
+            print(f"Info: {len(page_classes['blank'])} blank page(s) without chunks: {page_classes['blank']}")
+
     # Apply internal chunk grouping first (to reduce small chunks)
     if len(oxcart["chunks"]) > 0:
         print(f"Info: Applying internal chunk grouping to {len(oxcart['chunks'])} chunks")
         oxcart["chunks"] = _group_small_chunks(oxcart["chunks"], min_chunk_size=100, max_combined_size=1200)
         print(f"Info: After grouping: {len(oxcart['chunks'])} chunks")
-    
+
     # Apply external chunk optimization if requested
     if optimize_for_rag:
         try:
@@ -890,8 +824,8 @@ def transform_dolphin_to_oxcart_preserving_labels(
             print("Warning: chunk_optimizer module not available, skipping external optimization")
         except Exception as e:
             print(f"Warning: External optimization failed: {e}")
-    
+
     # Final validation and quality metrics
     _validate_and_enhance_chunks(oxcart)
-    
-    return oxcart
\ No newline at end of file
+
+    return oxcart
@@ -0,0 +1,196 @@
+"""
+Multi-process Dolphin decoding with one shared copy of the model weights
+
+A single DOLPHIN instance is loaded in the parent process and its parameters are moved
+to shared memory (Tensor.share_memory_). Worker processes, forked or spawned, reuse those
+tensors instead of loading their own copy of the checkpoint, and pull batches of crops
+from one common task queue:
+
+    parent: chat(prompts, images) -> split into batches -> task queue
+    workers (N): task queue -> model.chat(batch) -> result queue
+    parent: result queue -> results in input order
+
+SharedModelWorkers exposes the same chat() and model_args as DOLPHIN, so it can be passed
+as the model to demo_page.process_document or the OCR pipeline. Meant for CPU-only hosts:
+each worker runs torch with its share of the cores.
+
+Only float weights can be shared this way. The int8 CPU backends keep their weights packed
+inside quantized linears, which have no parameters to move to shared memory; a spawned worker
+would unpickle its own copy, so such models need start_method="fork" (the packed weights are
+then inherited copy-on-write) or cpu_backend fp32.
+
+Usage:
+
+    workers = SharedModelWorkers(DOLPHIN(config), num_workers=4)
+    json_path, recognition_results = process_document(pdf_path, workers, save_dir, max_batch_size=4)
+    workers.close()
+"""
+
+import os
+import queue
+import traceback
+
+import torch
+import torch.multiprocessing as mp
+from torch.ao.nn.quantized import Linear as QuantizedLinear
+
+from utils.scheduler import (
+    estimate_output_length,
+    length_bucketed_batches,
+    restore_order,
+    sequential_batches,
+)
+
+_STOP = None
+
+
+def _worker_loop(model, tasks, results, num_threads):
+    """Decode batches from the task queue until the stop sentinel arrives"""
+    torch.set_num_threads(num_threads)
+    while True:
+        task = tasks.get()
+        if task is _STOP:
+            return
+        task_id, question, images, kwargs = task
+        try:
+            with torch.no_grad():
+                results.put((task_id, model.chat(question, images, **kwargs), None))
+        except Exception:
+            results.put((task_id, None, traceback.format_exc()))
+
+
+class SharedModelWorkers:
+    """Process pool decoding with one DOLPHIN model whose weights live in shared memory
+
+    Args:
+        model: DOLPHIN model instance, loaded once in this process
+        num_workers: Number of decoding processes
+        num_threads: Torch threads per worker (default: the CPU cores split evenly)
+        start_method: "spawn" (the model is sent to the workers with its tensors passed as
+            shared-memory handles) or "fork" (workers inherit the model). Fork only when the
+            parent has not run torch yet: a child forked after the parent's first inference
+            inherits its intra-op thread pool in a broken state and can hang. Models with int8
+            quantized linears can only be used with fork
+    """
+
+    def __init__(self, model, num_workers=2, num_threads=None, start_method="spawn"):
+        if next(model.model.parameters()).is_cuda:
+            raise ValueError("SharedModelWorkers is meant for CPU models; use a single process on GPU")
+        if start_method != "fork" and any(isinstance(m, QuantizedLinear) for m in model.model.modules()):
+            raise ValueError(
+                "SharedModelWorkers cannot share int8 quantized weights with spawned workers, each would "
+                'load its own copy; use cpu_backend fp32 or start_method="fork"'
+            )
+
+        self.model = model
+        self.model_args = model.model_args
+        self.processor = model.processor
+        self.tokenizer = model.tokenizer
+        self.num_workers = max(1, num_workers)
+        self.num_threads = num_threads or max(1, (os.cpu_count() or 1) // self.num_workers)
+
+        # Parameters and buffers are moved to shared memory once, before any worker starts
+        model.model.share_memory()
+
+        context = mp.get_context(start_method)
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.workers = [
+            context.Process(
+                target=_worker_loop,
+                args=(model, self.tasks, self.results, self.num_threads),
+                name=f"dolphin-worker-{i}",
+                daemon=True,
+            )
+            for i in range(self.num_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+        self._next_task_id = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def chat(self, question, image, max_batch_size=16, max_new_tokens=None, **kwargs):
+        """DOLPHIN.chat, with batched calls split across the workers
+
+        A list of prompts is cut into batches of max_batch_size (length bucketed if enabled)
+        that are decoded by whichever worker is free; results come back in input order.
+        return_raw is not supported.
+        """
+        if kwargs.get("return_raw"):
+            raise ValueError("SharedModelWorkers.chat does not support return_raw")
+        if not isinstance(question, list):
+            return self._run([(question, image, dict(kwargs, max_new_tokens=max_new_tokens))])[0]
+
+        labels = kwargs.pop("labels", None)
+        if isinstance(max_new_tokens, int):
+            max_new_tokens = [max_new_tokens] * len(question)
+
+        # Same batch formation as DOLPHIN.chat, then whole batches go to the workers
+        length_bucketing = kwargs.pop("length_bucketing", None)
+        if length_bucketing is None:
+            length_bucketing = self.model_args.get("length_bucketing", False)
+        if length_bucketing:
+            if labels is None:
+                labels = ["tab" if "table" in q else "para" for q in question]
+            lengths = [estimate_output_length(label, *img.size) for label, img in zip(labels, image)]
+            batches = length_bucketed_batches(lengths, max_batch_size)
+        else:
+            batches = sequential_batches(len(question), max_batch_size)
+
+        tasks = []
+        for indices in batches:
+            batch_kwargs = dict(kwargs, max_batch_size=max_batch_size, length_bucketing=False)
+            if labels is not None:
+                batch_kwargs["labels"] = [labels[i] for i in indices]
+            if max_new_tokens is not None:
+                batch_kwargs["max_new_tokens"] = [max_new_tokens[i] for i in indices]
+            tasks.append(([question[i] for i in indices], [image[i] for i in indices], batch_kwargs))
+        output = self._merge(self._run(tasks))
+        if isinstance(output, tuple):
+            return tuple(restore_order(values, batches) for values in output)
+        return restore_order(output, batches)
+
+    def _run(self, tasks):
+        """Queue tasks and wait for all of their results"""
+        first_id = self._next_task_id
+        self._next_task_id += len(tasks)
+        for offset, (question, images, kwargs) in enumerate(tasks):
+            self.tasks.put((first_id + offset, question, images, kwargs))
+
+        outputs = {}
+        while len(outputs) < len(tasks):
+            try:
+                task_id, output, error = self.results.get(timeout=1.0)
+            except queue.Empty:
+                dead = [worker.name for worker in self.workers if not worker.is_alive()]
+                if dead:
+                    raise RuntimeError(f"Dolphin worker(s) exited unexpectedly: {', '.join(dead)}")
+                continue
+            if task_id < first_id:
+                continue  # left over from a call that failed
+            if error is not None:
+                raise RuntimeError(f"Dolphin worker failed:\n{error}")
+            outputs[task_id - first_id] = output
+        return [outputs[i] for i in range(len(tasks))]
+
+    @staticmethod
+    def _merge(outputs):
+        """Concatenate per-batch outputs (lists, or tuples of lists) in batch order"""
+        if outputs and isinstance(outputs[0], tuple):
+            return tuple(sum((list(output[k]) for output in outputs), []) for k in range(len(outputs[0])))
+        return sum((list(output) for output in outputs), [])
+
+    def close(self):
+        """Stop the workers after the tasks already queued"""
+        for _ in self.workers:
+            self.tasks.put(_STOP)
+        for worker in self.workers:
+            worker.join(timeout=30)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
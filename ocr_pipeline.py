@@ -0,0 +1,361 @@
+"""
+Pipelined rasterize -> layout -> recognize executor for the Dolphin OCR path
+
+The serial path in demo_page renders a page, pads it, runs layout, crops elements and
+recognizes them one after the other, so the model waits while PyMuPDF and PIL work.
+Here the work is split into stages connected by bounded queues:
+
+    rasterize (process pool) -> layout (model) -> crop (process pool) -> recognize (model) -> write (thread)
+
+A single thread owns the model and alternates between layout of page i and recognition
+of the pages before it, while the process pool renders upcoming pages and crops the
+elements of the page whose layout just finished. Figures are written by a background
+writer thread; the combined results are written once a document's figures are on disk,
+so the returned json_path always exists.
+
+Usage from a batch loop (drop-in for demo_page.process_document):
+
+    with OCRPipeline(model, save_dir, max_batch_size=4) as pipeline:
+        for pdf_file in pdf_files:
+            json_path, recognition_results = pipeline.process_document(str(pdf_file))
+        pipeline.print_report()
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from demo_page import (
+    LAYOUT_PROMPT,
+    get_render_size,
+    process_document,
+    profiled_chat,
+    recognize_elements,
+    split_elements,
+)
+from utils.page_check import precheck_page
+from utils.page_store import PageStore
+from utils.text_layer import extract_text_layer_pages
+from utils.utils import (
+    crop_layout_elements,
+    get_figure_filename,
+    get_pdf_page_count,
+    rasterize_pdf_page,
+    save_combined_pdf_results,
+    save_figure_to_local,
+    timed_call,
+)
+
+_DONE = object()
+
+
+class StageStats:
+    """Busy time accounting for one pipeline stage"""
+
+    def __init__(self, name, workers=1):
+        self.name = name
+        self.workers = workers
+        self.busy_time = 0.0
+        self.items = 0
+        self._lock = threading.Lock()
+
+    def add(self, seconds, items=1):
+        with self._lock:
+            self.busy_time += seconds
+            self.items += items
+
+    def utilization(self, wall_time):
+        if wall_time <= 0:
+            return 0.0
+        return self.busy_time / (wall_time * self.workers)
+
+
+class OCRPipeline:
+    """Staged OCR executor sharing one model across all documents it processes
+
+    Args:
+        model: DOLPHIN model instance (only ever called from the calling thread)
+        save_dir: Directory to save results
+        max_batch_size: Maximum batch size for element recognition
+        pages_per_batch: Number of pages whose crops are pooled into shared batches
+        num_workers: Processes used for rasterization and crop preparation
+        queue_size: Maximum number of pages in flight between two stages
+        target_size: Longest side of the rendered pages (default: the model's input size)
+        crop_cache: Optional CropCache of element results
+        resume: Reuse pages already in a PDF's page store (False starts over)
+        text_layer: Take pages with a usable born-digital text layer straight from the PDF
+        figure_writer: Optional utils.figure_store.FigureWriter; figures are otherwise written
+            as PNG by the writer thread
+    """
+
+    def __init__(
+        self,
+        model,
+        save_dir,
+        max_batch_size=4,
+        pages_per_batch=1,
+        num_workers=2,
+        queue_size=4,
+        target_size=None,
+        crop_cache=None,
+        resume=True,
+        text_layer=False,
+        figure_writer=None,
+    ):
+        self.model = model
+        self.save_dir = save_dir
+        self.max_batch_size = max_batch_size
+        self.pages_per_batch = max(1, pages_per_batch)
+        self.queue_size = max(1, queue_size)
+        self.target_size = target_size or get_render_size(model)
+        self.crop_cache = crop_cache
+        self.resume = resume
+        self.text_layer = text_layer
+        self.figure_writer = figure_writer
+        self.save_figure = figure_writer or self._queue_figure
+        self.page_precheck = bool(getattr(model, "model_args", {}).get("page_precheck"))
+
+        # Pool jobs live in utils.utils, so workers never touch the model
+        self.pool = ProcessPoolExecutor(max_workers=num_workers, mp_context=get_context("spawn"))
+
+        self.stats = {
+            "rasterize": StageStats("rasterize", workers=num_workers),
+            "layout": StageStats("layout"),
+            "crop": StageStats("crop", workers=num_workers),
+            "recognize": StageStats("recognize"),
+            "write": StageStats("write"),
+        }
+        self.wall_time = 0.0
+
+        self.write_queue = queue.Queue(maxsize=self.queue_size * 8)
+        self.write_errors = []
+        self.writer = threading.Thread(target=self._writer_loop, name="ocr-writer", daemon=True)
+        self.writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def process_document(self, document_path):
+        """Parse a document through the pipeline
+
+        Returns:
+            Tuple of (json_path, recognition_results) like demo_page.process_document
+        """
+        if os.path.splitext(document_path)[1].lower() != ".pdf":
+            json_path, recognition_results = process_document(
+                document_path,
+                self.model,
+                self.save_dir,
+                self.max_batch_size,
+                crop_cache=self.crop_cache,
+                resume=self.resume,
+                text_layer=self.text_layer,
+                save_figure=self.save_figure,
+            )
+            self.flush()
+            return json_path, recognition_results
+
+        start = time.perf_counter()
+        num_pages = get_pdf_page_count(document_path)
+        if num_pages == 0:
+            raise Exception(f"Failed to convert PDF {document_path} to images")
+
+        base_name = os.path.splitext(os.path.basename(document_path))[0]
+        pages_elements = [None] * num_pages
+
+        # Pages finished by an earlier run are taken from the page store
+        page_store = PageStore(self.save_dir, document_path)
+        if not self.resume:
+            page_store.clear()
+        missing_pages = page_store.missing_pages(num_pages)
+
+        if self.text_layer and missing_pages:
+            text_pages = extract_text_layer_pages(
+                document_path, missing_pages, self.target_size, self.save_dir, base_name, save_figure=self.save_figure
+            )
+            for page_idx, elements in text_pages.items():
+                page_store.append(page_idx, elements, page_info={"page_class": "text_layer"})
+            missing_pages = [page_idx for page_idx in missing_pages if page_idx not in text_pages]
+
+        # Stage 1: rasterization is fed from a separate thread; the bounded queue keeps
+        # at most queue_size rendered pages waiting for the model
+        render_queue = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        feeder = threading.Thread(
+            target=self._feed_pages,
+            args=(document_path, missing_pages, render_queue, stop),
+            name="ocr-rasterize",
+            daemon=True,
+        )
+        feeder.start()
+
+        # Stages 2-4 run on this thread, which owns the model
+        pending = []
+        feeder_done = False
+        try:
+            while True:
+                future = render_queue.get()
+                if future is _DONE:
+                    feeder_done = True
+                    break
+                if isinstance(future, BaseException):
+                    raise future
+                (page_idx, pil_image, padded_image, dims), elapsed = future.result()
+                self.stats["rasterize"].add(elapsed)
+
+                # Blank and image-only pages are settled without the model
+                page_name = f"{base_name}_page_{page_idx + 1:03d}"
+                if self.page_precheck:
+                    precheck = precheck_page(pil_image, self.save_dir, page_name, save_figure=self.save_figure)
+                    if precheck is not None:
+                        pages_elements[page_idx], page_info = precheck
+                        page_store.append(page_idx, pages_elements[page_idx], page_info=page_info)
+                        continue
+
+                layout_start = time.perf_counter()
+                layout_output = profiled_chat(self.model, LAYOUT_PROMPT, pil_image, "layout", page_name)
+                self.stats["layout"].add(time.perf_counter() - layout_start)
+
+                crop_future = self.pool.submit(timed_call, crop_layout_elements, layout_output, padded_image, dims)
+                pending.append((page_idx, crop_future))
+
+                # Recognize earlier pages while the crops of this one are being prepared
+                if len(pending) > self.pages_per_batch:
+                    group, pending = pending[: self.pages_per_batch], pending[self.pages_per_batch :]
+                    self._recognize_pages(group, base_name, pages_elements, page_store)
+
+            while pending:
+                group, pending = pending[: self.pages_per_batch], pending[self.pages_per_batch :]
+                self._recognize_pages(group, base_name, pages_elements, page_store)
+        except BaseException:
+            # Unblock the feeder so it does not hold pool slots for an abandoned document
+            stop.set()
+            while not feeder_done:
+                feeder_done = render_queue.get() is _DONE
+            raise
+        finally:
+            feeder.join()
+
+        all_results = page_store.assemble(num_pages)
+
+        # Stage 5: combined JSON/markdown, once the figures they link are written
+        self.flush()
+        write_start = time.perf_counter()
+        json_path = save_combined_pdf_results(all_results, document_path, self.save_dir)
+        self.stats["write"].add(time.perf_counter() - write_start)
+
+        self.wall_time += time.perf_counter() - start
+        return json_path, all_results
+
+    def _feed_pages(self, document_path, page_indices, render_queue, stop):
+        try:
+            for page_idx in page_indices:
+                if stop.is_set():
+                    break
+                future = self.pool.submit(timed_call, rasterize_pdf_page, document_path, page_idx, self.target_size)
+                render_queue.put(future)
+        except Exception as e:
+            # e.g. a shut-down pool: handed to the model thread, which raises it
+            render_queue.put(e)
+        finally:
+            render_queue.put(_DONE)
+
+    def _recognize_pages(self, group, base_name, pages_elements, page_store):
+        """Recognize the text/table crops of a group of pages in shared batches"""
+        pooled_elements = []
+        for page_idx, crop_future in group:
+            elements, elapsed = crop_future.result()
+            self.stats["crop"].add(elapsed)
+
+            page_name = f"{base_name}_page_{page_idx + 1:03d}"
+            figure_results, text_table_elements = split_elements(
+                elements, self.save_dir, page_name, save_figure=self.save_figure
+            )
+            pages_elements[page_idx] = figure_results
+            pooled_elements.extend((page_idx, elem) for elem in text_table_elements)
+
+        recognize_start = time.perf_counter()
+        batch_results = recognize_elements(
+            [elem for _, elem in pooled_elements], self.model, self.max_batch_size, self.crop_cache
+        )
+        self.stats["recognize"].add(time.perf_counter() - recognize_start, items=len(pooled_elements))
+
+        for (page_idx, _), result in zip(pooled_elements, batch_results):
+            pages_elements[page_idx].append(result)
+        for page_idx, _ in group:
+            pages_elements[page_idx].sort(key=lambda x: x.get("reading_order", 0))
+            page_store.append(page_idx, pages_elements[page_idx])
+
+    def _queue_figure(self, pil_crop, save_dir, image_name, reading_order):
+        """Hand a figure to the writer thread and return the filename it will be saved under"""
+        self.write_queue.put((save_figure_to_local, (pil_crop, save_dir, image_name, reading_order)))
+        return get_figure_filename(image_name, reading_order)
+
+    def _writer_loop(self):
+        while True:
+            task = self.write_queue.get()
+            if task is _DONE:
+                self.write_queue.task_done()
+                break
+            func, args = task
+            write_start = time.perf_counter()
+            try:
+                func(*args)
+            except Exception as e:
+                # Raised on the calling thread by the next flush
+                self.write_errors.append(e)
+            self.stats["write"].add(time.perf_counter() - write_start)
+            self.write_queue.task_done()
+
+    def flush(self):
+        """Block until every queued figure has been written
+
+        Raises:
+            The first error of the writer thread since the last flush
+        """
+        self.write_queue.join()
+        if self.figure_writer is not None:
+            self.figure_writer.flush()
+        if self.write_errors:
+            error, self.write_errors = self.write_errors[0], []
+            raise error
+
+    def close(self):
+        """Flush pending writes and shut the worker pool down"""
+        if self.writer.is_alive():
+            self.write_queue.put(_DONE)
+            self.writer.join()
+        self.pool.shutdown()
+
+    def report(self):
+        """Per-stage utilization over the time spent in process_document
+
+        Returns:
+            dict: stage name -> {"busy_time", "items", "utilization"}
+        """
+        return {
+            name: {
+                "busy_time": round(stage.busy_time, 3),
+                "items": stage.items,
+                "utilization": round(stage.utilization(self.wall_time), 3),
+            }
+            for name, stage in self.stats.items()
+        }
+
+    def print_report(self):
+        """Print per-stage utilization; the busiest stage is the bottleneck"""
+        report = self.report()
+        print(f"\nPipeline wall time: {self.wall_time:.2f}s")
+        for name, stage in report.items():
+            print(
+                f"  {name:<10} busy {stage['busy_time']:>9.2f}s  items {stage['items']:>6}  "
+                f"utilization {stage['utilization'] * 100:5.1f}%"
+            )
+        bottleneck = max(report, key=lambda name: report[name]["utilization"])
+        print(f"  bottleneck: {bottleneck}")
@@ -0,0 +1,270 @@
+"""
+Durable job queue CLI for the full-corpus Dolphin run
+
+Replaces the notebook loop over PDFs (and the hand-written failed_pdfs.json) with a
+SQLite-backed queue (utils/job_queue.py). Start as many workers as the machine holds;
+each leases one PDF at a time, runs demo_page.process_document and
+transform_dolphin_to_oxcart_preserving_labels on it and writes <name>_philatelic.json.
+A worker that dies loses its lease and the PDF goes back to the queue; its finished pages
+are kept in the page store, so the next worker resumes where it stopped.
+
+PDFs longer than --shard_pages are queued as page-range shards that several workers
+process in parallel; the worker finishing the last shard stitches the combined results,
+which are identical to a single-pass run (global page numbers, same chunk IDs).
+
+Usage:
+    python ocr_queue.py add ./pdfs --priority 10 --shard_pages 100
+    python ocr_queue.py worker --save_dir ./results --output_dir ./results/parsed_jsons --enrich
+    python ocr_queue.py status
+    python ocr_queue.py failed --export failed_pdfs.json
+    python ocr_queue.py retry
+"""
+
+import argparse
+import glob
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+from pathlib import Path
+
+from utils.job_queue import JobQueue
+from utils.page_store import page_range_shards
+
+DEFAULT_QUEUE = "./results/ocr_queue.sqlite"
+
+
+def collect_pdfs(inputs):
+    """PDF paths from files, directories and glob patterns"""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(sorted(glob.glob(os.path.join(item, "*.pdf")) + glob.glob(os.path.join(item, "*.PDF"))))
+        elif os.path.exists(item):
+            paths.append(item)
+        else:
+            paths.extend(sorted(glob.glob(item)))
+    return paths
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "unknown"
+    hours, rest = divmod(int(seconds), 3600)
+    return f"{hours}h{rest // 60:02d}m"
+
+
+class LeaseKeeper:
+    """Renews a job lease in the background while the document is processed"""
+
+    def __init__(self, job_queue, job_id, worker_id, lease_seconds):
+        self.job_queue = job_queue
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="lease-keeper", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        self._thread.join()
+
+    def _loop(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            if not self.job_queue.renew(self.job_id, self.worker_id, self.lease_seconds):
+                self.lost = True
+                print(f"Warning: lease of job {self.job_id} was lost, another worker may take it over")
+                return
+
+
+def process_job(job, model, args):
+    """OCR one PDF and write its OXCART JSON
+
+    Returns:
+        Path of the written JSON file (None for a shard that did not complete its document)
+    """
+    from demo_page import process_document
+    from dolphin_transformer import transform_dolphin_to_oxcart_preserving_labels
+    from philatelic_patterns import save_json
+
+    pdf_name = Path(job["path"]).stem
+    _, recognition_results = process_document(
+        document_path=job["path"],
+        model=model,
+        save_dir=args.save_dir,
+        max_batch_size=args.max_batch_size,
+        pages_per_batch=args.pages_per_batch,
+        crop_cache=args.crop_cache_instance,
+        text_layer=args.text_layer,
+        page_range=(job["page_start"], job["page_stop"]) if job["page_stop"] else None,
+    )
+    if recognition_results is None:
+        return None  # a shard whose document is not complete yet; the last shard stitches it
+    ox = transform_dolphin_to_oxcart_preserving_labels(recognition_results, doc_id=pdf_name, optimize_for_rag=True)
+    if args.enrich:
+        from philatelic_patterns import enrich_all_chunks_advanced_philatelic
+
+        ox = enrich_all_chunks_advanced_philatelic(ox)
+    return save_json(ox, os.path.join(args.output_dir, f"{pdf_name}_philatelic.json"))
+
+
+def run_worker(args):
+    from omegaconf import OmegaConf
+
+    from chat import DOLPHIN
+    from utils.utils import setup_output_dirs
+
+    job_queue = JobQueue(args.queue, backoff_base=args.backoff)
+    worker_id = args.worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    setup_output_dirs(args.save_dir)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    model = DOLPHIN(OmegaConf.load(args.config))
+    args.crop_cache_instance = None
+    if args.crop_cache:
+        from utils.crop_cache import CropCache
+
+        args.crop_cache_instance = CropCache(args.crop_cache, model.model_args)
+
+    print(f"Worker {worker_id} polling {args.queue}")
+    processed = 0
+    while args.max_jobs is None or processed < args.max_jobs:
+        job = job_queue.lease(worker_id, args.lease)
+        if job is None:
+            # Wait for retries in backoff and for leases of other workers, which return to
+            # the queue if those workers die
+            counts = job_queue.status()["counts"]
+            if not args.wait and counts["pending"] == 0 and counts["leased"] == 0:
+                break
+            time.sleep(args.poll)
+            continue
+
+        pages = f" pages {job['page_start'] + 1}-{job['page_stop']}" if job["page_stop"] else ""
+        print(
+            f"\n[{worker_id}] Job {job['id']} (attempt {job['attempts']}/{job['max_attempts']}): {job['path']}{pages}"
+        )
+        start = time.perf_counter()
+        with LeaseKeeper(job_queue, job["id"], worker_id, args.lease):
+            try:
+                output = process_job(job, model, args)
+            except Exception as e:
+                state = job_queue.fail(job["id"], worker_id, f"{e}\n{traceback.format_exc()}")
+                print(f"Job {job['id']} failed ({e}), now {state}")
+            else:
+                job_queue.complete(job["id"], worker_id, output)
+                print(f"Job {job['id']} done in {time.perf_counter() - start:.1f}s -> {output or 'shard stored'}")
+        processed += 1
+
+    if args.crop_cache_instance is not None:
+        args.crop_cache_instance.close()
+    print(f"Worker {worker_id} finished after {processed} job(s)")
+
+
+def add_documents(args):
+    """Queue PDFs, as page-range shards when they are longer than --shard_pages"""
+    job_queue = JobQueue(args.queue)
+    paths = collect_pdfs(args.inputs)
+    whole, sharded = [], 0
+    for path in paths:
+        num_pages = 0
+        if args.shard_pages > 0:
+            from utils.utils import get_pdf_page_count
+
+            num_pages = get_pdf_page_count(path)
+        if num_pages > args.shard_pages > 0:
+            shards = page_range_shards(num_pages, args.shard_pages)
+            sharded += job_queue.add_shards(path, shards, priority=args.priority, max_attempts=args.max_attempts)
+            print(f"{path}: {num_pages} pages in {len(shards)} shards")
+        else:
+            whole.append(path)
+    added = job_queue.add(whole, priority=args.priority, max_attempts=args.max_attempts)
+    print(f"Queued {added} new PDF(s) and {sharded} new shard(s) from {len(paths)} PDF(s)")
+
+
+def print_status(args):
+    job_queue = JobQueue(args.queue)
+    status = job_queue.status(window=args.window)
+    counts = status["counts"]
+    total = sum(counts.values())
+    print(f"Queue {args.queue}: {total} document(s)")
+    for state, count in counts.items():
+        print(f"  {state:<8} {count:6d}")
+    print(f"Active workers: {len(status['workers'])} {' '.join(status['workers'])}")
+    print(
+        f"Throughput: {status['docs_per_hour']:.1f} docs/hour over the last {args.window / 60:.0f} min, "
+        f"ETA {format_duration(status['eta_seconds'])}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Durable OCR job queue for Dolphin corpus runs")
+    parser.add_argument("--queue", default=DEFAULT_QUEUE, help=f"SQLite queue file (default: {DEFAULT_QUEUE})")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    add_parser = subparsers.add_parser("add", help="Queue PDFs (files, directories or glob patterns)")
+    add_parser.add_argument("inputs", nargs="+")
+    add_parser.add_argument("--priority", type=int, default=0, help="Higher priorities are processed first")
+    add_parser.add_argument("--max_attempts", type=int, default=3, help="Attempts before a PDF is marked failed")
+    add_parser.add_argument(
+        "--shard_pages",
+        type=int,
+        default=0,
+        help="Split PDFs longer than this into page-range shards processed in parallel (default: 0, no sharding)",
+    )
+
+    worker_parser = subparsers.add_parser("worker", help="Process queued PDFs until the queue is empty")
+    worker_parser.add_argument("--config", default="./config/Dolphin.yaml", help="Path to configuration file")
+    worker_parser.add_argument("--save_dir", default="./results", help="Directory for Dolphin results")
+    worker_parser.add_argument("--output_dir", default="./results/parsed_jsons", help="Directory for OXCART JSONs")
+    worker_parser.add_argument("--max_batch_size", type=int, default=4, help="Element decoding batch size")
+    worker_parser.add_argument("--pages_per_batch", type=int, default=1, help="PDF pages pooled per batch")
+    worker_parser.add_argument("--crop_cache", default=None, help="SQLite crop cache shared by the workers")
+    worker_parser.add_argument("--text_layer", action="store_true", help="Use born-digital text layers")
+    worker_parser.add_argument("--enrich", action="store_true", help="Add philatelic metadata to the chunks")
+    worker_parser.add_argument("--worker_id", default=None, help="Worker name (default: host:pid)")
+    worker_parser.add_argument("--lease", type=float, default=600, help="Lease timeout in seconds")
+    worker_parser.add_argument("--backoff", type=float, default=30, help="First retry delay in seconds")
+    worker_parser.add_argument("--poll", type=float, default=10, help="Seconds between polls of an idle queue")
+    worker_parser.add_argument("--wait", action="store_true", help="Keep polling when the queue is empty")
+    worker_parser.add_argument("--max_jobs", type=int, default=None, help="Stop after this many jobs")
+
+    status_parser = subparsers.add_parser("status", help="Show progress, throughput and ETA")
+    status_parser.add_argument("--window", type=float, default=3600, help="Throughput window in seconds")
+
+    failed_parser = subparsers.add_parser("failed", help="List PDFs that ran out of attempts")
+    failed_parser.add_argument("--export", default=None, help="Also write them to this JSON file")
+
+    subparsers.add_parser("retry", help="Requeue failed PDFs with fresh attempts")
+
+    args = parser.parse_args()
+    if args.command == "add":
+        add_documents(args)
+    elif args.command == "worker":
+        run_worker(args)
+    elif args.command == "status":
+        print_status(args)
+    elif args.command == "failed":
+        failed = [
+            {"pdf": Path(job["path"]).stem, "path": job["path"], "attempts": job["attempts"], "error": job["error"]}
+            for job in JobQueue(args.queue).jobs("failed")
+        ]
+        for job in failed:
+            error = (job["error"] or "").strip().splitlines()
+            print(f"{job['path']} ({job['attempts']} attempts): {error[0] if error else 'unknown error'}")
+        if args.export:
+            with open(args.export, "w", encoding="utf-8") as f:
+                json.dump(failed, f, indent=2, ensure_ascii=False)
+            print(f"{len(failed)} failed PDF(s) saved to {args.export}")
+    elif args.command == "retry":
+        print(f"Requeued {JobQueue(args.queue).retry_failed()} failed PDF(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+Summarize OCR profiles: the labels and pages the decoding time went to
+
+Profiles are written by demo_page.py --profile as recognition_json/<name>.profile.json.
+
+Usage:
+    python profile_report.py ./results/recognition_json --top 15
+    python profile_report.py ./results/recognition_json/catalog.profile.json
+"""
+
+import argparse
+import glob
+import os
+
+from utils.ocr_profile import print_profile_summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize Dolphin OCR profiles")
+    parser.add_argument("inputs", nargs="+", help="Profile files or directories holding *.profile.json")
+    parser.add_argument("--top", type=int, default=10, help="Number of labels and pages to list (default: 10)")
+    args = parser.parse_args()
+
+    paths = []
+    for item in args.inputs:
+        if os.path.isdir(item):
+            paths.extend(sorted(glob.glob(os.path.join(item, "*.profile.json"))))
+        else:
+            paths.append(item)
+    if not paths:
+        print("No profiles found")
+        return
+    print(f"{len(paths)} profile(s)")
+    print_profile_summary(paths, top=args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import copy
+
+import cv2
+import numpy as np
+
+from utils.utils import adjust_box_edges, compute_edge_maps
+
+
+def reference_adjust_box_edges(image, boxes, max_pixels=15, threshold=0.2):
+    """Edge refinement as it was before the prefix-sum version (one binarization per step)"""
+    img_h, img_w = image.shape[:2]
+    new_boxes = []
+    for box in boxes:
+        best_box = copy.deepcopy(box)
+
+        def check_edge(img, current_box, i, is_vertical):
+            edge = current_box[i]
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+
+            if is_vertical:
+                line = binary[current_box[1] : current_box[3] + 1, edge]
+            else:
+                line = binary[edge, current_box[0] : current_box[2] + 1]
+
+            transitions = np.abs(np.diff(line))
+            return np.sum(transitions) / len(transitions)
+
+        edges = [(0, -1, True), (2, 1, True), (1, -1, False), (3, 1, False)]
+
+        current_box = copy.deepcopy(box)
+        current_box[0] = min(max(current_box[0], 0), img_w - 1)
+        current_box[1] = min(max(current_box[1], 0), img_h - 1)
+        current_box[2] = min(max(current_box[2], 0), img_w - 1)
+        current_box[3] = min(max(current_box[3], 0), img_h - 1)
+
+        for i, direction, is_vertical in edges:
+            best_score = check_edge(image, current_box, i, is_vertical)
+            if best_score <= threshold:
+                continue
+            for _ in range(max_pixels):
+                current_box[i] += direction
+                if i == 0 or i == 2:
+                    current_box[i] = min(max(current_box[i], 0), img_w - 1)
+                else:
+                    current_box[i] = min(max(current_box[i], 0), img_h - 1)
+                score = check_edge(image, current_box, i, is_vertical)
+
+                if score < best_score:
+                    best_score = score
+                    best_box = copy.deepcopy(current_box)
+
+                if score <= threshold:
+                    break
+        new_boxes.append(best_box)
+
+    return new_boxes
+
+
+def _make_page(rng, h=160, w=120):
+    image = np.full((h, w, 3), 255, dtype=np.uint8)
+    for _ in range(40):
+        x, y = int(rng.integers(0, w)), int(rng.integers(0, h))
+        cv2.rectangle(image, (x, y), (x + int(rng.integers(1, 20)), y + int(rng.integers(1, 6))), (0, 0, 0), -1)
+    cv2.putText(image, "Genus 1882", (5, 80), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
+    return image
+
+
+def _random_boxes(rng, h, w, n):
+    boxes = []
+    for _ in range(n):
+        x1, y1 = int(rng.integers(-3, w)), int(rng.integers(-3, h))
+        boxes.append([x1, y1, x1 + int(rng.integers(0, 60)), y1 + int(rng.integers(0, 40))])
+    return boxes
+
+
+def test_matches_reference_refinement():
+    rng = np.random.default_rng(0)
+    for _ in range(10):
+        image = _make_page(rng)
+        boxes = _random_boxes(rng, *image.shape[:2], n=25)
+        with np.errstate(invalid="ignore"):
+            expected = reference_adjust_box_edges(image, copy.deepcopy(boxes))
+        assert adjust_box_edges(image, boxes) == expected
+
+
+def test_precomputed_edge_maps_and_thresholds():
+    rng = np.random.default_rng(1)
+    image = _make_page(rng)
+    boxes = _random_boxes(rng, *image.shape[:2], n=25)
+    edge_maps = compute_edge_maps(image)
+    for max_pixels, threshold in ((15, 0.2), (5, 0.0), (30, 50.0)):
+        with np.errstate(invalid="ignore"):
+            expected = reference_adjust_box_edges(image, copy.deepcopy(boxes), max_pixels, threshold)
+        assert adjust_box_edges(None, boxes, max_pixels, threshold, edge_maps=edge_maps) == expected
@@ -0,0 +1,157 @@
+import asyncio
+import contextlib
+import json
+import time
+
+from deployment_loader import load_deployment_module
+
+admission = load_deployment_module("admission.py")
+
+
+class MockEngine:
+    """ASGI stand-in for a server's generate routes: sleeps, then reports a batch of one"""
+
+    def __init__(self, metrics, seconds=0.0, tokens=10):
+        self.metrics = metrics
+        self.seconds = seconds
+        self.tokens = tokens
+        self.cancelled = 0
+
+    async def __call__(self, scope, receive, send):
+        await receive()
+        try:
+            await asyncio.sleep(self.seconds)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if scope["path"] == "/generate":
+            self.metrics.record_batch(1, self.tokens)
+        body = json.dumps({"text": "ok"}).encode()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": body})
+
+
+async def _request(app, path="/generate", method="POST", headers=(), disconnect_after=None):
+    """Status, headers and body of a request (status None if the client left before the response)"""
+    messages = []
+    body_read = False
+    response_complete = asyncio.Event()
+
+    async def receive():
+        # Like a server: the body, then a disconnect once the response is done or the client leaves
+        nonlocal body_read
+        if not body_read:
+            body_read = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(response_complete.wait(), disconnect_after)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+        if message["type"] == "http.response.body" and not message.get("more_body", False):
+            response_complete.set()
+
+    scope = {"type": "http", "path": path, "method": method, "headers": list(headers)}
+    await app(scope, receive, send)
+    if not messages:
+        return None, {}, b""
+    start = messages[0]
+    body = b"".join(message.get("body", b"") for message in messages[1:])
+    return start["status"], dict(start["headers"]), body
+
+
+def _server(seconds, max_in_flight=2, request_timeout=5.0):
+    controller = admission.AdmissionController(max_in_flight=max_in_flight, request_timeout=request_timeout)
+    engine = MockEngine(controller.metrics, seconds=seconds)
+    return controller, engine, admission.AdmissionMiddleware(engine, controller)
+
+
+def test_requests_over_the_limit_are_rejected_at_once():
+    controller, engine, app = _server(seconds=0.05)
+
+    async def run():
+        return await asyncio.gather(*(_request(app) for _ in range(5)))
+
+    responses = asyncio.run(run())
+    statuses = sorted(status for status, _, _ in responses)
+    assert statuses == [200, 200, 429, 429, 429]
+    rejected = [headers for status, headers, _ in responses if status == 429]
+    assert all(int(headers[b"retry-after"]) >= 1 for headers in rejected)
+    assert controller.in_flight == 0
+
+    snapshot = controller.snapshot()
+    assert snapshot["rejected"] == 3
+    assert snapshot["status_counts"] == {"200": 2}
+    assert snapshot["batch_size_histogram"] == {"1": 2}
+
+
+def test_requests_past_their_deadline_are_cancelled():
+    controller, engine, app = _server(seconds=1.0, request_timeout=0.5)
+
+    async def run():
+        # The client asks for less than the server's request timeout
+        return await _request(app, headers=[(b"x-deadline-seconds", b"0.05")])
+
+    status, _, body = asyncio.run(run())
+    assert status == 504
+    assert "deadline" in json.loads(body)["error"]
+    assert engine.cancelled == 1
+    assert controller.in_flight == 0
+    assert controller.snapshot()["timed_out"] == 1
+
+
+def test_requests_of_disconnected_clients_are_cancelled():
+    controller, engine, app = _server(seconds=1.0)
+
+    start = time.perf_counter()
+    status, _, _ = asyncio.run(_request(app, disconnect_after=0.05))
+    assert time.perf_counter() - start < 0.5, "the request ran on after its client left"
+    assert status is None
+    assert engine.cancelled == 1
+    assert controller.in_flight == 0
+    snapshot = controller.snapshot()
+    assert snapshot["disconnected"] == 1 and snapshot["timed_out"] == 0
+    assert snapshot["status_counts"] == {"499": 1}
+
+
+def test_metrics_endpoint_and_other_routes_bypass_admission():
+    controller, engine, app = _server(seconds=0.0, max_in_flight=1)
+
+    async def run():
+        for _ in range(4):
+            await _request(app)
+        controller.in_flight = 1  # server full: /health and /metrics still answer
+        health = await _request(app, path="/health", method="GET")
+        metrics = await _request(app, path="/metrics", method="GET")
+        controller.in_flight = 0
+        return health, metrics
+
+    health, (status, headers, body) = asyncio.run(run())
+    assert health[0] == 200
+    assert status == 200 and headers[b"content-type"] == b"application/json"
+    metrics = json.loads(body)
+    assert metrics["requests"] == 4 and metrics["rejected"] == 0
+    assert metrics["in_flight"] == 1 and metrics["max_in_flight"] == 1
+    assert metrics["batch_size_histogram"] == {"1": 4}
+    assert set(metrics["latency_seconds"]) == {"p50", "p95", "p99"}
+    assert metrics["latency_seconds"]["p99"] is not None
+
+
+def test_tokens_per_second_and_percentiles():
+    now = [100.0]
+    metrics = admission.ServerMetrics(window=10.0, clock=lambda: now[0])
+    metrics.record_batch(4, tokens=300)
+    now[0] = 105.0
+    metrics.record_batch(2, tokens=200)
+    for seconds in range(1, 101):
+        metrics.record_request(200, seconds / 100)
+
+    snapshot = metrics.snapshot()
+    assert snapshot["tokens_per_second"] == 50.0
+    assert snapshot["batch_size_histogram"] == {"2": 1, "4": 1}
+    assert snapshot["latency_seconds"] == {"p50": 0.5, "p95": 0.95, "p99": 0.99}
+
+    now[0] = 112.0  # the first batch left the window
+    assert metrics.snapshot()["tokens_per_second"] == 20.0
+    assert admission.percentile([], 50) is None
@@ -0,0 +1,40 @@
+import os
+
+import torch
+from safetensors.torch import load_file
+
+from chat import convert_checkpoint_to_safetensors, resolve_checkpoint_path
+
+
+def test_legacy_names_are_renamed_and_tied_weights_stored_once(tmp_path):
+    embed = torch.randn(10, 4)
+    ckpt = {
+        "state_dict": {
+            "model.encoder.layer.weight": torch.randn(4, 4),
+            "model.decoder.model.lm_head.weight": embed,
+            "model.decoder.model.model.decoder.embed_tokens.weight": embed,
+        }
+    }
+    ckpt_path = str(tmp_path / "dolphin_model.bin")
+    torch.save(ckpt, ckpt_path)
+
+    output_path = convert_checkpoint_to_safetensors(ckpt_path)
+
+    assert output_path == str(tmp_path / "dolphin_model.safetensors")
+    state_dict = load_file(output_path)
+    assert sorted(state_dict) == ["llm.model.model.decoder.embed_tokens.weight", "vpm.layer.weight"]
+    assert torch.equal(state_dict["llm.model.model.decoder.embed_tokens.weight"], embed)
+
+
+def test_converted_checkpoint_is_preferred_while_up_to_date(tmp_path):
+    ckpt_path = tmp_path / "dolphin_model.bin"
+    ckpt_path.write_bytes(b"ckpt")
+    assert resolve_checkpoint_path(str(ckpt_path)) == str(ckpt_path)
+
+    converted = tmp_path / "dolphin_model.safetensors"
+    converted.write_bytes(b"converted")
+    assert resolve_checkpoint_path(str(ckpt_path)) == str(converted)
+
+    # A checkpoint replaced after the conversion wins until it is converted again
+    os.utime(ckpt_path, (os.path.getmtime(converted) + 10,) * 2)
+    assert resolve_checkpoint_path(str(ckpt_path)) == str(ckpt_path)
@@ -0,0 +1,77 @@
+import torch
+from torch import nn
+
+from utils.model import DonutConfig, DonutModel
+
+VOCAB_SIZE = 24
+PAD, EOS = 1, 2
+
+
+class StubTokenizer:
+    pad_token_id = PAD
+    eos_token_id = EOS
+    vocab = {f"<t{i}>": i for i in range(VOCAB_SIZE)}
+
+    def __len__(self):
+        return VOCAB_SIZE
+
+    def batch_decode(self, sequences, skip_special_tokens=False):
+        return [" ".join(str(int(token)) for token in sequence) for sequence in sequences]
+
+
+class StubEncoder(nn.Module):
+    """Maps a tiny image to four encoder states, in place of the Swin encoder"""
+
+    def __init__(self, hidden_dimension):
+        super().__init__()
+        self.hidden_dimension = hidden_dimension
+        self.proj = nn.Linear(3 * 4 * 4, 4 * hidden_dimension)
+
+    def forward(self, x, text_embedding=None):
+        return self.proj(x.flatten(1)).view(x.shape[0], 4, self.hidden_dimension)
+
+
+def _model():
+    torch.manual_seed(0)
+    config = DonutConfig(decoder_layer=2, max_length=24, hidden_dimension=32)
+    model = DonutModel(config, vision_tower=StubEncoder(32), tokenizer=StubTokenizer()).double().eval()
+    # Large random weights, so outputs depend on the image, the prompt and every position
+    with torch.no_grad():
+        for parameter in model.parameters():
+            if parameter.dim() > 1:
+                parameter.normal_(0, 1.0)
+        model.llm.model.model.decoder.embed_tokens.weight[PAD] = 0
+    return model
+
+
+PROMPTS = [[0, 5], [0, 6, 7], [0, 8], [0, 9, 10], [0, 11], [0, 12, 13]]
+
+
+def _static(model, images, budgets):
+    """Decode every item on its own with generate"""
+    sequences, stop_reasons = [], []
+    for i, prompt in enumerate(PROMPTS):
+        output = model.inference(
+            torch.tensor([prompt]), image_tensors=images[i : i + 1], early_stopping=False, max_new_tokens=[budgets[i]]
+        )
+        sequences.append(output["sequences"][0].tolist())
+        stop_reasons.extend(output["stop_reasons"])
+    return sequences, stop_reasons
+
+
+def test_continuous_batching_matches_static_decoding():
+    model = _model()
+    images = torch.randn(len(PROMPTS), 3, 4, 4, dtype=torch.double)
+    budgets = [30, 30, 5, 30, 30, 9]
+    expected_sequences, expected_reasons = _static(model, images, budgets)
+    # Rows stop at different steps, for different reasons
+    assert {"eos", "budget", "max_length"} <= set(expected_reasons)
+    assert len({len(sequence) for sequence in expected_sequences}) >= 4
+
+    # Left padded prompts of two lengths; two slots, so finished rows are refilled from the queue
+    prompt_ids = torch.tensor([[PAD] * (3 - len(prompt)) + prompt for prompt in PROMPTS])
+    output = model.inference_continuous(prompt_ids, images, max_batch_size=2, max_new_tokens=budgets)
+
+    assert output["sequences"] == expected_sequences
+    assert output["stop_reasons"] == expected_reasons
+    assert max(output["batch_rows"]) == 2
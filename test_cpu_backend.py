@@ -0,0 +1,17 @@
+import torch
+from torch import nn
+
+from utils.model import quantize_linears_int8
+
+
+def test_linears_are_quantized_and_stay_close():
+    torch.manual_seed(0)
+    module = nn.Sequential(nn.Linear(64, 128), nn.GELU(), nn.Linear(128, 32), nn.LayerNorm(32))
+    inputs = torch.randn(8, 64)
+    reference = module(inputs)
+
+    quantize_linears_int8(module)
+
+    assert not any(type(layer) is nn.Linear for layer in module.modules())
+    assert isinstance(module[3], nn.LayerNorm)
+    assert torch.allclose(module(inputs), reference, atol=0.1)
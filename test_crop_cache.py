@@ -0,0 +1,74 @@
+import numpy as np
+from PIL import Image, ImageDraw
+
+from demo_page import recognize_elements
+from utils.crop_cache import CropCache, perceptual_image_hash
+
+
+def _running_title(text="SURFACE MAIL", size=(240, 24), offset=0):
+    image = Image.new("RGB", size, "white")
+    ImageDraw.Draw(image).text((10 + offset, 6), text, fill="black")
+    return image
+
+
+class CountingModel:
+    model_args = {}
+
+    def __init__(self):
+        self.decoded = 0
+
+    def chat(self, prompts, crops, return_stop_reason=False, **kwargs):
+        self.decoded += len(crops)
+        texts = [f"{prompt[:4]} {np.asarray(crop).sum()}" for prompt, crop in zip(prompts, crops)]
+        return texts, ["eos"] * len(texts)
+
+
+def _elements(crops):
+    prompt = "Read text in the image."
+    return [
+        {"crop": crop, "prompt": prompt, "label": "header", "bbox": [0, 0, 1, 1], "reading_order": i}
+        for i, crop in enumerate(crops)
+    ]
+
+
+def test_cache_hits_across_calls_and_runs(tmp_path):
+    path = str(tmp_path / "crops.sqlite")
+    model = CountingModel()
+    crops = [_running_title(), _running_title("Costa Rica Postal Catalogue"), _running_title()]
+
+    cache = CropCache(path)
+    first = recognize_elements(_elements(crops), model, 4, crop_cache=cache)
+    assert model.decoded == 2  # the repeated title is decoded once
+    assert first[0]["text"] == first[2]["text"]
+    cache.close()
+
+    cache = CropCache(path)
+    second = recognize_elements(_elements(crops), model, 4, crop_cache=cache)
+    assert model.decoded == 2
+    assert [r["text"] for r in second] == [r["text"] for r in first]
+    assert cache.hit_rate() == 1.0
+
+
+def test_decoding_settings_are_part_of_the_key(tmp_path):
+    path = str(tmp_path / "crops.sqlite")
+    crop = _running_title()
+    key = CropCache(path, {"max_length": 4096}).key(crop, "Read text in the image.")
+    assert CropCache(path, {"max_length": 4096}).key(crop, "Read text in the image.") == key
+    assert CropCache(path, {"max_length": 2048}).key(crop, "Read text in the image.") != key
+    assert CropCache(path, {"max_length": 4096}).key(crop, "Parse the table in the image.") != key
+    for settings in ({"decoding_engine": "continuous"}, {"length_bucketing": True}):
+        assert CropCache(path, {"max_length": 4096, **settings}).key(crop, "Read text in the image.") != key
+
+
+def test_outputs_cut_short_are_not_cached(tmp_path):
+    cache = CropCache(str(tmp_path / "crops.sqlite"))
+    keys = ["complete", "looped", "over_budget"]
+    cache.put_many(keys, ["SURFACE MAIL", "1 1 1 1", "Costa"], ["eos", "repetition", "budget"])
+    assert cache.get_many(keys) == [{"text": "SURFACE MAIL", "stop_reason": "eos"}, None, None]
+
+
+def test_perceptual_hash_tolerates_small_shifts():
+    assert perceptual_image_hash(_running_title(size=(240, 24))) == perceptual_image_hash(
+        _running_title(size=(241, 24))
+    )
+    assert perceptual_image_hash(_running_title("SURFACE MAIL")) != perceptual_image_hash(_running_title("AIR MAIL"))
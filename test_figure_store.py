@@ -0,0 +1,41 @@
+import os
+
+from PIL import Image
+
+from utils.figure_store import FigureWriter, thumbnail_path
+
+
+def _figures_dir(tmp_path):
+    figures_dir = tmp_path / "markdown" / "figures"
+    figures_dir.mkdir(parents=True)
+    return figures_dir
+
+
+def test_default_writer_keeps_figure_names(tmp_path):
+    figures_dir = _figures_dir(tmp_path)
+    writer = FigureWriter()
+    filename = writer(Image.new("RGB", (40, 30), "red"), str(tmp_path), "doc_page_001", 2)
+    writer.close()
+
+    assert filename == "doc_page_001_figure_002.png"
+    assert Image.open(figures_dir / filename).size == (40, 30)
+
+
+def test_repeated_figures_are_stored_once(tmp_path):
+    figures_dir = _figures_dir(tmp_path)
+    writer = FigureWriter(image_format="webp", thumbnail_size=16, dedup=True)
+    logo = Image.new("RGB", (64, 48), "navy")
+    names = [writer(logo.copy(), str(tmp_path), f"doc_page_{page:03d}", 0) for page in range(1, 4)]
+    plate = writer(Image.new("RGB", (64, 48), "green"), str(tmp_path), "doc_page_004", 1)
+    writer.close()
+
+    assert len(set(names)) == 1 and names[0].endswith(".webp") and plate != names[0]
+    assert (writer.written, writer.deduplicated) == (2, 2)
+    assert sorted(os.listdir(figures_dir)) == sorted([names[0], plate, "thumbs"])
+    assert max(Image.open(thumbnail_path(str(figures_dir / plate))).size) == 16
+
+    # A later run finds the stored figure and does not write it again
+    writer = FigureWriter(image_format="webp", dedup=True)
+    assert writer(logo, str(tmp_path), "other_page_001", 0) == names[0]
+    writer.close()
+    assert writer.written == 0
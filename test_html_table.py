@@ -0,0 +1,83 @@
+from dolphin_transformer import (
+    _simplify_html_table,
+    _table_to_md_tsv_and_sentences,
+    _validate_html_table,
+)
+from utils.html_table import parse_html_table
+
+DOLPHIN_TABLE = (
+    "<table><tr><td></td><td>HellaSwag</td><td>Obqa</td><td>Avg</td></tr>"
+    "<tr><td>OPT-1.3B</td><td>53.65</td><td>33.40</td><td>51.44</td></tr>"
+    "<tr><td>Pythia|1.0B</td><td>47.16</td><td>31.40</td><td>48.30</td></tr></table>"
+)
+
+
+def test_grid_repeats_spanned_cells():
+    table = parse_html_table(
+        "<table><thead><tr><th rowspan='2'>Scott</th><th colspan=2>Printing</th></tr>"
+        "<tr><th>Date</th><th>Quantity</th></tr></thead>"
+        "<tbody><tr><td rowspan=2>5</td><td>1882-09-01</td><td>50&nbsp;000</td></tr>"
+        "<tr><td>1882-12-01</td><td>20<br/>000</td></tr></tbody></table>"
+    )
+    assert table.has_table
+    assert table.header_rows == 2
+    assert table.grid == [
+        ["Scott", "Printing", "Printing"],
+        ["Scott", "Date", "Quantity"],
+        ["5", "1882-09-01", "50\xa0000"],
+        ["5", "1882-12-01", "20 000"],
+    ]
+    assert [len(row) for row in table.rows] == [2, 2, 3, 2]
+    assert table.stats()["cells"] == 9
+
+
+def test_unclosed_cells_and_rows_are_closed_by_the_next_tag():
+    table = parse_html_table("<table><tr><th>a<th>b<tr><td>1<td><i>2</i></table>")
+    assert table.grid == [["a", "b"], ["1", "2"]]
+    assert table.header_rows == 1
+
+
+def test_validation_statistics():
+    assert _validate_html_table(DOLPHIN_TABLE)
+    assert not _validate_html_table("<tr><td>no table tag</td></tr><tr><td>x</td></tr>")
+    assert not _validate_html_table("<table><tr><td>one row only</td></tr></table>")
+    # The "Genus" problem: most cells repeat the same text
+    repeated = "<table>" + "<tr><td>Genus</td><td>Genus</td></tr>" * 4 + "<tr><td>a</td><td>b</td></tr></table>"
+    assert not _validate_html_table(repeated)
+    # Cells whose only content is markup count as empty
+    blank = "<table>" + "<tr><td><b></b></td><td> </td></tr>" * 5 + "<tr><td>x</td><td></td></tr></table>"
+    stats = parse_html_table(blank).stats()
+    assert stats["content_cells"] == 6 and stats["empty_cells"] == 5
+    assert not _validate_html_table(blank)
+
+
+def test_renderings_come_from_one_parse():
+    table = parse_html_table(DOLPHIN_TABLE)
+    conv = _table_to_md_tsv_and_sentences(table, context_title="Table 2")
+    assert conv["headers"] == ["Column 1", "HellaSwag", "Obqa", "Avg"]
+    assert conv["markdown"].splitlines() == [
+        "| Column 1 | HellaSwag | Obqa | Avg |",
+        "| --- | --- | --- | --- |",
+        "| OPT-1.3B | 53.65 | 33.40 | 51.44 |",
+        "| Pythia\\|1.0B | 47.16 | 31.40 | 48.30 |",
+    ]
+    assert conv["tsv"].splitlines()[1] == "OPT-1.3B\t53.65\t33.40\t51.44"
+    assert conv["row_sentences"][0] == "Table 2 — Column 1: OPT-1.3B, HellaSwag: 53.65, Obqa: 33.40, Avg: 51.44"
+    assert _simplify_html_table(table).splitlines() == [
+        "Headers: HellaSwag | Obqa | Avg",
+        "Row 1: OPT-1.3B | 53.65 | 33.40 | 51.44",
+        "Row 2: Pythia|1.0B | 47.16 | 31.40 | 48.30",
+    ]
+    # HTML strings are still accepted
+    assert _table_to_md_tsv_and_sentences(DOLPHIN_TABLE, context_title="Table 2") == conv
+
+
+def test_oversized_tables_are_skipped():
+    wide = (
+        "<table>"
+        + ("<tr>" + "<td>c</td>" * 30 + "</tr>") * 2
+        + "<tr>"
+        + "".join(f"<td>{i}</td>" for i in range(30))
+        + "</tr></table>"
+    )
+    assert _table_to_md_tsv_and_sentences(wide) == {"markdown": None, "tsv": None, "headers": [], "row_sentences": []}
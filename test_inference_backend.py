@@ -0,0 +1,174 @@
+import json
+import threading
+import time
+from argparse import Namespace
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+from deployment_loader import load_deployment_module
+from utils.inference_backend import (
+    LocalBackend,
+    TensorRTBackend,
+    VLLMBackend,
+    create_backend,
+    encode_image_bytes,
+)
+
+
+class StubServer:
+    """Local stand-in for the /generate_batch endpoint of the inference servers
+
+    Echoes every prompt with the size of its image, after an optional delay, and records
+    the requests, the client connections and the peak number of requests in flight.
+    """
+
+    def __init__(self, delay=0.0, reject_first=0):
+        self.delay = delay
+        self.reject_first = reject_first
+        self.requests = []
+        self.connections = set()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode()
+                message = BytesParser(policy=HTTP).parsebytes(header + body)
+                fields = {}
+                for part in message.iter_parts():
+                    fields.setdefault(part.get_param("name", header="content-disposition"), []).append(
+                        part.get_payload(decode=True)
+                    )
+                with stub.lock:
+                    stub.connections.add(self.client_address)
+                    if stub.reject_first > 0:
+                        stub.reject_first -= 1
+                        self._reply(429, b"{}", {"Retry-After": "0"})
+                        return
+                    stub.in_flight += 1
+                    stub.peak_in_flight = max(stub.peak_in_flight, stub.in_flight)
+                    stub.requests.append(fields)
+                time.sleep(stub.delay)
+                prompts = json.loads(fields["prompts"][0])
+                texts = [f"{prompt}|{len(image)}" for prompt, image in zip(prompts, fields["images"])]
+                with stub.lock:
+                    stub.in_flight -= 1
+                self._reply(200, json.dumps({"text": texts}).encode())
+
+            def _reply(self, status, body, headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    server = StubServer(delay=0.05)
+    yield server
+    server.close()
+
+
+def test_batches_are_sent_concurrently_with_outputs_in_input_order(stub):
+    backend = TensorRTBackend(stub.url, max_concurrency=2)
+    prompts = [f"Read text in the image. {i}" for i in range(7)]
+    images = [b"x" * (i + 1) for i in range(7)]
+    try:
+        texts, stop_reasons = backend.chat(prompts, images, max_batch_size=2, return_stop_reason=True)
+        assert texts == [f"{prompt}|{i + 1}" for i, prompt in enumerate(prompts)]
+        assert stop_reasons == [None] * 7
+        assert backend.chat("Parse the reading order of this document.", b"page") == (
+            "Parse the reading order of this document.|4"
+        )
+    finally:
+        backend.close()
+
+    assert len(stub.requests) == 5
+    assert stub.peak_in_flight == 2
+    # Keep-alive: the requests reuse the pooled connections
+    assert len(stub.connections) <= 2
+    assert "sampling_params" not in stub.requests[0]
+
+
+def test_vllm_backend_sends_sampling_params(stub):
+    backend = create_backend("vllm", url=stub.url, sampling_params={"temperature": 0.0, "max_tokens": 64})
+    try:
+        assert isinstance(backend, VLLMBackend)
+        assert backend.chat(["Parse the table in the image."], [b"tab"]) == ["Parse the table in the image.|3"]
+    finally:
+        backend.close()
+    assert json.loads(stub.requests[0]["sampling_params"][0]) == {"temperature": 0.0, "max_tokens": 64}
+
+
+def test_api_client_sends_image_paths_in_one_request(stub, tmp_path, capsys):
+    api_client = load_deployment_module("tensorrt_llm/api_client.py")
+    image_paths = [str(tmp_path / f"crop_{i}.png") for i in range(3)]
+    for i, path in enumerate(image_paths):
+        Image.new("L", (8 + i, 8)).save(path)
+
+    host, port = stub.server.server_address
+    api_client.main(Namespace(host=host, port=port, prompt="Read text in the image.", image_paths=image_paths))
+
+    assert len(stub.requests) == 1
+    assert stub.requests[0]["images"] == [encode_image_bytes(path) for path in image_paths]
+    assert capsys.readouterr().out.splitlines()[0].startswith(f"{image_paths[0]}: 'Read text in the image.|")
+
+
+def test_image_bytes_are_sent_raw(tmp_path):
+    image_path = tmp_path / "crop.png"
+    Image.new("L", (8, 8)).save(image_path)
+    raw = image_path.read_bytes()
+    assert encode_image_bytes(str(image_path)) == raw
+    assert encode_image_bytes(raw) == raw
+    assert encode_image_bytes(Image.open(image_path)) == raw
+
+
+def test_rejected_batches_are_retried():
+    server = StubServer(reject_first=2)
+    backend = TensorRTBackend(server.url)
+    try:
+        assert backend.chat("Read text in the image.", b"ab") == "Read text in the image.|2"
+        assert backend.requests_sent == 3
+    finally:
+        backend.close()
+        server.close()
+
+
+def test_local_backend_delegates_to_the_model():
+    class FakeDolphin:
+        model_args = {"page_precheck": True}
+        processor = "processor"
+
+        def chat(self, question, image, max_batch_size=16, return_stop_reason=False, **kwargs):
+            texts = [f"{q}:{i}" for q, i in zip(question, image)]
+            return (texts, ["eos"] * len(texts)) if return_stop_reason else texts
+
+    backend = LocalBackend(FakeDolphin())
+    assert backend.chat(["a", "b"], [1, 2], return_stop_reason=True) == (["a:1", "b:2"], ["eos", "eos"])
+    assert backend.model_args == {"page_precheck": True}
+    assert backend.processor == "processor"
+    with pytest.raises(ValueError):
+        create_backend("tensorrt")
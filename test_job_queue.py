@@ -0,0 +1,87 @@
+from utils.job_queue import JobQueue
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _queue(tmp_path, clock):
+    return JobQueue(str(tmp_path / "queue.sqlite"), backoff_base=10, clock=clock)
+
+
+def test_priorities_and_duplicates(tmp_path):
+    job_queue = _queue(tmp_path, Clock())
+    assert job_queue.add(["a.pdf", "b.pdf"]) == 2
+    assert job_queue.add(["b.pdf", "c.pdf"], priority=5) == 1
+
+    leased = [job_queue.lease("w1")["path"] for _ in range(3)]
+    assert [path.rsplit("/", 1)[-1] for path in leased] == ["c.pdf", "a.pdf", "b.pdf"]
+    assert job_queue.lease("w1") is None
+
+
+def test_failures_back_off_then_fail_for_good(tmp_path):
+    clock = Clock()
+    job_queue = _queue(tmp_path, clock)
+    job_queue.add(["a.pdf"], max_attempts=2)
+
+    job = job_queue.lease("w1")
+    assert job_queue.fail(job["id"], "w1", "CUDA out of memory") == "pending"
+    assert job_queue.lease("w1") is None  # backing off
+    clock.now += 10
+    job = job_queue.lease("w1")
+    assert job["attempts"] == 2
+    assert job_queue.fail(job["id"], "w1", "CUDA out of memory") == "failed"
+    assert [job["error"] for job in job_queue.jobs("failed")] == ["CUDA out of memory"]
+
+    assert job_queue.retry_failed() == 1
+    assert job_queue.lease("w1")["attempts"] == 1
+
+
+def test_killed_worker_job_returns_to_queue(tmp_path):
+    clock = Clock()
+    job_queue = _queue(tmp_path, clock)
+    job_queue.add(["a.pdf"])
+
+    job = job_queue.lease("w1", lease_seconds=60)
+    clock.now += 30
+    assert job_queue.renew(job["id"], "w1", lease_seconds=60)
+    clock.now += 59
+    assert job_queue.lease("w2") is None  # lease still held
+
+    # w1 is killed and stops renewing
+    clock.now += 2
+    job = job_queue.lease("w2", lease_seconds=60)
+    assert job is not None and job["attempts"] == 2
+    assert not job_queue.complete(job["id"], "w1", "late.json")
+    assert job_queue.complete(job["id"], "w2", "a_philatelic.json")
+
+
+def test_status_reports_throughput_and_eta(tmp_path):
+    clock = Clock()
+    job_queue = _queue(tmp_path, clock)
+    job_queue.add([f"{i}.pdf" for i in range(4)])
+    for _ in range(2):
+        job = job_queue.lease("w1")
+        clock.now += 60
+        job_queue.complete(job["id"], "w1")
+    job_queue.lease("w2")
+
+    status = job_queue.status()
+    assert status["counts"] == {"pending": 1, "leased": 1, "done": 2, "failed": 0}
+    assert status["workers"] == ["w2"]
+    assert status["docs_per_hour"] == 60
+    assert status["eta_seconds"] == 120
+
+
+def test_shards_of_a_document_are_separate_jobs(tmp_path):
+    job_queue = _queue(tmp_path, Clock())
+    assert job_queue.add_shards("big.pdf", [(0, 100), (100, 200), (200, 250)]) == 3
+    assert job_queue.add_shards("big.pdf", [(0, 100)]) == 0
+    assert job_queue.add(["big.pdf"]) == 1
+
+    leased = [job_queue.lease(f"w{i}") for i in range(3)]
+    assert [(job["page_start"], job["page_stop"]) for job in leased] == [(0, 100), (100, 200), (200, 250)]
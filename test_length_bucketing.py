@@ -0,0 +1,57 @@
+from utils.scheduler import (
+    BudgetTelemetry,
+    estimate_output_length,
+    length_bucketed_batches,
+    restore_order,
+    sequential_batches,
+    token_budget,
+)
+
+
+def test_tables_estimate_longer_than_text_of_same_size():
+    assert estimate_output_length("tab", 600, 300) > estimate_output_length("para", 600, 300)
+
+
+def test_estimate_grows_with_crop_area():
+    caption = estimate_output_length("cap", 400, 14)
+    paragraph = estimate_output_length("para", 400, 280)
+    assert caption < paragraph
+    assert estimate_output_length("foot", 2, 2) >= 1
+
+
+def test_bucketed_batches_group_similar_lengths():
+    lengths = [5, 900, 7, 850, 6, 880]
+    batches = length_bucketed_batches(lengths, max_batch_size=3)
+    assert [sorted(lengths[i] for i in batch) for batch in batches] == [[850, 880, 900], [5, 6, 7]]
+
+
+def test_restore_order_undoes_bucketing():
+    lengths = [3, 1, 4, 1, 5, 9, 2, 6]
+    batches = length_bucketed_batches(lengths, max_batch_size=3)
+    run_order = [i for batch in batches for i in batch]
+    outputs = [f"out{i}" for i in run_order]
+    assert restore_order(outputs, batches) == [f"out{i}" for i in range(len(lengths))]
+
+
+def test_sequential_batches_keep_arrival_order():
+    assert sequential_batches(5, 2) == [[0, 1], [2, 3], [4]]
+    assert restore_order(["a", "b", "c"], sequential_batches(3, 2)) == ["a", "b", "c"]
+
+
+def test_token_budget_follows_label_caps_and_crop_size():
+    policy = {"enabled": True, "headroom": 4.0, "min_tokens": 64, "label_caps": {"foot": 128, "default": 4096}}
+    assert token_budget("para", 10, 10, policy) == 64
+    assert token_budget("foot", 600, 300, policy) == 128
+    assert token_budget("tab", 600, 300, policy) > token_budget("para", 600, 300, policy)
+    assert token_budget("tab", 5000, 5000, policy) == 4096
+    assert token_budget("para", 600, 300, {"enabled": False}) is None
+
+
+def test_budget_telemetry_counts_hits_per_label():
+    telemetry = BudgetTelemetry()
+    telemetry.record("tab", 1000, "budget")
+    telemetry.record("tab", 500, "eos")
+    telemetry.record("foot", 128, "eos")
+    summary = telemetry.summary()
+    assert summary["tab"] == {"elements": 2, "budget_hits": 1, "hit_rate": 0.5, "mean_budget": 750.0}
+    assert summary["foot"]["budget_hits"] == 0
@@ -0,0 +1,69 @@
+import asyncio
+import time
+
+from deployment_loader import load_deployment_module
+
+MicroBatcher = load_deployment_module("tensorrt_llm/batcher.py").MicroBatcher
+
+
+class FakeRunner:
+    """Stands in for DolphinRunner.run: echoes each image, one list of texts per input"""
+
+    def __init__(self, seconds=0.0, fail=False):
+        self.seconds = seconds
+        self.fail = fail
+        self.calls = []
+
+    def run(self, prompts, images, max_new_tokens):
+        self.calls.append((list(prompts), list(images), max_new_tokens))
+        time.sleep(self.seconds)
+        if self.fail:
+            raise RuntimeError("engine error")
+        return [[f"{prompt}:{image}"] for prompt, image in zip(prompts, images)]
+
+
+def _serve(batcher, requests):
+    async def run():
+        try:
+            return await asyncio.gather(
+                *(batcher.submit(prompt, image, 4024) for prompt, image in requests), return_exceptions=True
+            )
+        finally:
+            await batcher.close()
+
+    return asyncio.run(run())
+
+
+def test_concurrent_requests_share_batches_and_get_their_own_outputs():
+    runner = FakeRunner(seconds=0.01)
+    batcher = MicroBatcher(runner.run, max_batch_size=4, max_wait_ms=50)
+    outputs = _serve(batcher, [("Read text in the image.", i) for i in range(10)])
+
+    assert outputs == [f"Read text in the image.:{i}" for i in range(10)]
+    assert batcher.batch_sizes == [4, 4, 2]
+    assert all(max_new_tokens == 4024 for _, _, max_new_tokens in runner.calls)
+
+
+def test_prompts_are_never_mixed_in_one_runner_call():
+    runner = FakeRunner()
+    batcher = MicroBatcher(runner.run, max_batch_size=8, max_wait_ms=20)
+    requests = [("Read text in the image.", 0), ("Parse the table in the image.", 1), ("Read text in the image.", 2)]
+    outputs = _serve(batcher, requests)
+
+    assert outputs == [f"{prompt}:{image}" for prompt, image in requests]
+    assert sorted(len(set(prompts)) for prompts, _, _ in runner.calls) == [1, 1]
+    assert sorted(batcher.batch_sizes) == [1, 2]
+
+
+def test_a_lone_request_waits_at_most_max_wait():
+    batcher = MicroBatcher(FakeRunner().run, max_batch_size=16, max_wait_ms=30)
+    start = time.perf_counter()
+    assert _serve(batcher, [("Read text in the image.", 0)]) == ["Read text in the image.:0"]
+    assert time.perf_counter() - start < 0.5
+    assert batcher.batch_sizes == [1]
+
+
+def test_runner_errors_reach_every_caller_of_the_batch():
+    batcher = MicroBatcher(FakeRunner(fail=True).run, max_batch_size=4, max_wait_ms=20)
+    outputs = _serve(batcher, [("Read text in the image.", i) for i in range(3)])
+    assert all(isinstance(output, RuntimeError) for output in outputs)
@@ -0,0 +1,60 @@
+import pytest
+import torch
+from PIL import Image
+from torch import nn
+
+from model_workers import SharedModelWorkers
+from utils.model import quantize_linears_int8
+
+
+class EchoModel:
+    """Stands in for DOLPHIN: answers with the prompt, crop width and worker-visible weight"""
+
+    model_args = {"length_bucketing": False}
+    processor = None
+    tokenizer = None
+
+    def __init__(self):
+        self.model = nn.Linear(2, 2)
+
+    def chat(self, question, image, return_stop_reason=False, max_new_tokens=None, **kwargs):
+        if not isinstance(question, list):
+            return f"{question}:{image.size[0]}"
+        weight = float(self.model.weight.sum())
+        texts = [f"{q}:{img.size[0]}:{weight:.1f}" for q, img in zip(question, image)]
+        if return_stop_reason:
+            return texts, [f"budget {budget}" for budget in max_new_tokens]
+        return texts
+
+
+def test_batches_are_spread_over_workers_and_returned_in_order():
+    model = EchoModel()
+    with torch.no_grad():
+        model.model.weight.fill_(1.0)
+    crops = [Image.new("RGB", (10 + i, 10)) for i in range(7)]
+
+    with SharedModelWorkers(model, num_workers=2, num_threads=1) as workers:
+        assert model.model.weight.is_shared()
+        assert workers.chat("layout", crops[0]) == "layout:10"
+
+        # An in-place update in the parent is seen by the workers: the weights are shared
+        with torch.no_grad():
+            model.model.weight.fill_(2.0)
+        texts, reasons = workers.chat(
+            [f"p{i}" for i in range(7)],
+            crops,
+            max_batch_size=3,
+            return_stop_reason=True,
+            max_new_tokens=list(range(7)),
+        )
+
+    assert texts == [f"p{i}:{10 + i}:8.0" for i in range(7)]
+    assert reasons == [f"budget {i}" for i in range(7)]
+
+
+def test_spawned_workers_refuse_int8_models():
+    model = EchoModel()
+    model.model = quantize_linears_int8(nn.Sequential(nn.LayerNorm(2), nn.Linear(2, 2)))
+
+    with pytest.raises(ValueError, match="int8"):
+        SharedModelWorkers(model, num_workers=1, num_threads=1)
@@ -0,0 +1,156 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import Image
+
+import ocr_pipeline
+from ocr_pipeline import OCRPipeline
+from utils.utils import prepare_image
+
+
+class FakeModel:
+    model_args = {}
+
+    def chat(self, question, image, **kwargs):
+        return "[0.1,0.1,0.9,0.9] fig"
+
+
+class PageModel:
+    """Lays every page out as two paragraphs, bottom half first, and reads back which page and half a crop shows"""
+
+    model_args = {}
+
+    def __init__(self):
+        self.batches = []
+
+    def chat(self, question, image, **kwargs):
+        if isinstance(question, str):
+            return "[0.1,0.55,0.9,0.95] para[0.1,0.05,0.9,0.45] para"
+        self.batches.append(len(image))
+        texts = []
+        for crop in image:
+            red, green, blue = crop.getpixel((crop.width // 2, crop.height // 2))
+            texts.append(f"page {green // 10} {'top' if red > blue else 'bottom'}")
+        if kwargs.get("return_stop_reason"):
+            return texts, ["eos"] * len(texts)
+        return texts
+
+
+def fake_rasterize(document_path, page_idx, target_size):
+    if page_idx == 1:
+        raise ValueError("corrupt page")
+    image = Image.new("RGB", (64, 64), "white")
+    return (page_idx, image, *prepare_image(image))
+
+
+def page_rasterize(document_path, page_idx, target_size):
+    """A page whose halves tell the page number (green) and the half (red on top, blue below)"""
+    image = Image.new("RGB", (64, 64), (200, 10 * (page_idx + 1), 0))
+    image.paste((0, 10 * (page_idx + 1), 200), (0, 32, 64, 64))
+    return (page_idx, image, *prepare_image(image))
+
+
+class FakeFigureWriter:
+    def __init__(self):
+        self.flushes = 0
+        self.figures = []
+
+    def __call__(self, pil_crop, save_dir, image_name, reading_order):
+        self.figures.append(image_name)
+        return f"{image_name}_figure_{reading_order:03d}.png"
+
+    def flush(self):
+        self.flushes += 1
+
+
+def failing_crop(layout_output, padded_image, dims):
+    raise MemoryError("out of memory")
+
+
+def failing_write(pil_crop, save_dir, image_name, reading_order):
+    raise OSError("disk full")
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    monkeypatch.setattr(ocr_pipeline, "get_pdf_page_count", lambda path: 3)
+    monkeypatch.setattr(ocr_pipeline, "rasterize_pdf_page", fake_rasterize)
+    pipeline = OCRPipeline(FakeModel(), str(tmp_path), num_workers=1, queue_size=1, target_size=64)
+    # Threads instead of processes, so the fakes above are used by the workers
+    pipeline.pool.shutdown()
+    pipeline.pool = ThreadPoolExecutor(max_workers=1)
+    yield pipeline
+    pipeline.close()
+
+
+def _process(pipeline, document_path):
+    """process_document on a thread, so a hang fails the test instead of blocking it"""
+    with open(document_path, "wb") as f:
+        f.write(b"%PDF-1.4 placeholder: the pages are faked")
+    outcome = {}
+
+    def run():
+        try:
+            outcome["result"] = pipeline.process_document(document_path)
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout=30)
+    assert not thread.is_alive(), "process_document hung"
+    return outcome
+
+
+def test_pooled_pages_get_their_own_elements_in_reading_order(pipeline, tmp_path, monkeypatch):
+    monkeypatch.setattr(ocr_pipeline, "rasterize_pdf_page", page_rasterize)
+    pipeline.model = PageModel()
+    pipeline.pages_per_batch = 2
+    outcome = _process(pipeline, str(tmp_path / "doc.pdf"))
+    assert "error" not in outcome
+    json_path, results = outcome["result"]
+    assert os.path.exists(json_path)
+    assert [page["page_number"] for page in results] == [1, 2, 3]
+    for page in results:
+        n = page["page_number"]
+        assert [elem["text"] for elem in page["elements"]] == [f"page {n} bottom", f"page {n} top"]
+    # The crops of pages 1-2 share one recognition call
+    assert pipeline.model.batches == [4, 2]
+
+
+def test_failing_page_is_raised(pipeline, tmp_path):
+    outcome = _process(pipeline, str(tmp_path / "doc.pdf"))
+    assert isinstance(outcome.get("error"), ValueError)
+
+
+def test_error_after_the_last_page_is_raised(pipeline, tmp_path, monkeypatch):
+    # A one-page document: its recognition runs after the feeder finished
+    monkeypatch.setattr(ocr_pipeline, "get_pdf_page_count", lambda path: 1)
+    monkeypatch.setattr(ocr_pipeline, "crop_layout_elements", failing_crop)
+    outcome = _process(pipeline, str(tmp_path / "doc.pdf"))
+    assert isinstance(outcome.get("error"), MemoryError)
+
+
+def test_feeder_errors_reach_the_caller(pipeline, tmp_path):
+    pipeline.pool.shutdown()
+    outcome = _process(pipeline, str(tmp_path / "doc.pdf"))
+    assert isinstance(outcome.get("error"), RuntimeError)
+
+
+def test_figures_are_flushed_per_document(pipeline, tmp_path, monkeypatch):
+    monkeypatch.setattr(ocr_pipeline, "get_pdf_page_count", lambda path: 1)
+    pipeline.figure_writer = pipeline.save_figure = FakeFigureWriter()
+    outcome = _process(pipeline, str(tmp_path / "doc.pdf"))
+    assert "error" not in outcome
+    assert pipeline.figure_writer.figures == ["doc_page_001"]
+    assert pipeline.figure_writer.flushes == 1
+
+
+def test_writer_errors_reach_the_caller(pipeline, tmp_path, monkeypatch):
+    monkeypatch.setattr(ocr_pipeline, "get_pdf_page_count", lambda path: 1)
+    monkeypatch.setattr(ocr_pipeline, "save_figure_to_local", failing_write)
+    outcome = _process(pipeline, str(tmp_path / "doc.pdf"))
+    assert isinstance(outcome.get("error"), OSError)
+    assert not (tmp_path / "recognition_json" / "doc.json").exists()
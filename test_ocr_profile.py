@@ -0,0 +1,51 @@
+import json
+
+from utils.ocr_profile import OCRProfiler, print_profile_summary, profile_path
+
+
+def _metrics(seconds, tokens, stop_reason="eos", score=0.9):
+    return {
+        "preprocess_seconds": 0.01,
+        "encoder_seconds": 0.04,
+        "decode_seconds": seconds,
+        "decode_steps": tokens,
+        "generated_tokens": tokens,
+        "stop_reason": stop_reason,
+        "mean_token_score": score,
+        "batch_occupancy": 0.5,
+    }
+
+
+def test_profile_totals_by_label_and_page(tmp_path):
+    profiler = OCRProfiler()
+    profiler.record("layout", "catalog_page_001", _metrics(0.5, 40))
+    profiler.record_many(
+        ["para", "tab"],
+        ["catalog_page_001", "catalog_page_002"],
+        [_metrics(0.2, 20), _metrics(2.0, 300, stop_reason="max_length", score=None)],
+    )
+
+    path = profiler.write(profile_path(str(tmp_path), "pdfs/catalog.pdf"), "pdfs/catalog.pdf")
+    assert path.endswith("recognition_json/catalog.profile.json")
+    assert profiler.elements == []
+
+    profile = json.load(open(path, encoding="utf-8"))
+    summary = profile["summary"]
+    assert summary["total"]["elements"] == 3
+    assert summary["total"]["tokens"] == 360
+    assert summary["labels"]["tab"]["stop_reasons"] == {"max_length": 1}
+    assert summary["labels"]["tab"]["mean_token_score"] is None
+    assert summary["pages"]["catalog_page_001"]["seconds"] == 0.8
+    assert summary["pages"]["catalog_page_002"]["tokens_per_second"] == round(300 / 2.05, 2)
+
+
+def test_summary_ranks_slowest_labels_and_pages(tmp_path, capsys):
+    profiler = OCRProfiler()
+    profiler.record("para", "catalog_page_001", _metrics(0.1, 10))
+    profiler.record("tab", "catalog_page_002", _metrics(3.0, 400))
+    path = profiler.write(profile_path(str(tmp_path), "catalog.pdf"), "catalog.pdf")
+
+    print_profile_summary([path], top=1)
+    output = capsys.readouterr().out
+    assert "tab" in output and "catalog:catalog_page_002" in output
+    assert "catalog_page_001" not in output
@@ -0,0 +1,51 @@
+import pymupdf
+
+from demo_page import LAYOUT_PROMPT, process_document
+
+
+class PageModel:
+    """Lays every page out as two paragraphs, bottom half first, and reads back which page and half a crop shows"""
+
+    model_args = {}
+
+    def __init__(self):
+        self.text_batches = []
+
+    def chat(self, question, image, **kwargs):
+        if question[0] == LAYOUT_PROMPT:
+            return ["[0.1,0.55,0.9,0.95] para[0.1,0.05,0.9,0.45] para"] * len(question)
+        self.text_batches.append(len(image))
+        texts = []
+        for crop in image:
+            red, green, blue = crop.getpixel((crop.width // 2, crop.height // 2))
+            texts.append(f"page {round(green / 10)} {'top' if red > blue else 'bottom'}")
+        if kwargs.get("return_stop_reason"):
+            return texts, ["eos"] * len(texts)
+        return texts
+
+
+def _write_pdf(path, num_pages):
+    """Square pages whose halves tell the page number (green) and the half (red on top, blue below)"""
+    with pymupdf.open() as doc:
+        for page_idx in range(num_pages):
+            page = doc.new_page(width=200, height=200)
+            green = 10 * (page_idx + 1) / 255
+            page.draw_rect(pymupdf.Rect(0, 0, 200, 100), color=None, fill=(200 / 255, green, 0))
+            page.draw_rect(pymupdf.Rect(0, 100, 200, 200), color=None, fill=(0, green, 200 / 255))
+        doc.save(path)
+
+
+def test_pooled_pages_get_their_own_elements_in_reading_order(tmp_path):
+    pdf_path = str(tmp_path / "doc.pdf")
+    _write_pdf(pdf_path, 3)
+    model = PageModel()
+
+    _, results = process_document(pdf_path, model, str(tmp_path / "out"), max_batch_size=8, pages_per_batch=2)
+
+    assert [page["page_number"] for page in results] == [1, 2, 3]
+    for page in results:
+        n = page["page_number"]
+        assert [elem["text"] for elem in page["elements"]] == [f"page {n} bottom", f"page {n} top"]
+        assert [elem["reading_order"] for elem in page["elements"]] == [0, 1]
+    # The crops of pages 1-2 share one recognition call, page 3 gets the next
+    assert model.text_batches == [4, 2]
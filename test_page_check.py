@@ -0,0 +1,100 @@
+import numpy as np
+from PIL import Image, ImageDraw
+
+from demo_page import process_page_batch
+from dolphin_transformer import transform_dolphin_to_oxcart_preserving_labels
+from utils.page_check import classify_page
+
+LAYOUT = "[0.10,0.10,0.90,0.20] title[0.10,0.30,0.90,0.60] para"
+
+
+def _paper(seed=0, size=(630, 896)):
+    rng = np.random.default_rng(seed)
+    pixels = np.clip(235 + rng.normal(0, 4, (size[1], size[0], 3)), 0, 255).astype(np.uint8)
+    return Image.fromarray(pixels)
+
+
+def _blank_verso():
+    page = _paper()
+    draw = ImageDraw.Draw(page)
+    draw.rectangle([100, 100, 500, 700], fill=(215, 215, 215))  # show-through from the recto
+    draw.text((300, 860), "12", fill="black")
+    return page
+
+
+def _text_page():
+    page = _paper()
+    draw = ImageDraw.Draw(page)
+    for i in range(50):
+        draw.text((40, 40 + i * 15), "Costa Rica 1863, perf 12, unwatermarked paper", fill="black")
+    return page
+
+
+def _plate(caption=None, with_text=False):
+    rng = np.random.default_rng(1)
+    page = _paper()
+    photo = rng.normal(110, 40, (80, 60, 3)).clip(0, 255).astype(np.uint8)
+    page.paste(Image.fromarray(photo).resize((480, 640), Image.BILINEAR), (75, 100))
+    draw = ImageDraw.Draw(page)
+    if caption:
+        draw.text((280, 800), caption, fill="black")
+    if with_text:
+        for i in range(5):
+            draw.text((40, 760 + i * 15), "The 1/2 real blue, showing the cracked plate variety", fill="black")
+    return page
+
+
+class LayoutCountingModel:
+    model_args = {"page_precheck": True}
+
+    def __init__(self):
+        self.layout_pages = 0
+
+    def chat(self, prompts, images, return_stop_reason=False, **kwargs):
+        if prompts[0].startswith("Parse the reading order"):
+            self.layout_pages += len(images)
+            return [LAYOUT] * len(images)
+        texts = [f"{prompt[:4]} {crop.size}" for prompt, crop in zip(prompts, images)]
+        return texts, ["eos"] * len(texts)
+
+
+def test_pages_are_classified():
+    assert classify_page(_blank_verso())["page_class"] == "blank"
+    assert classify_page(_text_page())["page_class"] == "content"
+    assert classify_page(_plate(with_text=True))["page_class"] == "content"
+    # A short caption or denomination beside the picture is text to recognize too
+    for caption in ("1863", "Plate IV"):
+        assert classify_page(_plate(caption))["page_class"] == "content"
+
+    plate = classify_page(_plate())
+    assert plate["page_class"] == "image_only"
+    assert plate["image_bbox"] == [75, 100, 555, 740]
+
+
+def test_blank_and_plate_pages_skip_layout(tmp_path):
+    (tmp_path / "markdown" / "figures").mkdir(parents=True)
+    model = LayoutCountingModel()
+    pages_info = []
+    pages = process_page_batch(
+        [_blank_verso(), _text_page(), _plate()],
+        model,
+        str(tmp_path),
+        ["doc_page_001", "doc_page_002", "doc_page_003"],
+        4,
+        pages_info=pages_info,
+    )
+
+    assert model.layout_pages == 1
+    assert pages_info == [{"page_class": "blank"}, {}, {"page_class": "image_only"}]
+    assert pages[0] == []
+    assert [element["label"] for element in pages[1]] == ["title", "para"]
+    assert [element["label"] for element in pages[2]] == ["fig"]
+    assert (tmp_path / "markdown" / pages[2][0]["figure_path"]).exists()
+
+    recognition_results = [
+        {"page_number": i + 1, "elements": elements, **info}
+        for i, (elements, info) in enumerate(zip(pages, pages_info))
+    ]
+    oxcart = transform_dolphin_to_oxcart_preserving_labels(recognition_results, optimize_for_rag=False)
+    assert oxcart["page_count"] == 3
+    assert oxcart["metadata"]["page_classes"] == {"blank": [1], "image_only": [3]}
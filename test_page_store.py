@@ -0,0 +1,79 @@
+import pytest
+
+from utils.page_store import PageStore, page_range_shards, shard_name
+
+
+def _store(tmp_path, content=b"%PDF-1.4 fixture"):
+    pdf_path = tmp_path / "catalog.pdf"
+    pdf_path.write_bytes(content)
+    return PageStore(str(tmp_path), str(pdf_path))
+
+
+def test_resume_skips_stored_pages(tmp_path):
+    store = _store(tmp_path)
+    store.append(0, [{"label": "para", "text": "Costa Rica", "reading_order": 0}])
+    store.append(2, [])
+    assert store.missing_pages(4) == [1, 3]
+
+    # A renamed copy of the same PDF shares the store
+    assert _store(tmp_path).missing_pages(4) == [1, 3]
+    assert _store(tmp_path, b"%PDF-1.4 other").missing_pages(4) == [0, 1, 2, 3]
+
+
+def test_torn_last_line_is_ignored_and_not_corrupting(tmp_path):
+    store = _store(tmp_path)
+    store.append(0, [])
+    with open(store.path, "a", encoding="utf-8") as f:
+        f.write('{"page_index": 1, "elem')
+    assert store.missing_pages(2) == [1]
+
+    store.append(1, [{"label": "tab", "text": "<table></table>", "reading_order": 0}])
+    pages = store.assemble(2)
+    assert [page["page_number"] for page in pages] == [1, 2]
+    assert pages[1]["elements"][0]["label"] == "tab"
+
+
+def test_assemble_requires_every_page(tmp_path):
+    store = _store(tmp_path)
+    store.append(0, [])
+    with pytest.raises(Exception, match=r"Pages \[2\] are missing"):
+        store.assemble(2)
+    store.clear()
+    assert store.missing_pages(1) == [0]
+
+
+def test_shards_are_stitched_with_global_page_numbers(tmp_path):
+    pdf_path = tmp_path / "catalog.pdf"
+    pdf_path.write_bytes(b"%PDF-1.4 fixture")
+    shards = page_range_shards(5, 2)
+    assert shards == [(0, 2), (2, 4), (4, 5)]
+
+    stores = [PageStore(str(tmp_path), str(pdf_path), shard=shard_name(shard)) for shard in shards]
+    assert stores[1].missing_pages(5, page_range=shards[1]) == [2, 3]
+    for store, (start, stop) in zip(reversed(stores), reversed(shards)):
+        for page_idx in range(start, stop):
+            store.append(page_idx, [{"label": "para", "text": f"page {page_idx + 1}", "reading_order": 0}])
+
+    assert len({store.path for store in stores}) == 3
+    assert stores[1].missing_pages(5) == []
+    single_pass = PageStore(str(tmp_path), str(pdf_path))
+    pages = single_pass.assemble(5)
+    assert [page["page_number"] for page in pages] == [1, 2, 3, 4, 5]
+    assert [page["elements"][0]["text"] for page in pages] == [f"page {i}" for i in range(1, 6)]
+
+    # Starting a shard over only forgets that shard
+    stores[0].clear()
+    assert single_pass.missing_pages(5) == [0, 1]
+
+
+def test_only_one_shard_claims_the_stitch(tmp_path):
+    pdf_path = tmp_path / "catalog.pdf"
+    pdf_path.write_bytes(b"%PDF-1.4 fixture")
+    first, second = (PageStore(str(tmp_path), str(pdf_path), shard=shard_name(shard)) for shard in [(0, 2), (2, 4)])
+    assert first.claim_stitch()
+    assert not second.claim_stitch()
+    # A retry of the stitching shard (e.g. after a crash) claims it again
+    assert PageStore(str(tmp_path), str(pdf_path), shard=first.shard).claim_stitch()
+    # Starting over releases the claim
+    first.clear()
+    assert second.claim_stitch()
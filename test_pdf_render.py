@@ -0,0 +1,57 @@
+import io
+
+import numpy as np
+import pymupdf
+import torch
+from PIL import Image, ImageOps
+from torchvision.transforms.functional import resize
+
+from utils.processor import DolphinProcessor
+from utils.utils import iter_pdf_images, render_pdf_page
+
+
+def _page(doc):
+    page = doc.new_page(width=595, height=842)
+    page.insert_text((72, 100), "Costa Rica 1863 - Sello de medio real, azul", fontsize=14)
+    page.draw_rect(pymupdf.Rect(72, 200, 400, 500), color=(0, 0, 0), fill=(0.2, 0.4, 0.8))
+    return page
+
+
+def _png_render(page, target_size):
+    """The PNG round trip render_pdf_page replaced"""
+    scale = target_size / max(page.rect.width, page.rect.height)
+    pix = page.get_pixmap(matrix=pymupdf.Matrix(scale, scale))
+    return Image.open(io.BytesIO(pix.tobytes("png")))
+
+
+def _old_tensor(processor, image):
+    """DolphinProcessor input of the old convert_pdf_to_images pages: resize, thumbnail, center pad"""
+    height, width = processor.input_size
+    image = resize(image, min(height, width))
+    image.thumbnail((width, height))
+    pad_w, pad_h = width - image.width, height - image.height
+    image = ImageOps.expand(image, (pad_w // 2, pad_h // 2, pad_w - pad_w // 2, pad_h - pad_h // 2))
+    return processor.transform(image).unsqueeze(0)
+
+
+def test_raw_samples_match_the_png_round_trip():
+    with pymupdf.open() as doc:
+        page = _page(doc)
+        image = render_pdf_page(page, 896)
+        reference = _png_render(page, 896)
+    assert image.mode == "RGB" and max(image.size) == 896
+    assert np.array_equal(np.asarray(image), np.asarray(reference.convert("RGB")))
+
+
+def test_page_rendered_at_the_input_size_gives_the_old_tensor(tmp_path):
+    pdf_path = str(tmp_path / "doc.pdf")
+    with pymupdf.open() as doc:
+        _page(doc)
+        reference = _png_render(doc[0], 896)
+        doc.save(pdf_path)
+    processor = DolphinProcessor({}, tokenizer=None, transform_args={"input_size": 896})
+
+    [(page_idx, image)] = list(iter_pdf_images(pdf_path, target_size=896))
+
+    assert page_idx == 0
+    assert torch.equal(processor.process_image_for_inference(image), _old_tensor(processor, reference))
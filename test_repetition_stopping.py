@@ -0,0 +1,45 @@
+import torch
+
+from utils.model import RepetitionStoppingCriteria, find_repeated_tails
+
+
+def _prompt_and(generated, prompt_length=3):
+    return torch.tensor([[0] * prompt_length + generated])
+
+
+def test_repeated_table_row_is_flagged():
+    row = [10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20]  # e.g. <tr><td>Genus</td>...</tr>
+    windows = torch.tensor([list(range(100, 140)) + row * 16])
+    assert find_repeated_tails(windows, max_period=64, min_repeats=4, min_span=128).tolist() == [True]
+
+
+def test_varied_text_is_not_flagged():
+    windows = torch.tensor([list(range(200)), [i % 97 for i in range(200)]])
+    flags = find_repeated_tails(windows, max_period=64, min_repeats=4, min_span=128)
+    assert flags.tolist() == [False, False]
+
+
+def test_short_runs_are_allowed():
+    # A few empty cells in a row are normal table content
+    windows = torch.tensor([list(range(300, 460)) + [7, 8] * 20])
+    assert find_repeated_tails(windows, max_period=64, min_repeats=4, min_span=128).tolist() == [False]
+
+
+def test_criteria_stops_only_the_looping_row():
+    criteria = RepetitionStoppingCriteria(prompt_length=3, pad_token_id=1, min_span=32, check_interval=1)
+    looping = [5, 6, 7, 8] * 10
+    varied = list(range(100, 140))
+    input_ids = torch.cat([_prompt_and(looping), _prompt_and(varied)])
+    assert criteria(input_ids, None).tolist() == [True, False]
+
+
+def test_padding_after_eos_is_not_a_loop():
+    criteria = RepetitionStoppingCriteria(prompt_length=3, pad_token_id=1, min_span=32, check_interval=1)
+    finished = list(range(100, 108)) + [2] + [1] * 31
+    assert criteria(_prompt_and(finished), None).tolist() == [False]
+
+
+def test_check_sequences_matches_batched_call():
+    criteria = RepetitionStoppingCriteria(prompt_length=0, pad_token_id=1, min_span=32, check_interval=1)
+    generated = [[5, 6, 7, 8] * 10, list(range(100, 150)), [9] * 20]
+    assert criteria.check_sequences(generated) == [True, False, False]
@@ -0,0 +1,66 @@
+import json
+import sys
+
+import pytest
+
+import demo_page
+from utils.result_stream import DocumentStream, read_page_records
+from utils.utils import save_combined_pdf_results
+
+
+def _pages():
+    return [
+        {"page_number": 1, "elements": [{"label": "title", "text": "Costa Rica 1863", "reading_order": 0}]},
+        {"page_number": 2, "elements": []},
+        {
+            "page_number": 3,
+            "elements": [{"label": "para", "text": "Sello de ½ real, azul", "reading_order": 0}],
+            "page_class": "text_layer",
+        },
+    ]
+
+
+def test_pages_are_written_in_order_as_they_become_contiguous(tmp_path):
+    stream = DocumentStream(str(tmp_path), "catalog.pdf", 3)
+    pages = _pages()
+    stream.add_page(1, pages[1])
+    assert list(read_page_records(stream.jsonl_path)) == []
+
+    stream.add_page(0, {"page_index": 0, **pages[0]})
+    assert [page["page_number"] for page in read_page_records(stream.jsonl_path)] == [1, 2]
+    with pytest.raises(Exception, match=r"Pages \[3\] are missing"):
+        stream.close()
+
+    stream.add_page(2, pages[2])
+    assert stream.close() == stream.jsonl_path
+    assert list(read_page_records(stream.jsonl_path)) == pages
+
+    markdown = open(stream.markdown_path, encoding="utf-8").read()
+    assert markdown.count("---") == 1
+    assert markdown.index("Costa Rica 1863") < markdown.index("½ real")
+
+
+def test_exported_json_matches_combined_results(tmp_path):
+    stream = DocumentStream(str(tmp_path / "stream"), "catalog.pdf", 3)
+    stream.add_pages(dict(enumerate(_pages())))
+    stream.close()
+    exported = open(stream.export_json(), encoding="utf-8").read()
+
+    combined_path = save_combined_pdf_results(_pages(), "catalog.pdf", str(tmp_path / "combined"))
+    assert exported == open(combined_path, encoding="utf-8").read()
+    assert json.loads(exported)["total_pages"] == 3
+
+
+def test_reader_stops_at_a_line_still_being_written(tmp_path):
+    stream = DocumentStream(str(tmp_path), "catalog.pdf", 2)
+    stream.add_page(0, _pages()[0])
+    with open(stream.jsonl_path, "a", encoding="utf-8") as f:
+        f.write('{"page_number": 2, "elem')
+    assert len(list(read_page_records(stream.jsonl_path))) == 1
+
+
+@pytest.mark.parametrize("flag", ["--stream_results", "--no_combined_json"])
+def test_pipeline_workers_refuse_streaming_flags(monkeypatch, flag):
+    monkeypatch.setattr(sys, "argv", ["demo_page.py", "--pipeline_workers", "2", flag])
+    with pytest.raises(ValueError, match="--pipeline_workers"):
+        demo_page.main()
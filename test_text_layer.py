@@ -0,0 +1,54 @@
+import pymupdf
+
+from utils.text_layer import (
+    analyze_text_layer,
+    extract_text_layer_pages,
+    text_layer_elements,
+)
+
+BODY = "The 1930 surface mail issues were printed by Waterlow and Sons in sheets of fifty."
+
+
+def _born_digital_page(doc):
+    page = doc.new_page()
+    page.insert_text((72, 120), "Costa Rica Airmail", fontsize=24)
+    y = 170
+    for _ in range(10):
+        page.insert_text((72, y), BODY, fontsize=10)
+        y += 13
+    page.insert_text((300, 820), "12", fontsize=9)
+    return page
+
+
+def _scanned_page(doc):
+    page = doc.new_page()
+    pix = pymupdf.Pixmap(pymupdf.csRGB, pymupdf.IRect(0, 0, 60, 80), False)
+    pix.set_rect(pix.irect, (200, 200, 200))
+    page.insert_image(page.rect, pixmap=pix)
+    return page
+
+
+def test_born_digital_page_becomes_elements():
+    doc = pymupdf.open()
+    page = _born_digital_page(doc)
+    assert analyze_text_layer(page)["qualifies"]
+
+    elements = text_layer_elements(page, target_size=896)
+    assert [element["label"] for element in elements] == ["title", "para", "foot"]
+    assert [element["reading_order"] for element in elements] == [0, 1, 2]
+    assert elements[1]["text"].startswith(BODY)
+    # bboxes are in the pixel space of the page rendered with its longest side at 896
+    assert all(0 <= coord <= 896 for element in elements for coord in element["bbox"])
+
+
+def test_scanned_and_empty_pages_go_to_the_model(tmp_path):
+    doc = pymupdf.open()
+    _born_digital_page(doc)
+    _scanned_page(doc)
+    doc.new_page()
+    pdf_path = str(tmp_path / "bulletin.pdf")
+    doc.save(pdf_path)
+
+    assert not analyze_text_layer(doc[1])["qualifies"]
+    pages = extract_text_layer_pages(pdf_path, [0, 1, 2], target_size=896)
+    assert list(pages) == [0]
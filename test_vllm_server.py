@@ -0,0 +1,147 @@
+import asyncio
+import base64
+import io
+import json
+import time
+from argparse import Namespace
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("vllm")
+pytest.importorskip("multipart")
+from fastapi.testclient import TestClient  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from deployment_loader import load_deployment_module  # noqa: E402
+
+api_server = load_deployment_module("vllm/api_server.py")
+
+
+class FakeTokenizer:
+    bos_token_id = 0
+
+    def __call__(self, text, add_special_tokens=False):
+        return {"input_ids": [ord(c) for c in text]}
+
+
+class FakeEngine:
+    """Stands in for AsyncLLMEngine: decodes the decoder prompt back, one token per step"""
+
+    def __init__(self, step_seconds=0.0, max_steps=None):
+        self.engine = SimpleNamespace(get_tokenizer_group=lambda: SimpleNamespace(tokenizer=FakeTokenizer()))
+        self.step_seconds = step_seconds
+        self.max_steps = max_steps
+        self.steps = {}
+        self.aborted = []
+
+    async def generate(self, prompt, params, request_id):
+        text = "".join(chr(i) for i in prompt["decoder_prompt"]["prompt_token_ids"])
+        steps = self.max_steps or len(text)
+        self.steps[request_id] = 0
+        for step in range(1, steps + 1):
+            await asyncio.sleep(self.step_seconds)
+            self.steps[request_id] = step
+            output = SimpleNamespace(text=text[:step], token_ids=list(range(step)))
+            yield SimpleNamespace(prompt="", outputs=[output])
+
+    async def abort(self, request_id):
+        self.aborted.append(request_id)
+
+
+@pytest.fixture(scope="module")
+def app():
+    return api_server.build_app(Namespace(root_path=None, max_in_flight=8, request_timeout=30.0))
+
+
+def _png(size):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, "white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_generate_batch_answers_every_pair_in_order(app, monkeypatch):
+    monkeypatch.setattr(api_server, "engine", FakeEngine())
+    prompts = ["Read text in the image.", "Parse the table in the image.", "Read text in the image."]
+    files = [("images", (f"crop_{i}.png", _png((20, 10 + i)), "image/png")) for i in range(3)]
+
+    with TestClient(app) as client:
+        response = client.post(
+            "/generate_batch",
+            data={"prompts": json.dumps(prompts), "sampling_params": json.dumps({"max_tokens": 64})},
+            files=files,
+        )
+
+    assert response.status_code == 200
+    assert response.json() == {"text": [f"<s>{prompt} <Answer/>" for prompt in prompts]}
+
+
+def test_timed_out_request_stops_generating(app, monkeypatch):
+    engine = FakeEngine(step_seconds=0.01, max_steps=10_000)
+    monkeypatch.setattr(api_server, "engine", engine)
+    metrics = api_server.admission.metrics
+    batches = sum(metrics.batch_sizes.values())
+    body = {"decoder_prompt": "Read text in the image.", "image_base64": base64.b64encode(_png((20, 10))).decode()}
+
+    with TestClient(app) as client:
+        response = client.post("/generate", json=body, headers={"X-Deadline-Seconds": "0.2"})
+        (request_id,) = engine.steps
+        steps = engine.steps[request_id]
+        time.sleep(0.1)
+        assert engine.steps[request_id] == steps, "the engine kept decoding after the 504"
+
+    assert response.status_code == 504
+    assert engine.aborted == [request_id]
+    assert 0 < steps < 10_000
+    # The partial request still counts in the batch histogram and tokens/second
+    assert sum(metrics.batch_sizes.values()) == batches + 1
+    assert metrics.tokens[-1][1] == steps
+
+
+def test_disconnected_request_is_aborted(app, monkeypatch):
+    engine = FakeEngine(step_seconds=0.01, max_steps=10_000)
+    monkeypatch.setattr(api_server, "engine", engine)
+    body = json.dumps(
+        {"decoder_prompt": "Read text in the image.", "image_base64": base64.b64encode(_png((20, 10))).decode()}
+    ).encode()
+    received = []
+    sent = []
+
+    async def receive():
+        if not received:
+            received.append(body)
+            return {"type": "http.request", "body": body, "more_body": False}
+        # The client goes away while the engine is still decoding
+        await asyncio.sleep(0.2)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/generate",
+        "raw_path": b"/generate",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 50000),
+        "server": ("127.0.0.1", 8000),
+    }
+
+    async def run():
+        await app(scope, receive, send)
+        (request_id,) = engine.steps
+        steps = engine.steps[request_id]
+        await asyncio.sleep(0.1)
+        return request_id, steps
+
+    request_id, steps = asyncio.run(run())
+    assert engine.steps[request_id] == steps, "the engine kept decoding after the client left"
+    assert engine.aborted == [request_id]
+    assert 0 < steps < 10_000
+    assert sent == []
@@ -0,0 +1,189 @@
+"""
+Content-addressed cache of element recognition results
+
+Journals repeat the same running titles, mastheads and marginalia on hundreds of pages.
+Results are stored in a local SQLite file keyed by a hash of the crop, the prompt and a
+fingerprint of the model checkpoint and decoding settings, so an identical crop is only
+decoded once - within a document, across the documents of a run and across runs. Only
+outputs that ended at EOS are stored; outputs cut short (repetition, token budget, maximum
+length) are decoded again next time.
+
+Two key modes are available:
+    exact       SHA-256 of the crop pixels (identical renderings only, never wrong)
+    perceptual  difference hash (dHash) of the crop plus its size rounded to a few pixels,
+                which also matches scans of the same furniture with slightly different
+                crop boundaries; tiny differences such as page numbers may collide
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Sequence
+
+import numpy as np
+from omegaconf import OmegaConf
+from PIL import Image
+
+# Decoding settings that change the output for the same crop and prompt
+DECODING_KEYS = (
+    "max_length",
+    "extra_answer_tokens",
+    "repetition_stopping",
+    "repetition_retry_penalty",
+    "token_budgets",
+    "cpu_backend",
+    "decoding_engine",
+    "length_bucketing",
+)
+# Stop reasons of complete outputs, the only ones cached
+CACHED_STOP_REASONS = ("eos",)
+
+
+def exact_image_hash(image: Image.Image) -> str:
+    """SHA-256 of the pixel data, size and mode of an image"""
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def perceptual_image_hash(image: Image.Image, hash_size: int = 16, size_step: int = 8) -> str:
+    """Difference hash of an image, prefixed with its size rounded to size_step pixels
+
+    Args:
+        image: PIL image
+        hash_size: Hash grid side; the hash has hash_size * hash_size bits
+        size_step: Crop sizes within the same step share a key
+
+    Returns:
+        str: Hex digest
+    """
+    gray = np.asarray(image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR), dtype=np.int16)
+    bits = (gray[:, 1:] > gray[:, :-1]).flatten()
+    value = int("".join("1" if bit else "0" for bit in bits), 2)
+    width, height = (round(side / size_step) for side in image.size)
+    return f"{width}x{height}:{value:0{hash_size * hash_size // 4}x}"
+
+
+def checkpoint_fingerprint(path: str) -> str:
+    """SHA-256 of a checkpoint file (empty string if there is none)"""
+    if not path or not os.path.exists(path):
+        return ""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CropCache:
+    """Persistent crop -> recognition result cache
+
+    Args:
+        path: SQLite file to store results in (created if missing)
+        model_args: model section of the config, used to fingerprint the checkpoint and the
+            decoding settings; results of other checkpoints or settings are never returned
+        mode: "exact" or "perceptual" crop keys
+    """
+
+    def __init__(self, path: str, model_args=None, mode: str = "exact"):
+        if mode not in ("exact", "perceptual"):
+            raise ValueError(f"Unknown crop cache mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, text TEXT, stop_reason TEXT, created REAL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, digest TEXT)"
+        )
+        self.conn.commit()
+        self.model_fingerprint = self._model_fingerprint(model_args or {})
+
+    def _model_fingerprint(self, model_args) -> str:
+        settings = {}
+        for key in DECODING_KEYS:
+            value = model_args.get(key)
+            settings[key] = OmegaConf.to_container(value) if OmegaConf.is_config(value) else value
+        checkpoint = self._checkpoint_digest(model_args.get("model_name_or_path"))
+        return hashlib.sha256(json.dumps([checkpoint, settings], sort_keys=True).encode()).hexdigest()
+
+    def _checkpoint_digest(self, path) -> str:
+        """Checkpoint hash, recomputed only when the file's size or mtime changed"""
+        if not path or not os.path.exists(path):
+            return ""
+        stat = os.stat(path)
+        row = self.conn.execute(
+            "SELECT digest FROM checkpoints WHERE path = ? AND size = ? AND mtime = ?",
+            (os.path.abspath(path), stat.st_size, stat.st_mtime),
+        ).fetchone()
+        if row:
+            return row[0]
+        digest = checkpoint_fingerprint(path)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?)",
+            (os.path.abspath(path), stat.st_size, stat.st_mtime, digest),
+        )
+        self.conn.commit()
+        return digest
+
+    def key(self, crop: Image.Image, prompt: str) -> str:
+        image_hash = exact_image_hash(crop) if self.mode == "exact" else perceptual_image_hash(crop)
+        return hashlib.sha256(f"{self.model_fingerprint}|{self.mode}|{image_hash}|{prompt}".encode()).hexdigest()
+
+    def get_many(self, keys: Sequence[str]) -> List[Optional[dict]]:
+        """Cached {"text", "stop_reason"} for each key, or None on a miss"""
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = list(keys[start : start + 500])
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.conn.execute(
+                    f"SELECT key, text, stop_reason FROM results WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                found.update({key: {"text": text, "stop_reason": stop_reason} for key, text, stop_reason in rows})
+            results = [found.get(key) for key in keys]
+            hits = sum(result is not None for result in results)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return results
+
+    def put_many(self, keys: Sequence[str], texts: Sequence[str], stop_reasons: Sequence[str]):
+        """Store decoded results; those with a stop reason outside CACHED_STOP_REASONS are skipped"""
+        now = time.time()
+        rows = [
+            (key, text, stop_reason, now)
+            for key, text, stop_reason in zip(keys, texts, stop_reasons)
+            if stop_reason in CACHED_STOP_REASONS
+        ]
+        with self._lock:
+            self.conn.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", rows)
+            self.conn.commit()
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def print_summary(self):
+        lookups = self.hits + self.misses
+        print(
+            f"\nCrop cache ({self.mode}): {self.hits}/{lookups} hits ({self.hit_rate() * 100:.1f}%), "
+            f"{self.size()} stored results in {self.path}"
+        )
+
+    def size(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,123 @@
+"""
+Background writer for figure crops, with content dedup and compact formats
+
+save_figure_to_local encodes every figure crop as PNG inside the recognition loop. Stamp
+plates and logos repeat on many pages, and PNG is the slowest and largest choice for
+photographs. FigureWriter is a drop-in save_figure callable that:
+    - returns the figure filename at once and encodes/writes on a thread pool
+    - with dedup, names figures by a hash of their pixels, so every unique image is
+      stored once and identical crops share one file (also across documents and runs)
+    - writes PNG, WebP or JPEG, plus an optional small thumbnail in figures/thumbs/
+
+Filenames depend only on the page name and reading order (or on the content, with
+dedup), so figure_path and the markdown links are known before the file is written.
+"""
+
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from utils.utils import get_figure_filename
+
+FORMATS = {"png": ("PNG", "png"), "webp": ("WEBP", "webp"), "jpeg": ("JPEG", "jpg")}
+THUMBNAIL_DIR = "thumbs"
+
+
+def thumbnail_path(figure_path: str) -> str:
+    """Path of the thumbnail of a figure (e.g. figures/x.webp -> figures/thumbs/x.webp)"""
+    directory, filename = os.path.split(figure_path)
+    return os.path.join(directory, THUMBNAIL_DIR, filename)
+
+
+class FigureWriter:
+    """Asynchronous save_figure callable (pil_crop, save_dir, image_name, reading_order) -> filename
+
+    Args:
+        num_workers: Encoding threads
+        image_format: "png" (lossless), "webp" or "jpeg"
+        quality: Quality of lossy formats
+        thumbnail_size: Longest side of thumbnails written to figures/thumbs (0: none)
+        dedup: Name figures by content hash and store each unique image once
+    """
+
+    def __init__(
+        self,
+        num_workers: int = 2,
+        image_format: str = "png",
+        quality: int = 85,
+        thumbnail_size: int = 0,
+        dedup: bool = False,
+    ):
+        if image_format not in FORMATS:
+            raise ValueError(f"Unknown figure format: {image_format}")
+        self.image_format = image_format
+        self.quality = quality
+        self.thumbnail_size = thumbnail_size
+        self.dedup = dedup
+        self.pool = ThreadPoolExecutor(max_workers=max(1, num_workers), thread_name_prefix="figure-writer")
+        self.pending = []
+        self.written = 0
+        self.deduplicated = 0
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, pil_crop: Image.Image, save_dir: str, image_name: str, reading_order: int) -> str:
+        extension = FORMATS[self.image_format][1]
+        if self.dedup:
+            digest = hashlib.sha256(f"{pil_crop.mode}:{pil_crop.size}:".encode() + pil_crop.tobytes())
+            filename = f"fig_{digest.hexdigest()[:24]}.{extension}"
+        else:
+            filename = os.path.splitext(get_figure_filename(image_name, reading_order))[0] + f".{extension}"
+        figure_path = os.path.join(save_dir, "markdown", "figures", filename)
+
+        with self._lock:
+            if self.dedup and (figure_path in self._seen or os.path.exists(figure_path)):
+                self._seen.add(figure_path)
+                self.deduplicated += 1
+                return filename
+            self._seen.add(figure_path)
+            self.pending = [future for future in self.pending if not future.done()]
+            self.pending.append(self.pool.submit(self._write, pil_crop, figure_path))
+        return filename
+
+    def _write(self, pil_crop: Image.Image, figure_path: str):
+        try:
+            self._save(pil_crop, figure_path)
+            if self.thumbnail_size:
+                thumbnail = pil_crop.copy()
+                thumbnail.thumbnail((self.thumbnail_size, self.thumbnail_size))
+                os.makedirs(os.path.dirname(thumbnail_path(figure_path)), exist_ok=True)
+                self._save(thumbnail, thumbnail_path(figure_path))
+            with self._lock:
+                self.written += 1
+        except Exception as e:
+            print(f"Error saving figure {figure_path}: {str(e)}")
+
+    def _save(self, image: Image.Image, path: str):
+        image_format = FORMATS[self.image_format][0]
+        if image_format == "JPEG" and image.mode != "RGB":
+            image = image.convert("RGB")
+        # Write to a temporary name first, so readers never see a half-written figure
+        tmp_path = f"{path}.tmp"
+        if image_format == "PNG":
+            image.save(tmp_path, format=image_format)
+        else:
+            image.save(tmp_path, format=image_format, quality=self.quality)
+        os.replace(tmp_path, path)
+
+    def flush(self):
+        """Block until every queued figure has been written"""
+        with self._lock:
+            pending, self.pending = self.pending, []
+        for future in pending:
+            future.result()
+
+    def close(self):
+        self.flush()
+        self.pool.shutdown()
+
+    def print_summary(self):
+        print(f"\nFigures: {self.written} written ({self.image_format}), {self.deduplicated} duplicates skipped")
@@ -0,0 +1,207 @@
+"""
+Single-pass parser of the HTML tables Dolphin emits for "tab" elements
+
+dolphin_transformer used to scan the same table HTML with several regex passes per use
+(rows, cells, tag stripping, cell content counts), 4-5 times per table, and converted it
+once more with pandas.read_html. parse_html_table scans it once and collects everything
+those passes produced:
+    rows    the cells of every <tr> as written (text, th or td, colspan/rowspan)
+    grid    the rows laid out on a rectangular grid, with spanned cells repeated in every
+            position they cover
+    stats   row/cell counts and cell content counts for the malformed-table checks
+
+The renderings (markdown, TSV, row sentences, simplified text) are built from the parsed
+table in dolphin_transformer, so one parse serves validation and every rendering.
+"""
+
+import html as html_lib
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+# One match per row/section tag or per cell (with its content up to the next structural
+# tag), so the whole table is scanned once and Python only sees rows and cells
+TOKEN_RE = re.compile(
+    r"<(/?)(tr|table|thead|tbody|tfoot)\b[^>]*>"
+    r"|<(t[dh])\b([^>]*)>([^<]*(?:<(?!/?(?:t[rdh]|table|thead|tbody|tfoot)\b)[^<]*)*)",
+    re.I,
+)
+INLINE_TAG_RE = re.compile(r"<[^>]*>")
+BR_RE = re.compile(r"<br\s*/?>", re.I)
+SPAN_RE = re.compile(r"\b(rowspan|colspan)\s*=\s*[\"']?(\d+)", re.I)
+MAX_SPAN = 100  # larger spans are treated as this (guards the grid against garbled output)
+
+
+@dataclass
+class TableCell:
+    """One <td>/<th> of the table
+
+    Attributes:
+        text: Text content, tags removed, entities decoded and stripped
+        header: The cell is a <th>
+        colspan: Columns the cell covers
+        rowspan: Rows the cell covers
+        has_content: The cell's HTML (tags included) is not blank
+    """
+
+    text: str
+    header: bool = False
+    colspan: int = 1
+    rowspan: int = 1
+    has_content: bool = False
+
+
+@dataclass
+class HTMLTable:
+    """Parsed table; see parse_html_table
+
+    Attributes:
+        length: Length of the HTML without surrounding whitespace
+        has_table: A <table> tag was found
+        rows: Cells of every row in document order
+        header_rows: Number of leading rows that form the header (<thead> rows, else leading
+            rows of <th> cells only)
+        grid: Cell texts laid out with rowspan/colspan, one list of n_cols texts per row
+        n_cells: Number of <td>/<th> cells
+        content_counts: Counter of the texts of the cells with content
+    """
+
+    length: int = 0
+    has_table: bool = False
+    rows: List[List[TableCell]] = field(default_factory=list)
+    header_rows: int = 0
+    grid: List[List[str]] = field(default_factory=list)
+    n_cells: int = 0
+    content_counts: Counter = field(default_factory=Counter)
+
+    @property
+    def n_rows(self) -> int:
+        return len(self.rows)
+
+    @property
+    def n_cols(self) -> int:
+        return len(self.grid[0]) if self.grid else 0
+
+    def stats(self) -> Dict[str, int]:
+        """Counts the malformed-table checks look at"""
+        contents = sum(self.content_counts.values())
+        most_common = self.content_counts.most_common(1)
+        return {
+            "rows": self.n_rows,
+            "cells": self.n_cells,
+            "cols": self.n_cols,
+            "content_cells": contents,
+            "most_common_count": most_common[0][1] if most_common else 0,
+            "empty_cells": self.content_counts[""] + self.content_counts["nan"],
+        }
+
+
+def _cell_text(raw: str) -> str:
+    if "<" in raw:
+        raw = INLINE_TAG_RE.sub("", BR_RE.sub(" ", raw))
+    if "&" in raw:
+        raw = html_lib.unescape(raw)
+    return raw.strip()
+
+
+def parse_html_table(html: Optional[str]) -> HTMLTable:
+    """Parse table HTML in one pass
+
+    Lenient like the model output it reads: unclosed cells and rows are closed by the next
+    <td>/<th>/<tr>, cells outside a <tr> start a row of their own, and other tags inside
+    cells are dropped (<br> becomes a space).
+    """
+    table = HTMLTable()
+    if not html:
+        return table
+    table.length = len(html.strip())
+
+    rows = table.rows
+    grid = table.grid
+    contents: List[str] = []  # texts of the cells with content
+    row: Optional[List[TableCell]] = None
+    in_thead = False
+    thead_rows = 0
+    # Grid positions still covered by a rowspan from an earlier row: {column: [text, rows left]}
+    carried: Dict[int, list] = {}
+    width = 0
+
+    def close_row():
+        nonlocal row, width, thead_rows
+        # Lay the row out on the grid, skipping positions covered by rowspans from above
+        if carried:
+            texts = {position: entry[0] for position, entry in carried.items()}
+            for position in list(carried):
+                carried[position][1] -= 1
+                if carried[position][1] <= 0:
+                    del carried[position]
+            col = 0
+            for c in row:
+                while col in texts:
+                    col += 1
+                for position in range(col, col + c.colspan):
+                    texts[position] = c.text
+                    if c.rowspan > 1:
+                        carried[position] = [c.text, c.rowspan - 1]
+                col += c.colspan
+            grid_row = [texts.get(position, "") for position in range(max(texts) + 1)]
+        else:
+            grid_row = []
+            for c in row:
+                if c.rowspan > 1:
+                    for position in range(len(grid_row), len(grid_row) + c.colspan):
+                        carried[position] = [c.text, c.rowspan - 1]
+                grid_row.extend([c.text] * c.colspan)
+        width = max(width, len(grid_row))
+        grid.append(grid_row)
+        rows.append(row)
+        if in_thead:
+            thead_rows += 1
+        row = None
+
+    for closing, name, cell_tag, attrs, raw in TOKEN_RE.findall(html):
+        if cell_tag:
+            if row is None:
+                row = []
+            text = raw.strip()
+            if text:
+                if "<" in text or "&" in text:
+                    text = _cell_text(text)
+                contents.append(text)
+            cell = TableCell(text, cell_tag[1] in "hH", has_content=bool(raw) and not raw.isspace())
+            if attrs and "span" in attrs.lower():
+                for span, value in SPAN_RE.findall(attrs):
+                    setattr(cell, span.lower(), min(MAX_SPAN, max(1, int(value))))
+            row.append(cell)
+            continue
+
+        if row is not None:
+            close_row()
+        name = name.lower()
+        if name == "tr":
+            if not closing:
+                row = []
+        elif name == "table":
+            table.has_table = table.has_table or not closing
+        elif name == "thead":
+            in_thead = not closing
+
+    if row is not None:
+        close_row()
+    table.n_cells = sum(len(r) for r in rows)
+    table.content_counts.update(contents)
+
+    # Pad the grid to a rectangle
+    for grid_row in grid:
+        if len(grid_row) < width:
+            grid_row.extend([""] * (width - len(grid_row)))
+
+    if thead_rows:
+        table.header_rows = thead_rows
+    else:
+        while (
+            table.header_rows < len(rows) and rows[table.header_rows] and all(c.header for c in rows[table.header_rows])
+        ):
+            table.header_rows += 1
+    return table
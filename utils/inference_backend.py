@@ -0,0 +1,235 @@
+"""
+Inference backends: where demo_page sends its layout and element prompts
+
+Everything demo_page needs from a model is DOLPHIN.chat(question, image, max_batch_size)
+(a prompt and image, or lists of them) and its model_args. The backends below provide
+that interface for
+    local     the in-process PyTorch DOLPHIN
+    vllm      deployment/vllm/api_server.py
+    tensorrt  deployment/tensorrt_llm/api_server.py
+so many lightweight CPU workers (rasterizing, cropping, writing results) can share one
+inference box. The HTTP backends send each batch to /generate_batch as raw image bytes
+from an asyncio loop of their own, with at most max_concurrency requests in flight over a
+pool of keep-alive connections.
+"""
+
+import asyncio
+import io
+import json
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+SERVER_TYPES = ("vllm", "tensorrt")
+RETRY_STATUSES = (429, 503)
+
+
+def encode_image_bytes(image: Any) -> bytes:
+    """Raw bytes of an image given as a file path, bytes or a PIL image (PIL images as PNG)"""
+    if isinstance(image, (bytes, bytearray)):
+        return bytes(image)
+    if isinstance(image, str):
+        with open(image, "rb") as f:
+            return f.read()
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class InferenceBackend:
+    """Interface of a Dolphin inference backend
+
+    Attributes:
+        model_args: Model section of the config (page pre-check, token budgets, ...)
+    """
+
+    model_args: Dict = {}
+
+    def chat(self, question, image, max_batch_size: int = 16, return_stop_reason: bool = False, **kwargs):
+        """Run a prompt on an image, or lists of prompts and images, like DOLPHIN.chat
+
+        Returns:
+            The output text (list of texts for lists), plus the stop reason(s) when
+            return_stop_reason is set
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class LocalBackend(InferenceBackend):
+    """The in-process PyTorch model; other attributes (processor, ...) are those of the model"""
+
+    def __init__(self, dolphin):
+        self.dolphin = dolphin
+
+    @property
+    def model_args(self):
+        return self.dolphin.model_args
+
+    def chat(self, question, image, max_batch_size: int = 16, return_stop_reason: bool = False, **kwargs):
+        return self.dolphin.chat(
+            question, image, max_batch_size=max_batch_size, return_stop_reason=return_stop_reason, **kwargs
+        )
+
+    def __getattr__(self, name):
+        if name == "dolphin":
+            raise AttributeError(name)
+        return getattr(self.dolphin, name)
+
+
+class HTTPBackend(InferenceBackend):
+    """Dolphin inference server reached over HTTP (/generate_batch)
+
+    Lists are split into batches of max_batch_size that are sent concurrently; outputs come
+    back in input order. Stop reasons are not reported by the servers and are None. The
+    DOLPHIN.chat decoding options (labels, token budgets, repetition penalty) are not sent.
+
+    Args:
+        base_url: Server address, e.g. http://gpu-box:8000
+        max_concurrency: Most requests in flight at once
+        pool_size: Keep-alive connections kept open (default: max_concurrency)
+        timeout: Seconds to wait for one batch
+        max_retries: Retries of a batch the server turned away (429/503), after the delay
+            of its Retry-After header
+        model_args: Model section of the config, for the client-side stages
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        max_concurrency: int = 4,
+        pool_size: Optional[int] = None,
+        timeout: float = 600.0,
+        max_retries: int = 5,
+        model_args: Optional[Dict] = None,
+    ):
+        self.api_url = base_url.rstrip("/") + "/generate_batch"
+        self.max_concurrency = max(1, max_concurrency)
+        self.pool_size = pool_size or self.max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.model_args = model_args if model_args is not None else {}
+        self.requests_sent = 0
+        self._session = None
+        self._semaphore = None
+
+        # Synchronous callers submit to an event loop of the backend's own
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="inference-backend", daemon=True)
+        self._thread.start()
+
+    def form_fields(self) -> Dict[str, str]:
+        """Extra form fields sent with every batch"""
+        return {}
+
+    def chat(self, question, image, max_batch_size: int = 16, return_stop_reason: bool = False, **kwargs):
+        if kwargs.get("return_raw") or kwargs.get("return_metrics"):
+            raise ValueError("HTTP backends do not support return_raw or return_metrics")
+        questions, images = (question, image) if isinstance(question, list) else ([question], [image])
+        # Encode on the calling thread, so the event loop only does I/O
+        images = [encode_image_bytes(image) for image in images]
+        texts = asyncio.run_coroutine_threadsafe(self.generate(questions, images, max_batch_size), self._loop).result()
+
+        if not isinstance(question, list):
+            return (texts[0], None) if return_stop_reason else texts[0]
+        return (texts, [None] * len(texts)) if return_stop_reason else texts
+
+    async def generate(self, prompts: Sequence[str], images: Sequence[Any], max_batch_size: int = 16) -> List[str]:
+        """Outputs of every (prompt, image) pair in order, for callers on the backend's loop"""
+        max_batch_size = max(1, max_batch_size)
+        starts = range(0, len(prompts), max_batch_size)
+        outputs = await asyncio.gather(
+            *(
+                self._post(prompts[start : start + max_batch_size], images[start : start + max_batch_size])
+                for start in starts
+            )
+        )
+        return [text for batch in outputs for text in batch]
+
+    async def _post(self, prompts: Sequence[str], images: Sequence[Any]) -> List[str]:
+        import aiohttp
+
+        if self._session is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+
+        for attempt in range(self.max_retries + 1):
+            form = aiohttp.FormData()
+            form.add_field("prompts", json.dumps(list(prompts)))
+            for name, value in self.form_fields().items():
+                form.add_field(name, value)
+            for i, image in enumerate(images):
+                form.add_field(
+                    "images", encode_image_bytes(image), filename=f"image_{i}", content_type="application/octet-stream"
+                )
+
+            async with self._semaphore:
+                self.requests_sent += 1
+                async with self._session.post(self.api_url, data=form) as response:
+                    if response.status in RETRY_STATUSES and attempt < self.max_retries:
+                        delay = float(response.headers.get("Retry-After", 1))
+                    else:
+                        response.raise_for_status()
+                        texts = (await response.json())["text"]
+                        if len(texts) != len(images):
+                            raise RuntimeError(f"Server returned {len(texts)} outputs for {len(images)} images")
+                        return texts
+            await asyncio.sleep(delay)
+
+    def close(self):
+        """Close the connection pool and stop the backend's event loop"""
+        if self._thread is None:
+            return
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._thread = None
+
+
+class VLLMBackend(HTTPBackend):
+    """deployment/vllm/api_server.py
+
+    Args:
+        sampling_params: vLLM sampling parameters of every batch (default: greedy, max_tokens 4096)
+    """
+
+    def __init__(self, base_url: str, sampling_params: Optional[Dict] = None, **kwargs):
+        super().__init__(base_url, **kwargs)
+        self.sampling_params = sampling_params or {"temperature": 0.0, "max_tokens": 4096}
+
+    def form_fields(self) -> Dict[str, str]:
+        return {"sampling_params": json.dumps(self.sampling_params)}
+
+
+class TensorRTBackend(HTTPBackend):
+    """deployment/tensorrt_llm/api_server.py (max_new_tokens is set when starting the server)"""
+
+
+def create_backend(kind: str, config=None, url: Optional[str] = None, **kwargs) -> InferenceBackend:
+    """Backend of a kind ("local", "vllm" or "tensorrt")
+
+    Args:
+        kind: Backend kind
+        config: Loaded Dolphin config; the local backend builds DOLPHIN from it, the HTTP
+            backends take its model section as model_args
+        url: Server address of the HTTP backends
+        kwargs: Options of the HTTP backends (max_concurrency, timeout, ...)
+    """
+    if kind == "local":
+        from chat import DOLPHIN
+
+        return LocalBackend(DOLPHIN(config))
+    if kind not in SERVER_TYPES:
+        raise ValueError(f"Unknown inference backend: {kind}")
+    if not url:
+        raise ValueError(f"The {kind} backend needs a server URL")
+    if config is not None and "model_args" not in kwargs:
+        kwargs["model_args"] = config.model
+    backend_class = VLLMBackend if kind == "vllm" else TensorRTBackend
+    return backend_class(url, **kwargs)
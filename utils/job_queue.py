@@ -0,0 +1,261 @@
+"""
+Durable SQLite job queue for corpus-scale OCR runs
+
+Every document of a run is one row in a local SQLite file. Workers lease the next job
+(highest priority first, oldest first), renew the lease while they work and mark the job
+done or failed. A worker that is killed simply stops renewing: once its lease times out
+the job goes back to pending and another worker picks it up. Failed attempts are retried
+with exponential backoff until max_attempts is reached.
+
+Large PDFs can be queued as several page-range shards (page_start/page_stop, 0-based,
+stop exclusive); page_stop 0 means the whole document.
+
+Job states:
+    pending  waiting to be leased (not before not_before)
+    leased   owned by lease_owner until lease_expires
+    done     finished, output holds the result path
+    failed   out of attempts, error holds the last error
+
+All state changes run in IMMEDIATE transactions, so several worker processes on one
+machine can share the file safely.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+STATES = ("pending", "leased", "done", "failed")
+
+
+class JobQueue:
+    """Persistent queue of documents to process
+
+    Args:
+        path: SQLite file to store jobs in (created if missing)
+        backoff_base: Seconds before the first retry of a failed job, doubled per attempt
+        backoff_max: Upper bound of the retry delay in seconds
+        clock: Time source (seconds), replaceable for tests
+    """
+
+    def __init__(
+        self,
+        path: str,
+        backoff_base: float = 30.0,
+        backoff_max: float = 3600.0,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.path = path
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.clock = clock
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY, path TEXT, page_start INTEGER, page_stop INTEGER, priority INTEGER, "
+            "state TEXT, attempts INTEGER, max_attempts INTEGER, not_before REAL, lease_owner TEXT, "
+            "lease_expires REAL, error TEXT, output TEXT, created REAL, started REAL, finished REAL, "
+            "UNIQUE (path, page_start, page_stop))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_next ON jobs (state, priority DESC, id)")
+
+    def _transaction(self):
+        """IMMEDIATE transaction: one writer at a time across processes and threads"""
+        return _Transaction(self.conn, self._lock)
+
+    def add(self, paths: Sequence[str], priority: int = 0, max_attempts: int = 3) -> int:
+        """Queue documents; paths already in the queue are left as they are
+
+        Returns:
+            int: Number of newly queued documents
+        """
+        return self._insert([(path, 0, 0) for path in paths], priority, max_attempts)
+
+    def add_shards(
+        self, path: str, page_ranges: Sequence[Tuple[int, int]], priority: int = 0, max_attempts: int = 3
+    ) -> int:
+        """Queue one job per (start, stop) page range of a document
+
+        Returns:
+            int: Number of newly queued shards
+        """
+        return self._insert([(path, start, stop) for start, stop in page_ranges], priority, max_attempts)
+
+    def _insert(self, items, priority, max_attempts) -> int:
+        now = self.clock()
+        with self._transaction():
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO jobs (path, page_start, page_stop, priority, state, attempts, max_attempts, "
+                "not_before, created) VALUES (?, ?, ?, ?, 'pending', 0, ?, 0, ?)",
+                [(os.path.abspath(path), start, stop, priority, max_attempts, now) for path, start, stop in items],
+            )
+            return self.conn.total_changes - before
+
+    def lease(self, worker_id: str, lease_seconds: float = 600.0) -> Optional[Dict]:
+        """Take the next runnable job, or None if there is none right now
+
+        Jobs whose lease has expired (their worker died) are returned to pending first, or
+        marked failed when they are out of attempts.
+        """
+        now = self.clock()
+        with self._transaction():
+            self._reclaim_expired(now)
+            row = self.conn.execute(
+                "SELECT id FROM jobs WHERE state = 'pending' AND not_before <= ? ORDER BY priority DESC, id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE jobs SET state = 'leased', attempts = attempts + 1, lease_owner = ?, lease_expires = ?, "
+                "started = ? WHERE id = ?",
+                (worker_id, now + lease_seconds, now, row["id"]),
+            )
+            return dict(self.conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+
+    def _reclaim_expired(self, now: float):
+        self.conn.execute(
+            "UPDATE jobs SET state = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'pending' END, "
+            "error = 'lease of ' || lease_owner || ' expired', lease_owner = NULL, lease_expires = NULL, "
+            "finished = CASE WHEN attempts >= max_attempts THEN ? ELSE NULL END "
+            "WHERE state = 'leased' AND lease_expires < ?",
+            (now, now),
+        )
+
+    def renew(self, job_id: int, worker_id: str, lease_seconds: float = 600.0) -> bool:
+        """Extend a lease; False if the job is no longer leased by this worker"""
+        with self._transaction():
+            cursor = self.conn.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND state = 'leased' AND lease_owner = ?",
+                (self.clock() + lease_seconds, job_id, worker_id),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job_id: int, worker_id: str, output: str = None) -> bool:
+        """Mark a leased job done; False if the lease was lost in the meantime"""
+        with self._transaction():
+            cursor = self.conn.execute(
+                "UPDATE jobs SET state = 'done', output = ?, error = NULL, lease_owner = NULL, lease_expires = NULL, "
+                "finished = ? WHERE id = ? AND state = 'leased' AND lease_owner = ?",
+                (output, self.clock(), job_id, worker_id),
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, job_id: int, worker_id: str, error: str) -> Optional[str]:
+        """Record a failed attempt: retry later with backoff, or fail for good
+
+        Returns:
+            New state of the job ("pending" or "failed"), None if the lease was lost
+        """
+        now = self.clock()
+        with self._transaction():
+            row = self.conn.execute(
+                "SELECT attempts, max_attempts FROM jobs WHERE id = ? AND state = 'leased' AND lease_owner = ?",
+                (job_id, worker_id),
+            ).fetchone()
+            if row is None:
+                return None
+            if row["attempts"] >= row["max_attempts"]:
+                state, not_before, finished = "failed", 0, now
+            else:
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (row["attempts"] - 1))
+                state, not_before, finished = "pending", now + delay, None
+            self.conn.execute(
+                "UPDATE jobs SET state = ?, not_before = ?, error = ?, lease_owner = NULL, lease_expires = NULL, "
+                "finished = ? WHERE id = ?",
+                (state, not_before, error, finished, job_id),
+            )
+            return state
+
+    def retry_failed(self) -> int:
+        """Give failed jobs a fresh set of attempts
+
+        Returns:
+            int: Number of jobs requeued
+        """
+        with self._transaction():
+            cursor = self.conn.execute(
+                "UPDATE jobs SET state = 'pending', attempts = 0, not_before = 0, finished = NULL "
+                "WHERE state = 'failed'"
+            )
+            return cursor.rowcount
+
+    def jobs(self, state: str = None) -> List[Dict]:
+        """All jobs, or those in one state, in queue order"""
+        query = "SELECT * FROM jobs"
+        params = ()
+        if state is not None:
+            query += " WHERE state = ?"
+            params = (state,)
+        with self._lock:
+            return [dict(row) for row in self.conn.execute(query + " ORDER BY priority DESC, id", params)]
+
+    def status(self, window: float = 3600.0) -> Dict:
+        """Job counts per state, throughput over the last window seconds and ETA
+
+        Returns:
+            dict: counts, workers (active lease owners), done_in_window, docs_per_hour and
+                  eta_seconds (None while nothing has finished in the window)
+        """
+        now = self.clock()
+        with self._lock:
+            return self._status(now, window)
+
+    def _status(self, now: float, window: float) -> Dict:
+        counts = dict.fromkeys(STATES, 0)
+        for row in self.conn.execute("SELECT state, COUNT(*) AS n FROM jobs GROUP BY state"):
+            counts[row["state"]] = row["n"]
+        workers = [
+            row["lease_owner"]
+            for row in self.conn.execute(
+                "SELECT DISTINCT lease_owner FROM jobs WHERE state = 'leased' AND lease_expires >= ?", (now,)
+            )
+        ]
+        done_in_window = self.conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE state = 'done' AND finished >= ?", (now - window,)
+        ).fetchone()[0]
+
+        # Throughput over the part of the window the run has actually been going
+        first_start = self.conn.execute("SELECT MIN(started) FROM jobs WHERE started IS NOT NULL").fetchone()[0]
+        elapsed = min(window, now - first_start) if first_start is not None else 0.0
+        docs_per_second = done_in_window / elapsed if elapsed > 0 else 0.0
+        remaining = counts["pending"] + counts["leased"]
+        return {
+            "counts": counts,
+            "workers": workers,
+            "done_in_window": done_in_window,
+            "docs_per_hour": docs_per_second * 3600,
+            "eta_seconds": remaining / docs_per_second if docs_per_second > 0 else None,
+        }
+
+    def close(self):
+        self.conn.close()
+
+
+class _Transaction:
+    def __init__(self, conn, lock):
+        self.conn = conn
+        self.lock = lock
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            self.lock.release()
+            raise
+        return self.conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.conn.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        finally:
+            self.lock.release()
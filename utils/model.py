@@ -8,7 +8,8 @@ This modified file is released under the same license.
 """
 
 import logging
-from collections import defaultdict
+import time
+from collections import defaultdict, deque
 from typing import List, Optional
 
 import torch
@@ -315,6 +316,112 @@ class StoppingCriteriaScores(StoppingCriteria):
         return all(self.stopped.values()) and len(self.stopped) > 0
 
 
+def find_repeated_tails(windows: torch.Tensor, max_period: int, min_repeats: int, min_span: int) -> torch.Tensor:
+    """
+    Flag rows whose most recent tokens are one short pattern repeated over and over
+
+    Args:
+        windows: (batch_size, length) most recent token ids; positions that must not take part
+            in a match (prompt, padding) hold distinct negative values
+        max_period: Longest pattern considered, in tokens
+        min_repeats: Minimum number of consecutive copies of the pattern
+        min_span: Minimum number of tokens covered by the copies
+
+    Returns:
+        (batch_size,) bool tensor
+    """
+    length = windows.shape[1]
+    repeating = torch.zeros(windows.shape[0], dtype=torch.bool, device=windows.device)
+    for period in range(1, min(max_period, length - 1) + 1):
+        span = max(min_span, min_repeats * period)
+        if span > length:
+            break
+        # Number of trailing positions that equal the token one period earlier
+        matches = windows[:, period:] == windows[:, :-period]
+        run = matches.flip(1).long().cumprod(1).sum(1)
+        repeating |= run + period >= span
+    return repeating
+
+
+class RepetitionStoppingCriteria(StoppingCriteria):
+    """
+    Stop rows caught in a degenerate loop (the same word, cell or <tr> row generated again
+    and again) instead of letting them run to max_length. Unlike StoppingCriteriaScores this
+    works per row: other sequences of the batch keep decoding.
+    """
+
+    def __init__(
+        self,
+        prompt_length: int,
+        pad_token_id: int,
+        max_period: int = 64,
+        min_repeats: int = 4,
+        min_span: int = 128,
+        check_interval: int = 8,
+    ):
+        super().__init__()
+        self.prompt_length = prompt_length
+        self.pad_token_id = pad_token_id
+        self.max_period = max_period
+        self.min_repeats = min_repeats
+        self.min_span = min_span
+        self.check_interval = check_interval
+        self.window_size = max(min_span, min_repeats * max_period)
+        self.flagged = None
+
+    @torch.no_grad()
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        if self.flagged is None:
+            self.flagged = torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        generated = input_ids[:, self.prompt_length :]
+        # A loop keeps growing, so checking every few steps only costs a few extra tokens
+        if generated.shape[1] < self.min_span or generated.shape[1] % self.check_interval:
+            return self.flagged.clone()
+
+        windows = generated[:, -self.window_size :]
+        # Padding after </s> must not look like a repeated token
+        unique_fill = -1 - torch.arange(windows.shape[1], device=windows.device).expand_as(windows)
+        windows = torch.where(windows.eq(self.pad_token_id), unique_fill, windows)
+        self.flagged |= find_repeated_tails(windows, self.max_period, self.min_repeats, self.min_span)
+        return self.flagged.clone()
+
+    def check_sequences(self, generated: List[List[int]]) -> List[bool]:
+        """Repetition check for generated token lists of different lengths"""
+        flags = [False] * len(generated)
+        rows = [
+            row
+            for row, tokens in enumerate(generated)
+            if len(tokens) >= self.min_span and len(tokens) % self.check_interval == 0
+        ]
+        if not rows:
+            return flags
+        windows = torch.tensor(
+            [
+                [-1 - position for position in range(self.window_size - len(generated[row][-self.window_size :]))]
+                + generated[row][-self.window_size :]
+                for row in rows
+            ]
+        )
+        repeating = find_repeated_tails(windows, self.max_period, self.min_repeats, self.min_span)
+        for row, flag in zip(rows, repeating.tolist()):
+            flags[row] = flag
+        return flags
+
+
+class TokenBudgetStoppingCriteria(StoppingCriteria):
+    """Stop each row once it has generated its own token budget"""
+
+    def __init__(self, prompt_length: int, budgets: List[int]):
+        super().__init__()
+        self.prompt_length = prompt_length
+        self.budgets = torch.tensor(budgets)
+
+    @torch.no_grad()
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        generated_length = input_ids.shape[1] - self.prompt_length
+        return generated_length >= self.budgets.to(input_ids.device)
+
+
 def batch(l, b=15):
     subs = []
     for i in range(len(l) - b):
@@ -419,6 +526,9 @@ class DonutModel(PreTrainedModel):
         image_tensors: Optional[torch.Tensor] = None,
         return_attentions: bool = False,
         early_stopping: bool = True,
+        repetition_stopping: bool = False,
+        repetition_penalty: Optional[float] = None,
+        max_new_tokens: Optional[List[int]] = None,
     ):
         """
         Generate a token sequence in an auto-regressive manner.
@@ -427,12 +537,22 @@ class DonutModel(PreTrainedModel):
             image: input document image (PIL.Image)
             image_tensors: (1, num_channels, height, width)
                 convert prompt to tensor if image_tensor is not fed
+            repetition_stopping: Stop rows that fall into a repetition loop
+            repetition_penalty: Optional generate repetition penalty (e.g. for retries)
+            max_new_tokens: Optional token budget of each row, on top of config.max_length
+
+        Returns:
+            dict with sequences, scores, decoded repetitions and the stop_reasons of each row
+            ("eos", "repetition", "budget", "early_stop" or "max_length"), plus per-row metrics:
+            encoder_seconds and decode_seconds (the row's share of the batch), decode_steps,
+            generated_tokens and batch_rows (rows decoded alongside it, itself included)
         """
         output = {
             "predictions": list(),
             "sequences": list(),
             "repeats": list(),
             "repetitions": list(),
+            "stop_reasons": list(),
         }
         if image is None and image_tensors is None:
             logging.warn("Image not found")
@@ -446,12 +566,25 @@ class DonutModel(PreTrainedModel):
 
         image_tensors = image_tensors.to(self.device)
         prompt_ids = prompt_ids.to(self.device)
+        self._synchronize()
+        encoder_start = time.perf_counter()
         last_hidden_state = self.vpm(image_tensors, text_embedding=self.get_input_embeddings(prompt_ids))
+        self._synchronize()
+        decode_start = time.perf_counter()
 
         encoder_outputs = ModelOutput(last_hidden_state=last_hidden_state, attentions=None)
         if len(encoder_outputs.last_hidden_state.size()) == 1:
             encoder_outputs.last_hidden_state = encoder_outputs.last_hidden_state.unsqueeze(0)
 
+        stopping_criteria = StoppingCriteriaList()
+        if early_stopping:
+            stopping_criteria.append(StoppingCriteriaScores())
+        if repetition_stopping:
+            repetition_criteria = RepetitionStoppingCriteria(prompt_ids.shape[1], self.llm.tokenizer.pad_token_id)
+            stopping_criteria.append(repetition_criteria)
+        if max_new_tokens is not None:
+            stopping_criteria.append(TokenBudgetStoppingCriteria(prompt_ids.shape[1], max_new_tokens))
+
         # get decoder output
         decoder_output = self.llm.model.generate(
             input_ids=prompt_ids,
@@ -466,12 +599,313 @@ class DonutModel(PreTrainedModel):
             output_attentions=return_attentions,
             do_sample=False,
             num_beams=1,
-            stopping_criteria=StoppingCriteriaList([StoppingCriteriaScores()] if early_stopping else []),
+            stopping_criteria=stopping_criteria,
+            repetition_penalty=repetition_penalty,
         )
+        self._synchronize()
+        decode_end = time.perf_counter()
 
         output["repetitions"] = decoder_output.sequences.clone()
         output["sequences"] = decoder_output.sequences.clone()
         output["scores"] = torch.stack(decoder_output.scores, 1).softmax(-1).cpu().max(-1)[0]
 
         output["repetitions"] = self.llm.tokenizer.batch_decode(output["repetitions"], skip_special_tokens=False)
+
+        repetition_flags = repetition_criteria.flagged if repetition_stopping else None
+        for row, tokens in enumerate(decoder_output.sequences.cpu()):
+            output["stop_reasons"].append(
+                self._stop_reason(
+                    tokens[prompt_ids.shape[1] :].tolist(),
+                    len(tokens),
+                    self.config.max_length,
+                    repetition=repetition_flags is not None and bool(repetition_flags[row]),
+                    budget=max_new_tokens[row] if max_new_tokens is not None else None,
+                )
+            )
+
+        rows = decoder_output.sequences.shape[0]
+        output["encoder_seconds"] = [(decode_start - encoder_start) / rows] * rows
+        output["decode_seconds"] = [(decode_end - decode_start) / rows] * rows
+        output["decode_steps"] = [len(decoder_output.scores)] * rows
+        output["generated_tokens"] = [
+            self._generated_length(tokens[prompt_ids.shape[1] :].tolist()) for tokens in decoder_output.sequences.cpu()
+        ]
+        output["batch_rows"] = [rows] * rows
+        return output
+
+    def _synchronize(self):
+        """Wait for queued CUDA kernels, so that wall-clock timings cover them"""
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+
+    def _generated_length(self, generated: List[int]) -> int:
+        """Number of generated tokens of a row, without the padding of rows that stopped early"""
+        generated_length = len(generated)
+        while generated_length and generated[generated_length - 1] == self.llm.tokenizer.pad_token_id:
+            generated_length -= 1
+        return generated_length
+
+    def _stop_reason(
+        self,
+        generated: List[int],
+        sequence_length: int,
+        max_length: int,
+        repetition: bool = False,
+        budget: Optional[int] = None,
+    ) -> str:
+        """Why decoding of one row ended"""
+        if repetition:
+            return "repetition"
+        eos_token_id = self.llm.tokenizer.eos_token_id
+        if eos_token_id in generated:
+            # The </s> forced at the last position means the row ran out of length
+            if sequence_length - len(generated) + generated.index(eos_token_id) + 1 < max_length:
+                return "eos"
+            return "max_length"
+        # Rows that stopped early are padded up to the length of the batch
+        generated_length = self._generated_length(generated)
+        if budget is not None and generated_length >= budget:
+            return "budget"
+        if sequence_length < max_length:
+            return "early_stop"
+        return "max_length"
+
+    @torch.no_grad()
+    def inference_continuous(
+        self,
+        prompt_ids: torch.Tensor,
+        image_tensors: torch.Tensor,
+        max_batch_size: int = 16,
+        max_length: Optional[int] = None,
+        repetition_stopping: bool = False,
+        repetition_penalty: Optional[float] = None,
+        max_new_tokens: Optional[List[int]] = None,
+    ):
+        """
+        Generate token sequences with continuous (in-flight) batching.
+
+        Up to max_batch_size sequences are decoded together. As soon as one finishes it is
+        evicted from the batch and the next pending crop is admitted into the freed slot,
+        while the encoder outputs and key/value cache of the running sequences are kept.
+        Decoding is greedy and stops at </s>, max_length, the item's token budget or, if
+        enabled, a repetition loop.
+
+        Args:
+            prompt_ids: (num_items, prompt_length) prompt ids, left padded
+            image_tensors: (num_items, num_channels, height, width)
+            max_batch_size: Maximum number of sequences decoded at once
+            max_length: Maximum sequence length including the prompt (default: config.max_length)
+            repetition_stopping: Stop rows that fall into a repetition loop
+            repetition_penalty: Optional repetition penalty, applied like generate does
+            max_new_tokens: Optional token budget of each item, on top of max_length
+
+        Returns:
+            dict with the same keys as inference; sequences and scores are lists per item, and
+            batch_rows is the mean number of running sequences over the item's decoding steps
+        """
+        output = {
+            "predictions": list(),
+            "sequences": list(),
+            "repeats": list(),
+            "repetitions": list(),
+            "scores": list(),
+            "stop_reasons": list(),
+        }
+        max_length = max_length or self.config.max_length
+        pad_token_id = self.llm.tokenizer.pad_token_id
+        eos_token_id = self.llm.tokenizer.eos_token_id
+
+        if self.device.type != "mps":
+            image_tensors = image_tensors.to(next(self.parameters()).dtype)
+
+        num_items = image_tensors.shape[0]
+        prompts = [row[row.ne(pad_token_id)].tolist() for row in prompt_ids]
+        tokens = [list(prompt) for prompt in prompts]
+        token_scores = [[] for _ in range(num_items)]
+        encoder_seconds = [0.0] * num_items
+        decode_seconds = [0.0] * num_items
+        slot_rows = [0] * num_items
+
+        def _charge(items, seconds, per_item):
+            for item in items:
+                per_item[item] += seconds / len(items)
+
+        pending = deque(range(num_items))
+        slots = []  # item index of every row of the running batch
+        past_key_values = None
+        attention_mask = None
+        encoder_hidden_states = None
+
+        forced_eos_token_id = self.llm.model.config.forced_eos_token_id
+        repetition_detector = RepetitionStoppingCriteria(0, pad_token_id) if repetition_stopping else None
+        repeating = set()
+
+        def _append_tokens(items, logits):
+            logits = logits.float()
+            if repetition_penalty is not None and repetition_penalty != 1.0:
+                for row, item in enumerate(items):
+                    seen = torch.tensor(sorted(set(tokens[item])), device=logits.device)
+                    seen_logits = logits[row, seen]
+                    logits[row, seen] = torch.where(
+                        seen_logits < 0, seen_logits * repetition_penalty, seen_logits / repetition_penalty
+                    )
+            probs = logits.softmax(-1)
+            best_scores, best_tokens = probs.max(-1)
+            for item, token_id, score in zip(items, best_tokens.tolist(), best_scores.tolist()):
+                # Like generate, close sequences that reach max_length with the forced </s>
+                if forced_eos_token_id is not None and len(tokens[item]) == max_length - 1:
+                    token_id, score = forced_eos_token_id, 1.0
+                tokens[item].append(token_id)
+                token_scores[item].append(score)
+
+        def _is_finished(item):
+            if max_new_tokens is not None and len(tokens[item]) - len(prompts[item]) >= max_new_tokens[item]:
+                return True
+            return tokens[item][-1] == eos_token_id or len(tokens[item]) >= max_length or item in repeating
+
+        while pending or slots:
+            # Admit pending crops into free slots
+            if pending and len(slots) < max_batch_size:
+                admitted = [pending.popleft() for _ in range(min(max_batch_size - len(slots), len(pending)))]
+                encoder_start = time.perf_counter()
+                admitted_states = self.vpm(image_tensors[admitted].to(self.device))
+                self._synchronize()
+                _charge(admitted, time.perf_counter() - encoder_start, encoder_seconds)
+
+                # Prefill prompts of equal length together so that no padding is needed
+                by_length = defaultdict(list)
+                for position, item in enumerate(admitted):
+                    by_length[len(prompts[item])].append(position)
+                for positions in by_length.values():
+                    items = [admitted[position] for position in positions]
+                    prefill_start = time.perf_counter()
+                    states = admitted_states[positions]
+                    input_ids = torch.tensor([prompts[item] for item in items], device=self.device)
+                    prefill = self.llm.model(
+                        input_ids=input_ids,
+                        attention_mask=torch.ones_like(input_ids),
+                        encoder_hidden_states=states,
+                        use_cache=True,
+                        return_dict=True,
+                    )
+                    _append_tokens(items, prefill.logits[:, -1])
+                    _charge(items, time.perf_counter() - prefill_start, decode_seconds)
+                    for item in items:
+                        slot_rows[item] += len(slots) + len(items)
+                    past_key_values, attention_mask = self._merge_caches(
+                        past_key_values, attention_mask, prefill.past_key_values, torch.ones_like(input_ids)
+                    )
+                    encoder_hidden_states = (
+                        states if encoder_hidden_states is None else torch.cat([encoder_hidden_states, states], 0)
+                    )
+                    slots.extend(items)
+            elif slots:
+                # One decoding step for every running sequence
+                step_start = time.perf_counter()
+                decoder = self.llm.model.model.decoder
+                last_tokens = torch.tensor([[tokens[item][-1]] for item in slots], device=self.device)
+                attention_mask = torch.cat([attention_mask, attention_mask.new_ones((len(slots), 1))], 1)
+
+                # Rows were admitted at different times, so their positions differ from the
+                # shared cache length the decoder assumes; swap in each row's own position
+                positions_table = decoder.embed_positions.weight
+                offset = decoder.embed_positions.offset
+                own_positions = torch.tensor([len(tokens[item]) - 1 for item in slots], device=self.device)
+                shared_position = past_key_values[0][0].shape[2]
+                inputs_embeds = decoder.embed_tokens(last_tokens) + (
+                    positions_table[own_positions + offset] - positions_table[shared_position + offset]
+                ).unsqueeze(1)
+
+                step = self.llm.model(
+                    inputs_embeds=inputs_embeds,
+                    attention_mask=attention_mask,
+                    encoder_hidden_states=encoder_hidden_states,
+                    past_key_values=past_key_values,
+                    use_cache=True,
+                    return_dict=True,
+                )
+                past_key_values = step.past_key_values
+                _append_tokens(slots, step.logits[:, -1])
+                _charge(slots, time.perf_counter() - step_start, decode_seconds)
+                for item in slots:
+                    slot_rows[item] += len(slots)
+
+            if repetition_detector is not None:
+                flags = repetition_detector.check_sequences([tokens[item][len(prompts[item]) :] for item in slots])
+                repeating.update(item for item, flag in zip(slots, flags) if flag)
+
+            # Evict finished sequences
+            keep = [row for row, item in enumerate(slots) if not _is_finished(item)]
+            if len(keep) < len(slots):
+                slots = [slots[row] for row in keep]
+                if slots:
+                    index = torch.tensor(keep, device=self.device)
+                    past_key_values = tuple(
+                        tuple(tensor.index_select(0, index) for tensor in layer) for layer in past_key_values
+                    )
+                    attention_mask = attention_mask.index_select(0, index)
+                    encoder_hidden_states = encoder_hidden_states.index_select(0, index)
+                    past_key_values, attention_mask = self._trim_cache(past_key_values, attention_mask)
+                else:
+                    past_key_values = attention_mask = encoder_hidden_states = None
+
+        output["sequences"] = tokens
+        output["scores"] = token_scores
+        output["stop_reasons"] = [
+            self._stop_reason(
+                tokens[item][len(prompts[item]) :],
+                len(tokens[item]),
+                max_length,
+                repetition=item in repeating,
+                budget=max_new_tokens[item] if max_new_tokens is not None else None,
+            )
+            for item in range(num_items)
+        ]
+        output["repetitions"] = self.llm.tokenizer.batch_decode(tokens, skip_special_tokens=False)
+        output["encoder_seconds"] = encoder_seconds
+        output["decode_seconds"] = decode_seconds
+        # Every step of an item generates one of its tokens
+        output["decode_steps"] = [len(token_scores[item]) for item in range(num_items)]
+        output["generated_tokens"] = [len(tokens[item]) - len(prompts[item]) for item in range(num_items)]
+        output["batch_rows"] = [slot_rows[item] / max(1, len(token_scores[item])) for item in range(num_items)]
         return output
+
+    @staticmethod
+    def _merge_caches(past_a, mask_a, past_b, mask_b):
+        """Stack two key/value caches along the batch, left padding the shorter one"""
+        if past_a is None:
+            return past_b, mask_b
+        length_a, length_b = mask_a.shape[1], mask_b.shape[1]
+        length = max(length_a, length_b)
+
+        def _pad(tensor, current):
+            # Self-attention keys/values are (batch, heads, length, head_dim)
+            return F.pad(tensor, (0, 0, length - current, 0)) if current < length else tensor
+
+        merged = []
+        for layer_a, layer_b in zip(past_a, past_b):
+            self_attn = [torch.cat([_pad(a, length_a), _pad(b, length_b)], 0) for a, b in zip(layer_a[:2], layer_b[:2])]
+            cross_attn = [torch.cat([a, b], 0) for a, b in zip(layer_a[2:], layer_b[2:])]
+            merged.append(tuple(self_attn + cross_attn))
+        mask = torch.cat([F.pad(mask_a, (length - length_a, 0)), F.pad(mask_b, (length - length_b, 0))], 0)
+        return tuple(merged), mask
+
+    @staticmethod
+    def _trim_cache(past_key_values, attention_mask):
+        """Drop leading cache positions that no remaining row attends to"""
+        start = int(attention_mask.any(0).nonzero()[0])
+        if start == 0:
+            return past_key_values, attention_mask
+        trimmed = tuple(
+            tuple(tensor[:, :, start:] for tensor in layer[:2]) + tuple(layer[2:]) for layer in past_key_values
+        )
+        return trimmed, attention_mask[:, start:]
+
+
+def quantize_linears_int8(module: nn.Module) -> nn.Module:
+    """
+    Swap the nn.Linear layers of a module for dynamically quantized int8 ones (CPU only).
+    Weights are stored as int8 and activations are quantized on the fly per batch, which
+    speeds up the matmul-bound autoregressive decoder on CPUs without a calibration set.
+    """
+    return torch.ao.quantization.quantize_dynamic(module, {nn.Linear}, dtype=torch.qint8, inplace=True)
@@ -0,0 +1,141 @@
+"""
+Per-element OCR profiles: where the decoding time of a document went
+
+When ocr_profiler is enabled, every model call of demo_page records the metrics returned
+by DOLPHIN.chat(return_metrics=True) for each element (and each page layout pass), tagged
+with its label and page. After a document, write() saves them with per-label and per-page
+totals as recognition_json/<name>.profile.json; print_profile_summary ranks the slowest
+labels and pages of one or several profiles.
+"""
+
+import json
+import os
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence
+
+
+def profile_path(save_dir: str, document_path: str) -> str:
+    """Path of the profile written next to the recognition JSON of a document"""
+    base_name = os.path.splitext(os.path.basename(document_path))[0]
+    return os.path.join(save_dir, "recognition_json", f"{base_name}.profile.json")
+
+
+def element_seconds(metrics: Dict) -> float:
+    return metrics["preprocess_seconds"] + metrics["encoder_seconds"] + metrics["decode_seconds"]
+
+
+def summarize_elements(elements: Sequence[Dict]) -> Dict:
+    """Totals per label and per page of profiled elements
+
+    Returns:
+        dict with "total", "labels" (label -> stats) and "pages" (page -> stats), where stats
+        hold elements, seconds, the seconds spent in preprocess/encoder/decode, tokens,
+        tokens_per_second, mean_token_score, mean_batch_occupancy and stop_reasons counts
+    """
+    groups = defaultdict(list)
+    for element in elements:
+        groups[("labels", element["label"])].append(element)
+        groups[("pages", element["page"])].append(element)
+
+    summary = {"total": _stats(elements), "labels": {}, "pages": {}}
+    for (kind, key), group in sorted(groups.items(), key=lambda item: str(item[0])):
+        summary[kind][key] = _stats(group)
+    return summary
+
+
+def _stats(elements: Sequence[Dict]) -> Dict:
+    seconds = sum(element_seconds(element) for element in elements)
+    tokens = sum(element["generated_tokens"] for element in elements)
+    scores = [element["mean_token_score"] for element in elements if element["mean_token_score"] is not None]
+    stop_reasons = defaultdict(int)
+    for element in elements:
+        stop_reasons[element["stop_reason"]] += 1
+    return {
+        "elements": len(elements),
+        "seconds": round(seconds, 4),
+        "preprocess_seconds": round(sum(element["preprocess_seconds"] for element in elements), 4),
+        "encoder_seconds": round(sum(element["encoder_seconds"] for element in elements), 4),
+        "decode_seconds": round(sum(element["decode_seconds"] for element in elements), 4),
+        "tokens": tokens,
+        "tokens_per_second": round(tokens / seconds, 2) if seconds > 0 else None,
+        "mean_token_score": round(sum(scores) / len(scores), 4) if scores else None,
+        "mean_batch_occupancy": (
+            round(sum(element["batch_occupancy"] for element in elements) / len(elements), 4) if elements else None
+        ),
+        "stop_reasons": dict(sorted(stop_reasons.items())),
+    }
+
+
+class OCRProfiler:
+    """Collects the per-element metrics of the document being processed"""
+
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.elements = []
+
+    def record(self, label: str, page: Optional[str], metrics: Dict, **fields):
+        """Add the metrics of one decoded element (extra fields, e.g. retry=True, are kept)"""
+        self.elements.append({"label": label, "page": page, **metrics, **fields})
+
+    def record_many(self, labels: Sequence[str], pages: Sequence[Optional[str]], metrics: Sequence[Dict], **fields):
+        for label, page, element_metrics in zip(labels, pages, metrics):
+            self.record(label, page, element_metrics, **fields)
+
+    def write(self, path: str, document_path: str) -> str:
+        """Save the elements recorded since the last reset with their summary, then reset"""
+        profile = {
+            "source_file": document_path,
+            "summary": summarize_elements(self.elements),
+            "elements": self.elements,
+        }
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(profile, f, indent=2, ensure_ascii=False)
+        self.reset()
+        return path
+
+
+def print_profile_summary(paths: Sequence[str], top: int = 10):
+    """Print the slowest labels and pages over one or more profile files"""
+    elements: List[Dict] = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            profile = json.load(f)
+        document = os.path.splitext(os.path.basename(profile["source_file"]))[0]
+        for element in profile["elements"]:
+            # Page names are only unique within a document
+            elements.append(dict(element, page=f"{document}:{element['page']}"))
+    if not elements:
+        return
+
+    summary = summarize_elements(elements)
+    total = summary["total"]
+    print(
+        f"\nOCR profile: {total['elements']} model outputs, {total['seconds']:.1f}s "
+        f"(preprocess {total['preprocess_seconds']:.1f}s, encoder {total['encoder_seconds']:.1f}s, "
+        f"decode {total['decode_seconds']:.1f}s), {total['tokens']} tokens"
+    )
+    print("Slowest labels:")
+    for label, stats in sorted(summary["labels"].items(), key=lambda item: -item[1]["seconds"])[:top]:
+        print(
+            f"  {label:<10} elements {stats['elements']:>6}  {stats['seconds']:>8.1f}s  "
+            f"{stats['seconds'] / stats['elements']:>6.2f}s/elem  tokens/s {stats['tokens_per_second'] or 0:>7.1f}  "
+            f"occupancy {stats['mean_batch_occupancy'] * 100:5.1f}%  {_format_stop_reasons(stats['stop_reasons'])}"
+        )
+    print("Slowest pages:")
+    for page, stats in sorted(summary["pages"].items(), key=lambda item: -item[1]["seconds"])[:top]:
+        print(
+            f"  {page:<40} elements {stats['elements']:>4}  {stats['seconds']:>8.1f}s  tokens {stats['tokens']:>6}  "
+            f"{_format_stop_reasons(stats['stop_reasons'])}"
+        )
+
+
+def _format_stop_reasons(stop_reasons: Dict[str, int]) -> str:
+    return " ".join(f"{reason}={count}" for reason, count in stop_reasons.items())
+
+
+# Shared by every recognition call of the process
+ocr_profiler = OCRProfiler()
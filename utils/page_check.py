@@ -0,0 +1,130 @@
+"""
+Cheap pre-check of rendered pages before layout inference
+
+Scanned catalogs contain blank versos, separator sheets and plate pages that carry a
+photograph and nothing else. Layout parsing costs a full model call per page, so pages are
+first classified from their ink density and connected components:
+    blank       (almost) no ink - no elements, no model call
+    image_only  one or more dense picture regions and no ink outside them - a single fig
+                element, no model call
+    content     everything else - the usual layout + recognition path
+Thresholds are deliberately conservative: a page that is not clearly blank or pure image
+goes to the model.
+"""
+
+from typing import Callable, Optional
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from utils.utils import save_figure_to_local
+
+WORK_SIDE = 1024  # pages are measured at most this large (longest side)
+INK_CONTRAST = 80  # gray levels below the paper that count as ink (ignores show-through)
+TONE_CONTRAST = 30  # gray levels below the paper that count as picture tone
+MIN_MARK_AREA = 12  # connected ink smaller than this (pixels at WORK_SIDE) is dust
+BLANK_MAX_INK = 0.002  # ink share of a blank page
+BLANK_MAX_MARKS = 3  # e.g. a lone page number
+BLANK_MAX_TONE = 0.005  # picture tone share of a blank page (light drawings are not blank)
+MIN_REGION_RATIO = 0.02  # picture regions are at least this share of the page (bbox)
+MIN_REGION_DENSITY = 0.4  # share of a picture region's bbox covered by tone (text blocks are sparser)
+MIN_IMAGE_COVERAGE = 0.15  # picture regions together cover at least this share of the page
+
+
+def classify_page(image: Image.Image) -> dict:
+    """Classify a page as blank, image_only or content
+
+    Args:
+        image: PIL page image
+
+    Returns:
+        dict: page_class, ink_ratio, marks (connected ink marks outside pictures) and
+              image_bbox ([x1, y1, x2, y2] in image coordinates, image_only pages only)
+    """
+    gray = np.asarray(image.convert("L"))
+    scale = min(1.0, WORK_SIDE / max(gray.shape))
+    if scale < 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    height, width = gray.shape
+    page_area = float(height * width)
+
+    # Paper level from the bright end of the histogram, so toned or yellowed paper is not ink
+    paper = float(np.percentile(gray, 90))
+    ink = (gray < paper - INK_CONTRAST).astype(np.uint8)
+    ink_ratio = float(ink.mean())
+
+    _, _, mark_stats, mark_centers = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    min_mark_area = max(2, int(MIN_MARK_AREA * (max(height, width) / WORK_SIDE) ** 2))
+    keep = mark_stats[1:, cv2.CC_STAT_AREA] >= min_mark_area
+    mark_centers = mark_centers[1:][keep]
+
+    tone = (gray < paper - TONE_CONTRAST).astype(np.uint8)
+    result = {"page_class": "content", "ink_ratio": round(ink_ratio, 5), "marks": len(mark_centers)}
+    if ink_ratio <= BLANK_MAX_INK and len(mark_centers) <= BLANK_MAX_MARKS and tone.mean() <= BLANK_MAX_TONE:
+        result["page_class"] = "blank"
+        return result
+
+    # Picture regions: large connected areas densely covered by tone (halftones, photographs)
+    tone = cv2.morphologyEx(tone, cv2.MORPH_CLOSE, np.ones((3, 3), np.uint8))
+    _, _, region_stats, _ = cv2.connectedComponentsWithStats(tone, connectivity=8)
+    regions = []
+    for x, y, w, h, area in region_stats[1:]:
+        if w * h >= MIN_REGION_RATIO * page_area and area >= MIN_REGION_DENSITY * w * h:
+            regions.append((x, y, x + w, y + h))
+    if not regions or sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in regions) < MIN_IMAGE_COVERAGE * page_area:
+        return result
+
+    # Any ink next to the pictures means the page needs layout parsing: even a short caption,
+    # plate number or denomination ("1863") would be lost in a single fig element
+    in_region = np.zeros_like(tone, dtype=bool)
+    for x1, y1, x2, y2 in regions:
+        in_region[y1:y2, x1:x2] = True
+    centers = mark_centers.astype(int)
+    result["marks"] = int((~in_region[centers[:, 1], centers[:, 0]]).sum())
+    if result["marks"]:
+        return result
+
+    x1, y1 = min(region[0] for region in regions), min(region[1] for region in regions)
+    x2, y2 = max(region[2] for region in regions), max(region[3] for region in regions)
+    result["page_class"] = "image_only"
+    result["image_bbox"] = [int(x1 / scale), int(y1 / scale), int(np.ceil(x2 / scale)), int(np.ceil(y2 / scale))]
+    return result
+
+
+def precheck_page(
+    image: Image.Image,
+    save_dir: Optional[str] = None,
+    image_name: Optional[str] = None,
+    save_figure: Callable = save_figure_to_local,
+):
+    """Results of a page that does not need the model, or None if it does
+
+    Args:
+        image: PIL page image
+        save_dir: Directory to save figure crops
+        image_name: Name of the page (used for figure files)
+        save_figure: Callable (pil_crop, save_dir, image_name, reading_order) -> figure filename
+
+    Returns:
+        Tuple of (recognition_results, page_info) for blank and image_only pages, else None
+    """
+    check = classify_page(image)
+    page_class = check["page_class"]
+    if page_class == "content":
+        return None
+
+    recognition_results = []
+    if page_class == "image_only":
+        bbox = check["image_bbox"]
+        figure_filename = save_figure(image.crop(bbox), save_dir, image_name, 0)
+        recognition_results.append(
+            {
+                "label": "fig",
+                "text": f"![Figure](figures/{figure_filename})",
+                "figure_path": f"figures/{figure_filename}",
+                "bbox": bbox,
+                "reading_order": 0,
+            }
+        )
+    return recognition_results, {"page_class": page_class}
@@ -0,0 +1,166 @@
+"""
+Page-granular store of recognition results for resumable PDF processing
+
+Every finished page is appended as one JSON line to
+recognition_json/pages/<sha256 of the PDF>.jsonl, so a crash on page 380 of 400 only
+loses the pages in flight. Keying by content rather than file name means a renamed or
+re-downloaded copy of the same PDF resumes too. The combined JSON/markdown files are
+assembled from the store once every page is present.
+
+Page-range shards of one PDF, processed by different workers, write to their own
+<sha256>.<shard>.jsonl files next to it; every store of the PDF reads all of them, so
+the shards are stitched simply by assembling the pages in page order. Shards finishing
+together can all find every page stored; the one that creates the <sha256>.stitch marker
+stitches, the others leave it.
+"""
+
+import glob
+import hashlib
+import json
+import os
+from typing import Dict, List, Tuple
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def page_range_shards(num_pages: int, pages_per_shard: int) -> List[Tuple[int, int]]:
+    """Split a document into consecutive (start, stop) 0-based page ranges"""
+    pages_per_shard = max(1, pages_per_shard)
+    return [(start, min(start + pages_per_shard, num_pages)) for start in range(0, num_pages, pages_per_shard)]
+
+
+def shard_name(page_range: Tuple[int, int]) -> str:
+    """Page store shard name of a 0-based (start, stop) page range, e.g. pages_0101-0200"""
+    return f"pages_{page_range[0] + 1:04d}-{page_range[1]:04d}"
+
+
+class PageStore:
+    """Append-only JSONL store of per-page results of one PDF
+
+    Args:
+        save_dir: Directory results are saved to
+        document_path: Path to the PDF
+        document_hash: Content hash of the PDF (computed if not given)
+        shard: Optional shard name (e.g. "pages_0101-0200"); pages are then written to a
+            file of their own, while load still sees the pages of every shard
+    """
+
+    def __init__(self, save_dir: str, document_path: str, document_hash: str = None, shard: str = None):
+        self.document_hash = document_hash or file_sha256(document_path)
+        self.directory = os.path.join(save_dir, "recognition_json", "pages")
+        self.shard = shard
+        self.base_path = os.path.join(self.directory, f"{self.document_hash}.jsonl")
+        self.path = os.path.join(self.directory, f"{self.document_hash}.{shard}.jsonl") if shard else self.base_path
+        self.stitch_path = os.path.join(self.directory, f"{self.document_hash}.stitch")
+
+    def load(self) -> Dict[int, list]:
+        """Stored record ({"page_index", "page_number", "elements", ...}) of every page, by 0-based index
+
+        Pages written by other processes (files named <hash>.<suffix>.jsonl) are included.
+        A line cut short by a crash is ignored; that page is simply processed again.
+        """
+        pages = {}
+        paths = [self.base_path] + sorted(glob.glob(os.path.join(self.directory, f"{self.document_hash}.*.jsonl")))
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    pages[record["page_index"]] = record
+        return pages
+
+    def missing_pages(self, num_pages: int, page_range: Tuple[int, int] = None) -> List[int]:
+        """0-based indices of the pages without stored results
+
+        Args:
+            num_pages: Number of pages of the PDF
+            page_range: Optional (start, stop) 0-based page range to restrict the check to
+        """
+        stored = self.load()
+        start, stop = page_range or (0, num_pages)
+        return [page_idx for page_idx in range(start, min(stop, num_pages)) if page_idx not in stored]
+
+    def append(self, page_idx: int, elements: list, page_info: dict = None):
+        """Durably record the results of one page
+
+        Args:
+            page_idx: 0-based page index
+            elements: Recognition results of the page
+            page_info: Optional extra page fields, e.g. {"page_class": "text_layer"}
+
+        Returns:
+            The stored page record
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        record = {"page_index": page_idx, "page_number": page_idx + 1, "elements": elements, **(page_info or {})}
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        # Start on a fresh line if a crash left the previous one unfinished
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    line = "\n" + line
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        return record
+
+    def assemble(self, num_pages: int) -> List[dict]:
+        """Page results in page order, in the format of save_combined_pdf_results
+
+        Raises:
+            Exception: if a page has no stored results
+        """
+        stored = self.load()
+        missing = [page_idx + 1 for page_idx in range(num_pages) if page_idx not in stored]
+        if missing:
+            raise Exception(f"Pages {missing} are missing from page store {self.path}")
+        pages = []
+        for page_idx in range(num_pages):
+            page = {key: value for key, value in stored[page_idx].items() if key != "page_index"}
+            pages.append(page)
+        return pages
+
+    def claim_stitch(self) -> bool:
+        """Claim stitching the combined results of a sharded PDF
+
+        Creating the marker with O_CREAT | O_EXCL is atomic across processes, so only one
+        shard wins. The marker holds the winner's shard name: a retry of a stitcher that
+        crashed claims it again.
+
+        Returns:
+            True if this shard stitches the document
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            fd = os.open(self.stitch_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            with open(self.stitch_path, "r", encoding="utf-8") as f:
+                return f.read() == (self.shard or "")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(self.shard or "")
+        return True
+
+    def clear(self):
+        """Forget stored pages so the document is processed from scratch (only this shard's, if sharded)"""
+        if os.path.exists(self.stitch_path):
+            os.remove(self.stitch_path)
+        if self.shard:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        for path in [self.path] + glob.glob(os.path.join(self.directory, f"{self.document_hash}.*.jsonl")):
+            if os.path.exists(path):
+                os.remove(path)
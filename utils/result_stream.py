@@ -0,0 +1,125 @@
+"""
+Incremental per-document output: page-record JSONL and markdown written as pages finish
+
+save_combined_pdf_results keeps every page of a document in memory, dumps it as one
+indented JSON and then renders the whole markdown. DocumentStream instead appends each
+finished page, in page order, to
+    recognition_json/<name>.jsonl   one page record per line
+    markdown/<name>.md              the page's markdown, rendered on its own
+so memory stays bounded by a page and consumers can read complete pages while OCR is
+still running (read_page_records). The combined JSON of save_combined_pdf_results can
+still be exported from the JSONL, byte for byte the same, without loading the document.
+"""
+
+import json
+import os
+from typing import Dict, Iterator
+
+from utils.markdown_utils import MarkdownConverter
+
+PAGE_SEPARATOR = "\n\n---\n\n"
+
+
+def read_page_records(jsonl_path: str) -> Iterator[dict]:
+    """Page records of a document JSONL, skipping a line still being written"""
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+class DocumentStream:
+    """Writes the page records of one document as they finish
+
+    Pages may be added in any order; they are written in page order as soon as every
+    page before them has been added.
+
+    Args:
+        save_dir: Directory to save results
+        document_path: Path to the source document
+        num_pages: Number of pages of the document
+    """
+
+    def __init__(self, save_dir: str, document_path: str, num_pages: int):
+        base_name = os.path.splitext(os.path.basename(document_path))[0]
+        self.document_path = document_path
+        self.num_pages = num_pages
+        self.jsonl_path = os.path.join(save_dir, "recognition_json", f"{base_name}.jsonl")
+        self.markdown_path = os.path.join(save_dir, "markdown", f"{base_name}.md")
+        self.json_path = os.path.join(save_dir, "recognition_json", f"{base_name}.json")
+        self.markdown_converter = MarkdownConverter()
+        self.next_page = 0
+        self.pending: Dict[int, dict] = {}
+        self.has_markdown = False
+
+        for path in (self.jsonl_path, self.markdown_path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, "w", encoding="utf-8").close()
+
+    def add_page(self, page_idx: int, record: dict):
+        """Queue a page record ({"page_number", "elements", ...}) and write all pages that are ready"""
+        self.pending[page_idx] = {key: value for key, value in record.items() if key != "page_index"}
+        while self.next_page in self.pending:
+            self._write_page(self.pending.pop(self.next_page))
+            self.next_page += 1
+
+    def add_pages(self, records: Dict[int, dict]):
+        """Queue several page records by 0-based index, e.g. those of PageStore.load()"""
+        for page_idx in sorted(records):
+            self.add_page(page_idx, records[page_idx])
+
+    def _write_page(self, record: dict):
+        with open(self.jsonl_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+        elements = record.get("elements", [])
+        if not elements:
+            return
+        try:
+            markdown = self.markdown_converter.convert(elements)
+        except Exception as e:
+            print(f"Error generating markdown of page {record.get('page_number')}: {e}")
+            return
+        with open(self.markdown_path, "a", encoding="utf-8") as f:
+            if self.has_markdown:
+                f.write(PAGE_SEPARATOR)
+            f.write(markdown)
+        self.has_markdown = True
+
+    def close(self) -> str:
+        """Check that every page was written
+
+        Returns:
+            Path of the JSONL file
+
+        Raises:
+            Exception: if pages are missing
+        """
+        if self.next_page < self.num_pages:
+            missing = [page_idx + 1 for page_idx in range(self.next_page, self.num_pages)]
+            raise Exception(f"Pages {missing} are missing from {self.jsonl_path}")
+        return self.jsonl_path
+
+    def export_json(self) -> str:
+        """Write the combined JSON of save_combined_pdf_results from the JSONL, one page at a time
+
+        Returns:
+            Path of the combined JSON file
+        """
+        with open(self.json_path, "w", encoding="utf-8") as f:
+            f.write("{\n")
+            f.write(f'  "source_file": {json.dumps(self.document_path, ensure_ascii=False)},\n')
+            f.write(f'  "total_pages": {self.num_pages},\n')
+            f.write('  "pages": [')
+            written = 0
+            for record in read_page_records(self.jsonl_path):
+                # json.dump(..., indent=2) nests each page 4 spaces deep
+                page_json = json.dumps(record, indent=2, ensure_ascii=False).replace("\n", "\n    ")
+                f.write(("," if written else "") + "\n    " + page_json)
+                written += 1
+            f.write("\n  ]\n}" if written else "]\n}")
+        return self.json_path
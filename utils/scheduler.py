@@ -0,0 +1,152 @@
+"""
+Length-aware scheduling of element crops for batched decoding
+
+Greedy batched decoding runs until the longest sequence of a batch stops, so a one-line
+caption that shares a batch with a long table pays for every step of the table. The
+estimates below only need to rank crops by expected output length; crops of similar
+length are then decoded together and the results are put back in their original order.
+"""
+
+from collections import defaultdict
+from typing import List, Mapping, Optional, Sequence
+
+# Approximate glyph geometry of pages rendered with the longest side at 896 px
+LINE_HEIGHT_PX = 14
+CHAR_WIDTH_PX = 7
+CHARS_PER_TOKEN = 3.0
+
+# Output markup overhead relative to plain text (tables are decoded as HTML)
+LABEL_TOKEN_FACTORS = {
+    "tab": 2.5,
+    "equ": 1.5,
+    "alg": 1.5,
+    "code": 1.3,
+}
+DEFAULT_TOKEN_FACTOR = 1.0
+
+
+def estimate_output_length(label: str, width: int, height: int) -> int:
+    """Estimate the number of tokens generated for a crop
+
+    The crop is treated as lines of LINE_HEIGHT_PX holding characters of CHAR_WIDTH_PX, so
+    area and aspect ratio both matter: a wide single-line crop yields one line of text,
+    while a tall crop of the same area yields many short lines.
+
+    Args:
+        label: Layout label of the element (e.g. "para", "tab", "foot")
+        width: Crop width in pixels
+        height: Crop height in pixels
+
+    Returns:
+        int: Estimated number of output tokens (at least 1)
+    """
+    lines = max(1.0, height / LINE_HEIGHT_PX)
+    chars_per_line = max(1.0, width / CHAR_WIDTH_PX)
+    factor = LABEL_TOKEN_FACTORS.get(label, DEFAULT_TOKEN_FACTOR)
+    return int(lines * chars_per_line / CHARS_PER_TOKEN * factor) + 1
+
+
+def length_bucketed_batches(lengths: Sequence[int], max_batch_size: int) -> List[List[int]]:
+    """Group item indices into batches of similar estimated output length
+
+    Longest items come first so that the peak memory of a run shows up immediately.
+
+    Args:
+        lengths: Estimated output length of each item
+        max_batch_size: Maximum number of items per batch
+
+    Returns:
+        List of batches, each a list of indices into lengths
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    return [order[i : i + max_batch_size] for i in range(0, len(order), max_batch_size)]
+
+
+def sequential_batches(num_items: int, max_batch_size: int) -> List[List[int]]:
+    """Batches of consecutive indices, in arrival order"""
+    return [list(range(i, min(i + max_batch_size, num_items))) for i in range(0, num_items, max_batch_size)]
+
+
+def restore_order(values: Sequence, batches: List[List[int]]) -> list:
+    """Undo a batch ordering
+
+    Args:
+        values: Results in the order the batches were run
+        batches: Batches of original indices, as used for the run
+
+    Returns:
+        list: values rearranged into the original index order
+    """
+    order = [i for batch in batches for i in batch]
+    restored = [None] * len(order)
+    for position, index in enumerate(order):
+        restored[index] = values[position]
+    return restored
+
+
+def token_budget(label: str, width: int, height: int, policy: Optional[Mapping]) -> Optional[int]:
+    """Maximum number of tokens an element crop may generate
+
+    The budget is the estimated output length times policy["headroom"], raised to
+    policy["min_tokens"] and capped by policy["label_caps"][label] (or its "default").
+
+    Args:
+        label: Layout label of the element
+        width: Crop width in pixels
+        height: Crop height in pixels
+        policy: model.token_budgets section of the config
+
+    Returns:
+        Optional[int]: Token budget, or None when budgets are disabled
+    """
+    if not policy or not policy.get("enabled", False):
+        return None
+    estimate = estimate_output_length(label, width, height)
+    budget = max(int(estimate * policy.get("headroom", 4.0)), policy.get("min_tokens", 0))
+    label_caps = policy.get("label_caps") or {}
+    cap = label_caps.get(label, label_caps.get("default"))
+    return min(budget, cap) if cap else budget
+
+
+class BudgetTelemetry:
+    """Per-label counts of elements decoded under a token budget and of budget hits"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.stats = defaultdict(lambda: {"elements": 0, "budget_hits": 0, "budget_tokens": 0})
+
+    def record(self, label: str, budget: int, stop_reason: str):
+        stats = self.stats[label]
+        stats["elements"] += 1
+        stats["budget_tokens"] += budget
+        if stop_reason == "budget":
+            stats["budget_hits"] += 1
+
+    def summary(self) -> dict:
+        """label -> {"elements", "budget_hits", "hit_rate", "mean_budget"}"""
+        return {
+            label: {
+                "elements": stats["elements"],
+                "budget_hits": stats["budget_hits"],
+                "hit_rate": round(stats["budget_hits"] / stats["elements"], 4),
+                "mean_budget": round(stats["budget_tokens"] / stats["elements"], 1),
+            }
+            for label, stats in sorted(self.stats.items())
+        }
+
+    def print_summary(self):
+        summary = self.summary()
+        if not summary:
+            return
+        print("\nToken budget hits by label:")
+        for label, stats in summary.items():
+            print(
+                f"  {label:<10} elements {stats['elements']:>6}  hits {stats['budget_hits']:>5}  "
+                f"hit rate {stats['hit_rate'] * 100:5.1f}%  mean budget {stats['mean_budget']:>7.1f}"
+            )
+
+
+# Shared by every recognition call of the process
+budget_telemetry = BudgetTelemetry()
@@ -0,0 +1,249 @@
+"""
+Born-digital fast path: Dolphin-compatible elements straight from a PDF text layer
+
+Newer bulletins and auction catalogs are born-digital, so their text layer is exact and
+running the two-stage model on them only costs time. A page qualifies when it carries
+enough text, almost no garbled characters (unmapped glyphs, private-use code points) and
+is not a scan with an OCR layer on top (a page-sized image). Its blocks, tables and images
+are then turned into elements with the same label/bbox/reading_order/text fields the
+model produces, with bboxes in the pixel space of the page rendered by render_pdf_page.
+"""
+
+import os
+import unicodedata
+from html import escape
+from statistics import median
+from typing import Callable, Dict, Iterable, List, Optional
+
+import pymupdf
+from PIL import Image
+
+from utils.utils import save_figure_to_local
+
+MIN_CHARS = 40  # less text than this is left to the model (blank/image pages, stray marks)
+MAX_GARBLED_RATIO = 0.02  # share of unmapped/private-use/control characters
+MAX_IMAGE_COVERAGE = 0.5  # a page-sized image means a scan, possibly with an OCR text layer
+MARGIN_RATIO = 0.06  # blocks within this share of the page height are header/foot
+TITLE_SIZE_RATIO = 1.8  # font size relative to the page's body text
+SECTION_SIZE_RATIO = 1.25
+MIN_FIGURE_SIDE = 8  # rendered pixels
+
+
+def is_garbled_char(char: str) -> bool:
+    """Replacement, private-use, unassigned or control characters left by unmapped fonts"""
+    if char in "\n\t\r":
+        return False
+    return char == "�" or unicodedata.category(char) in ("Co", "Cn", "Cc")
+
+
+def analyze_text_layer(page: pymupdf.Page, text_dict: Optional[dict] = None) -> dict:
+    """Measure whether a page's text layer can replace OCR
+
+    Args:
+        page: pymupdf.Page object
+        text_dict: Output of page.get_text("dict") if already extracted
+
+    Returns:
+        dict: chars, garbled_ratio, image_coverage and qualifies
+    """
+    text_dict = text_dict or page.get_text("dict", sort=True)
+    page_area = max(page.rect.width * page.rect.height, 1.0)
+
+    chars = garbled = 0
+    image_area = 0.0
+    for block in text_dict["blocks"]:
+        if block["type"] == 1:
+            image_area += pymupdf.Rect(block["bbox"]).intersect(page.rect).get_area()
+            continue
+        for line in block["lines"]:
+            for span in line["spans"]:
+                text = span["text"]
+                chars += len(text.strip())
+                garbled += sum(is_garbled_char(char) for char in text)
+
+    garbled_ratio = garbled / chars if chars else 0.0
+    image_coverage = min(image_area / page_area, 1.0)
+    qualifies = (
+        page.rotation == 0
+        and chars >= MIN_CHARS
+        and garbled_ratio <= MAX_GARBLED_RATIO
+        and image_coverage < MAX_IMAGE_COVERAGE
+    )
+    return {
+        "chars": chars,
+        "garbled_ratio": round(garbled_ratio, 4),
+        "image_coverage": round(image_coverage, 4),
+        "qualifies": qualifies,
+    }
+
+
+def _block_text(block: dict) -> str:
+    """Join the lines of a text block, undoing end-of-line hyphenation"""
+    text = ""
+    for line in block["lines"]:
+        line_text = "".join(span["text"] for span in line["spans"]).strip()
+        if not line_text:
+            continue
+        if text.endswith("-") and line_text[:1].islower():
+            text = text[:-1] + line_text
+        elif text:
+            text += " " + line_text
+        else:
+            text = line_text
+    return text
+
+
+def _block_font_size(block: dict) -> float:
+    sizes = [span["size"] for line in block["lines"] for span in line["spans"] if span["text"].strip()]
+    return max(sizes) if sizes else 0.0
+
+
+def _table_html(rows: List[List[Optional[str]]]) -> str:
+    """Table cells as the HTML the model emits for "Parse the table in the image." """
+    html_rows = []
+    for row in rows:
+        cells = "".join(f"<td>{escape((cell or '').replace(chr(10), ' ').strip())}</td>" for cell in row)
+        html_rows.append(f"<tr>{cells}</tr>")
+    return "<table>" + "".join(html_rows) + "</table>"
+
+
+def _reading_order(items: List[dict], page_width: float) -> List[dict]:
+    """Order items top to bottom, reading two-column bands column by column
+
+    Full-width items split the page into bands; inside a band the left column is read
+    before the right one.
+    """
+    items = sorted(items, key=lambda item: (item["rect"].y0, item["rect"].x0))
+    ordered, band = [], []
+
+    def _flush():
+        middle = page_width / 2
+        band.sort(key=lambda item: (item["rect"].x0 + item["rect"].x1 >= 2 * middle, item["rect"].y0))
+        ordered.extend(band)
+        band.clear()
+
+    for item in items:
+        if item["rect"].width > page_width * 0.55:
+            _flush()
+            ordered.append(item)
+        else:
+            band.append(item)
+    _flush()
+    return ordered
+
+
+def text_layer_elements(
+    page: pymupdf.Page,
+    target_size: int = 896,
+    save_dir: Optional[str] = None,
+    image_name: Optional[str] = None,
+    text_dict: Optional[dict] = None,
+    save_figure: Callable = save_figure_to_local,
+) -> List[dict]:
+    """Build Dolphin-style elements of a born-digital page from its text layer
+
+    Args:
+        page: pymupdf.Page object
+        target_size: Longest side of the rendered page the bboxes refer to
+        save_dir: Directory to save figure crops (figures are skipped if None)
+        image_name: Name of the page, used for figure files
+        text_dict: Output of page.get_text("dict") if already extracted
+        save_figure: Callable (pil_crop, save_dir, image_name, reading_order) -> figure filename
+
+    Returns:
+        list: Elements with label, bbox, text and reading_order (figures add figure_path)
+    """
+    text_dict = text_dict or page.get_text("dict", sort=True)
+    rect = page.rect
+    scale = target_size / max(rect.width, rect.height)
+
+    items = []
+    table_rects = []
+    for table in page.find_tables().tables:
+        table_rects.append(pymupdf.Rect(table.bbox))
+        items.append({"label": "tab", "rect": table_rects[-1], "text": _table_html(table.extract())})
+
+    text_blocks = [block for block in text_dict["blocks"] if block["type"] == 0 and _block_text(block)]
+    body_sizes = [_block_font_size(block) for block in text_blocks]
+    body_size = median(body_sizes) if body_sizes else 0.0
+
+    for block in text_blocks:
+        block_rect = pymupdf.Rect(block["bbox"])
+        # Text inside a detected table is already part of its cells
+        center = (block_rect.tl + block_rect.br) * 0.5
+        if any(table_rect.contains(center) for table_rect in table_rects):
+            continue
+
+        size_ratio = _block_font_size(block) / body_size if body_size else 1.0
+        if block_rect.y1 <= rect.y0 + rect.height * MARGIN_RATIO:
+            label = "header"
+        elif block_rect.y0 >= rect.y1 - rect.height * MARGIN_RATIO:
+            label = "foot"
+        elif size_ratio >= TITLE_SIZE_RATIO:
+            label = "title"
+        elif size_ratio >= SECTION_SIZE_RATIO:
+            label = "sec"
+        else:
+            label = "para"
+        items.append({"label": label, "rect": block_rect, "text": _block_text(block)})
+
+    if save_dir is not None:
+        for block in text_dict["blocks"]:
+            block_rect = pymupdf.Rect(block["bbox"]) & rect
+            if block["type"] == 1 and min(block_rect.width, block_rect.height) * scale >= MIN_FIGURE_SIDE:
+                items.append({"label": "fig", "rect": block_rect, "text": ""})
+
+    elements = []
+    for reading_order, item in enumerate(_reading_order(items, rect.width)):
+        item_rect = item["rect"]
+        bbox = [int(coord * scale) for coord in (item_rect.x0, item_rect.y0, item_rect.x1, item_rect.y1)]
+        element = {"label": item["label"], "bbox": bbox, "text": item["text"], "reading_order": reading_order}
+        if item["label"] == "fig":
+            pix = page.get_pixmap(
+                matrix=pymupdf.Matrix(scale, scale), clip=item_rect, colorspace=pymupdf.csRGB, alpha=False
+            )
+            crop = Image.frombytes("RGB", (pix.width, pix.height), pix.samples, "raw", "RGB", pix.stride)
+            figure_filename = save_figure(crop, save_dir, image_name, reading_order)
+            element["text"] = f"![Figure](figures/{figure_filename})"
+            element["figure_path"] = f"figures/{figure_filename}"
+        elements.append(element)
+    return elements
+
+
+def extract_text_layer_pages(
+    pdf_path: str,
+    page_indices: Iterable[int],
+    target_size: int = 896,
+    save_dir: Optional[str] = None,
+    base_name: Optional[str] = None,
+    save_figure: Callable = save_figure_to_local,
+) -> Dict[int, List[dict]]:
+    """Elements of every page among page_indices whose text layer qualifies
+
+    Args:
+        pdf_path: Path to PDF file
+        page_indices: 0-based pages to check
+        target_size: Longest side of the rendered pages the bboxes refer to
+        save_dir: Directory to save figure crops
+        base_name: Document name, used for figure files
+        save_figure: Callable (pil_crop, save_dir, image_name, reading_order) -> figure filename
+
+    Returns:
+        dict: page index -> elements, for qualifying pages only
+    """
+    base_name = base_name or os.path.splitext(os.path.basename(pdf_path))[0]
+    pages = {}
+    with pymupdf.open(pdf_path) as doc:
+        for page_idx in page_indices:
+            page = doc[page_idx]
+            try:
+                text_dict = page.get_text("dict", sort=True)
+                if not analyze_text_layer(page, text_dict)["qualifies"]:
+                    continue
+                image_name = f"{base_name}_page_{page_idx + 1:03d}"
+                pages[page_idx] = text_layer_elements(
+                    page, target_size, save_dir, image_name, text_dict, save_figure=save_figure
+                )
+            except Exception as e:
+                print(f"Text layer extraction failed on page {page_idx + 1}, using OCR: {str(e)}")
+    return pages
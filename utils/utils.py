@@ -3,11 +3,11 @@ Copyright (c) 2025 Bytedance Ltd. and/or its affiliates
 SPDX-License-Identifier: MIT
 """
 
-import copy
-import io
+import itertools
 import json
 import os
 import re
+import time
 from dataclasses import dataclass
 from typing import List, Tuple
 
@@ -37,7 +37,7 @@ def save_figure_to_local(pil_crop, save_dir, image_name, reading_order):
         # os.makedirs(figures_dir, exist_ok=True)
 
         # Generate figure filename
-        figure_filename = f"{image_name}_figure_{reading_order:03d}.png"
+        figure_filename = get_figure_filename(image_name, reading_order)
         figure_path = os.path.join(figures_dir, figure_filename)
 
         # Save the figure
@@ -52,37 +52,102 @@ def save_figure_to_local(pil_crop, save_dir, image_name, reading_order):
         return f"{image_name}_figure_{reading_order:03d}_error.png"
 
 
-def convert_pdf_to_images(pdf_path, target_size=896):
-    """Convert PDF pages to images
+def get_figure_filename(image_name, reading_order):
+    """Filename used for a saved figure crop"""
+    return f"{image_name}_figure_{reading_order:03d}.png"
+
+
+def render_pdf_page(page, target_size=896):
+    """Render a PyMuPDF page so that its longest dimension equals target_size
+
+    The image is built directly from the raw pixmap samples, without a PNG encode/decode
+    round trip; the pixels are the same.
 
     Args:
-        pdf_path: Path to PDF file
+        page: pymupdf.Page object
         target_size: Target size for the longest dimension
 
     Returns:
-        List of PIL Images
+        PIL Image (RGB)
     """
-    images = []
-    try:
-        doc = pymupdf.open(pdf_path)
+    # Calculate scale to make longest dimension equal to target_size
+    rect = page.rect
+    scale = target_size / max(rect.width, rect.height)
+
+    # Render page as image
+    mat = pymupdf.Matrix(scale, scale)
+    pix = page.get_pixmap(matrix=mat, colorspace=pymupdf.csRGB, alpha=False)
+
+    # Convert to PIL Image
+    return Image.frombytes("RGB", (pix.width, pix.height), pix.samples, "raw", "RGB", pix.stride)
 
-        for page_num in range(len(doc)):
-            page = doc[page_num]
 
-            # Calculate scale to make longest dimension equal to target_size
-            rect = page.rect
-            scale = target_size / max(rect.width, rect.height)
+def rasterize_pdf_page(pdf_path, page_idx, target_size=896):
+    """Render one PDF page and prepare its padded copy for element cropping
 
-            # Render page as image
-            mat = pymupdf.Matrix(scale, scale)
-            pix = page.get_pixmap(matrix=mat)
+    Self-contained so it can run in a worker process of a rasterization pool.
+
+    Returns:
+        tuple: (page_idx, pil_image, padded_image, image_dimensions)
+    """
+    with pymupdf.open(pdf_path) as doc:
+        pil_image = render_pdf_page(doc[page_idx], target_size)
+    padded_image, dims = prepare_image(pil_image)
+    return page_idx, pil_image, padded_image, dims
+
+
+def timed_call(func, *args):
+    """Call func and return its result together with the elapsed wall time in seconds"""
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
 
-            # Convert to PIL Image
-            img_data = pix.tobytes("png")
-            pil_image = Image.open(io.BytesIO(img_data))
-            images.append(pil_image)
 
-        doc.close()
+def get_pdf_page_count(pdf_path):
+    """Number of pages in a PDF"""
+    with pymupdf.open(pdf_path) as doc:
+        return len(doc)
+
+
+def iter_pdf_images(pdf_path, target_size=896, page_indices=None):
+    """Lazily render PDF pages, one at a time
+
+    Args:
+        pdf_path: Path to PDF file
+        target_size: Target size for the longest dimension
+        page_indices: Optional iterable of 0-based page indices to render (default: all pages)
+
+    Yields:
+        tuple: (page_idx, PIL Image)
+    """
+    with pymupdf.open(pdf_path) as doc:
+        if page_indices is None:
+            page_indices = range(len(doc))
+        for page_idx in page_indices:
+            yield page_idx, render_pdf_page(doc[page_idx], target_size)
+
+
+def batched(iterable, n):
+    """Split an iterable into tuples of up to n items, like itertools.batched (Python 3.12+)"""
+    iterator = iter(iterable)
+    while batch := tuple(itertools.islice(iterator, n)):
+        yield batch
+
+
+def convert_pdf_to_images(pdf_path, target_size=896):
+    """Convert PDF pages to images
+
+    Materializes every page; prefer iter_pdf_images for large documents.
+
+    Args:
+        pdf_path: Path to PDF file
+        target_size: Target size for the longest dimension
+
+    Returns:
+        List of PIL Images
+    """
+    try:
+        images = [image for _, image in iter_pdf_images(pdf_path, target_size)]
         print(f"Successfully converted {len(images)} pages from PDF")
         return images
 
@@ -174,62 +239,122 @@ def check_coord_valid(x1, y1, x2, y2, image_size=None, abs_coord=True):
     return True, None
 
 
-def adjust_box_edges(image, boxes: List[List[float]], max_pixels=15, threshold=0.2):
+@dataclass
+class EdgeMaps:
+    """Transition prefix sums of a binarized page, shared by all boxes refined on it
+
+    vertical[k, x] sums the transitions of column x above row k and horizontal[y, k] the
+    transitions of row y left of column k, so the score of any edge segment is one
+    subtraction. Transitions keep the uint8 wrap-around of np.diff on the binary image:
+    a 0->255 step counts 255 and a 255->0 step counts 1.
     """
-    Image: cv2.image object, or Path
-    Input: boxes: list of boxes [[x1, y1, x2, y2]]. Using absolute coordinates.
+
+    vertical: np.ndarray
+    horizontal: np.ndarray
+
+    @property
+    def shape(self):
+        return self.vertical.shape
+
+
+def compute_edge_maps(image) -> EdgeMaps:
+    """Binarize a page once (inverted Otsu) and build its transition prefix sums
+
+    Args:
+        image: cv2 BGR image, or path to one
+
+    Returns:
+        EdgeMaps: Prefix sums for adjust_box_edges
     """
     if isinstance(image, str):
         image = cv2.imread(image)
-    img_h, img_w = image.shape[:2]
-    new_boxes = []
-    for box in boxes:
-        best_box = copy.deepcopy(box)
-
-        def check_edge(img, current_box, i, is_vertical):
-            edge = current_box[i]
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-
-            if is_vertical:
-                line = binary[current_box[1] : current_box[3] + 1, edge]
-            else:
-                line = binary[edge, current_box[0] : current_box[2] + 1]
-
-            transitions = np.abs(np.diff(line))
-            return np.sum(transitions) / len(transitions)
-
-        # Only widen the box
-        edges = [(0, -1, True), (2, 1, True), (1, -1, False), (3, 1, False)]
-
-        current_box = copy.deepcopy(box)
-        # make sure the box is within the image
-        current_box[0] = min(max(current_box[0], 0), img_w - 1)
-        current_box[1] = min(max(current_box[1], 0), img_h - 1)
-        current_box[2] = min(max(current_box[2], 0), img_w - 1)
-        current_box[3] = min(max(current_box[3], 0), img_h - 1)
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+
+    vertical = np.zeros(binary.shape, dtype=np.int32)
+    np.cumsum(np.diff(binary, axis=0), axis=0, dtype=np.int32, out=vertical[1:])
+    horizontal = np.zeros(binary.shape, dtype=np.int32)
+    np.cumsum(np.diff(binary, axis=1), axis=1, dtype=np.int32, out=horizontal[:, 1:])
+    return EdgeMaps(vertical=vertical, horizontal=horizontal)
+
+
+def _edge_scores(edge_maps: EdgeMaps, boxes: np.ndarray, i: int, positions: np.ndarray) -> np.ndarray:
+    """Mean transition value along edge i of every box, with that edge moved to positions
 
+    Args:
+        edge_maps: Prefix sums of the page
+        boxes: (num_boxes, 4) current boxes
+        i: Index of the edge coordinate (0/2: vertical edges, 1/3: horizontal edges)
+        positions: (num_boxes, num_positions) candidate values of coordinate i
+
+    Returns:
+        (num_boxes, num_positions) scores; NaN where the edge spans a single pixel
+    """
+    if i in (0, 2):
+        start, end = boxes[:, 1:2], boxes[:, 3:4]
+        sums = edge_maps.vertical[end, positions] - edge_maps.vertical[start, positions]
+    else:
+        start, end = boxes[:, 0:1], boxes[:, 2:3]
+        sums = edge_maps.horizontal[positions, end] - edge_maps.horizontal[positions, start]
+    lengths = np.broadcast_to(end - start, sums.shape)
+    scores = np.full(sums.shape, np.nan)
+    np.divide(sums, lengths, out=scores, where=lengths > 0)
+    return scores
+
+
+def adjust_box_edges(image, boxes: List[List[float]], max_pixels=15, threshold=0.2, edge_maps: EdgeMaps = None):
+    """
+    Image: cv2.image object, or Path
+    Input: boxes: list of boxes [[x1, y1, x2, y2]]. Using absolute coordinates.
+
+    Each edge of a box is pushed outwards pixel by pixel while it cuts through ink, keeping the
+    position with the fewest transitions. All boxes of a page are refined together; pass the
+    page's edge_maps (compute_edge_maps) to skip binarizing the image again.
+    """
+    if not boxes:
+        return []
+    if edge_maps is None:
+        edge_maps = compute_edge_maps(image)
+    img_h, img_w = edge_maps.shape
+
+    best_boxes = np.array(boxes, dtype=np.int64)
+    # make sure the box is within the image
+    current_boxes = best_boxes.copy()
+    current_boxes[:, [0, 2]] = np.clip(current_boxes[:, [0, 2]], 0, img_w - 1)
+    current_boxes[:, [1, 3]] = np.clip(current_boxes[:, [1, 3]], 0, img_h - 1)
+
+    rows = np.arange(len(boxes))
+    steps = np.arange(1, max_pixels + 1)
+
+    # Only widen the box
+    edges = [(0, -1, True), (2, 1, True), (1, -1, False), (3, 1, False)]
+
+    with np.errstate(invalid="ignore"):
         for i, direction, is_vertical in edges:
-            best_score = check_edge(image, current_box, i, is_vertical)
-            if best_score <= threshold:
+            start_scores = _edge_scores(edge_maps, current_boxes, i, current_boxes[:, i : i + 1])[:, 0]
+            active = ~(start_scores <= threshold)
+            if max_pixels <= 0 or not active.any():
                 continue
-            for step in range(max_pixels):
-                current_box[i] += direction
-                if i == 0 or i == 2:
-                    current_box[i] = min(max(current_box[i], 0), img_w - 1)
-                else:
-                    current_box[i] = min(max(current_box[i], 0), img_h - 1)
-                score = check_edge(image, current_box, i, is_vertical)
 
-                if score < best_score:
-                    best_score = score
-                    best_box = copy.deepcopy(current_box)
+            limit = img_w - 1 if is_vertical else img_h - 1
+            positions = np.clip(current_boxes[:, i : i + 1] + direction * steps, 0, limit)
+            scores = _edge_scores(edge_maps, current_boxes, i, positions)
+
+            # The walk stops at the first position at or below the threshold
+            below = scores <= threshold
+            last_step = np.where(below.any(1), below.argmax(1), max_pixels - 1)
 
-                if score <= threshold:
-                    break
-        new_boxes.append(best_box)
+            # Best position is the first strict minimum among the positions walked
+            walked = np.arange(max_pixels) <= last_step[:, None]
+            candidates = np.where(walked & ~np.isnan(scores), scores, np.inf)
+            best_step = candidates.argmin(1)
+            improved = active & (candidates[rows, best_step] < start_scores)
 
-    return new_boxes
+            best_boxes[improved] = current_boxes[improved]
+            best_boxes[improved, i] = positions[improved, best_step[improved]]
+            current_boxes[active, i] = positions[active, last_step[active]]
+
+    return best_boxes.tolist()
 
 
 def parse_layout_string(bbox_str):
@@ -308,7 +433,7 @@ def map_to_relevant_coordinates(abs_coords, dims: ImageDimensions):
         return 0.0, 0.0, 1.0, 1.0  # Return full image coordinates
 
 
-def process_coordinates(coords, padded_image, dims: ImageDimensions, previous_box=None):
+def process_coordinates(coords, padded_image, dims: ImageDimensions, previous_box=None, edge_maps=None):
     """Process and adjust coordinates
 
     Args:
@@ -316,6 +441,7 @@ def process_coordinates(coords, padded_image, dims: ImageDimensions, previous_bo
         padded_image: Padded image
         dims: Image dimensions object
         previous_box: Previous box coordinates for overlap adjustment
+        edge_maps: Optional EdgeMaps of padded_image, computed once per page
 
     Returns:
         tuple: (x1, y1, x2, y2, orig_x1, orig_y1, orig_x2, orig_y2, new_previous_box)
@@ -338,7 +464,7 @@ def process_coordinates(coords, padded_image, dims: ImageDimensions, previous_bo
             y2 = min(y1 + 1, dims.padded_h)
 
         # Extend box boundaries
-        new_boxes = adjust_box_edges(padded_image, [[x1, y1, x2, y2]])
+        new_boxes = adjust_box_edges(padded_image, [[x1, y1, x2, y2]], edge_maps=edge_maps)
         x1, y1, x2, y2 = new_boxes[0]
 
         # Ensure coordinates are still within image bounds after adjustment
@@ -378,6 +504,54 @@ def process_coordinates(coords, padded_image, dims: ImageDimensions, previous_bo
         return 0, 0, 100, 100, orig_x1, orig_y1, orig_x2, orig_y2, [0, 0, 100, 100]
 
 
+def crop_layout_elements(layout_results, padded_image, dims: ImageDimensions):
+    """Crop every element of a page layout from the padded page image
+
+    Args:
+        layout_results: Layout string returned by the reading order prompt
+        padded_image: Padded page image (cv2 BGR)
+        dims: Image dimensions object
+
+    Returns:
+        list: One dict per usable element with label, bbox (original coordinates),
+              reading_order and crop (PIL RGB image)
+    """
+    layout_results = parse_layout_string(layout_results)
+
+    elements = []
+    previous_box = None
+    reading_order = 0
+    # Binarize the page once for the edge refinement of all its boxes
+    edge_maps = compute_edge_maps(padded_image) if layout_results else None
+
+    for bbox, label in layout_results:
+        try:
+            # Adjust coordinates
+            x1, y1, x2, y2, orig_x1, orig_y1, orig_x2, orig_y2, previous_box = process_coordinates(
+                bbox, padded_image, dims, previous_box, edge_maps
+            )
+
+            # Crop element, skipping degenerate boxes
+            cropped = padded_image[y1:y2, x1:x2]
+            if cropped.size > 0 and cropped.shape[0] > 3 and cropped.shape[1] > 3:
+                elements.append(
+                    {
+                        "crop": Image.fromarray(cv2.cvtColor(cropped, cv2.COLOR_BGR2RGB)),
+                        "label": label,
+                        "bbox": [orig_x1, orig_y1, orig_x2, orig_y2],
+                        "reading_order": reading_order,
+                    }
+                )
+
+            reading_order += 1
+
+        except Exception as e:
+            print(f"Error processing bbox with label {label}: {str(e)}")
+            continue
+
+    return elements
+
+
 def prepare_image(image) -> Tuple[np.ndarray, ImageDimensions]:
     """Load and prepare image with padding while maintaining aspect ratio
 